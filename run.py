@@ -1,14 +1,41 @@
 import os
 import sys
+import multiprocessing
 import uvicorn
+import yaml
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+
+def run_writer(host: str, port: int):
+    """写入进程：负责导入和持久化，同时也提供查询"""
+    os.environ["RAG_SERVING_ROLE"] = "all"
+    uvicorn.run("src.web.app:app", host=host, port=port)
+
+
 if __name__ == "__main__":
-    uvicorn.run(
-        "src.web.app:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
-    ) 
\ No newline at end of file
+    with open("config.yaml", "r", encoding="utf-8") as f:
+        serving = yaml.safe_load(f).get("serving", {})
+    workers = serving.get("workers", 1)
+
+    if workers <= 1:
+        uvicorn.run(
+            "src.web.app:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True
+        )
+    else:
+        # 一个写入进程加 workers 个只读查询进程：查询进程内存映射同一份索引快照，
+        # 按manifest代数自动刷新，上传等写请求重定向到写入进程
+        writer = multiprocessing.Process(
+            target=run_writer, args=("0.0.0.0", serving.get("writer_port", 8001)), name="rag-writer"
+        )
+        writer.start()
+        os.environ["RAG_SERVING_ROLE"] = "query"
+        try:
+            uvicorn.run("src.web.app:app", host="0.0.0.0", port=8000, workers=workers)
+        finally:
+            writer.terminate()
+            writer.join()
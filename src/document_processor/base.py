@@ -1,20 +1,27 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Union
 import os
 import fitz  # PyMuPDF
 import docx
 import openpyxl
-from pdf2image import convert_from_path
-import pytesseract
 from PIL import Image
 
+from .pdf_engine import PDFPageEngine
+from .ocr import OCRPool
+from .images import EmbeddedImage, ImageFilter
+
 class DocumentProcessor(ABC):
     """文档处理基类"""
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, ocr_pool: Optional[OCRPool] = None):
         self.config = config
         self.supported_formats = config['document_processor']['supported_formats']
-        self.ocr_config = config['document_processor']['ocr']    
+        self.ocr_config = config['document_processor']['ocr']
+        # 识别池由调用方传入时各处理器共享，由调用方负责关闭
+        self._owns_ocr_pool = ocr_pool is None
+        self.ocr_pool = ocr_pool or OCRPool(config)
+        self.image_filter = ImageFilter(config)
+    
     @abstractmethod
     def process(self, file_path: str) -> Dict:
         """处理文档并返回结构化数据"""
@@ -24,8 +31,8 @@ class DocumentProcessor(ABC):
         """提取文档中的文本"""
         pass
     
-    def extract_images(self, file_path: str) -> List[Image.Image]:
-        """提取文档中的图片"""
+    def extract_images(self, file_path: str) -> List[EmbeddedImage]:
+        """提取文档中的嵌入图片，图片在使用时才解码"""
         pass
     
     def extract_tables(self, file_path: str) -> List[Dict]:
@@ -33,43 +40,86 @@ class DocumentProcessor(ABC):
         pass
     
     def perform_ocr(self, image: Image.Image) -> str:
-        """对图片进行OCR识别"""
-        return pytesseract.image_to_string(
-            image,
-            lang=self.ocr_config['language'],
-            config=f'--dpi {self.ocr_config["dpi"]}'
-        )
+        """对图片进行OCR识别，结果按图像哈希缓存"""
+        return self.ocr_pool.recognize(image)["text"]
 
 class PDFProcessor(DocumentProcessor):
-    """PDF文档处理器"""
+    """PDF文档处理器，按页并行处理"""
+    
+    def __init__(self, config: Dict, ocr_pool: Optional[OCRPool] = None):
+        super().__init__(config, ocr_pool)
+        self.engine = PDFPageEngine(config)
     
     def process(self, file_path: str) -> Dict:
+        pages = []
+        images = []
+        page_stats = []
+        ocr_futures = {}
+        for page in self.iter_pages(file_path, image_options=self.image_filter.options()):
+            pages.append(page['text'])
+            page_stats.append({
+                'page': page['page'],
+                'text_coverage': page['text_coverage'],
+                'image_coverage': page['image_coverage'],
+                'ocr': page['needs_ocr']
+            })
+            # 没有可用文本层的页在页面提取的同时送去OCR
+            if page['needs_ocr']:
+                ocr_futures[len(pages) - 1] = self.ocr_pool.submit(page['image'], page['image_hash'])
+            images.extend(page['embedded_images'])
+        
+        # 跨页重复的图片（如每页的logo）只保留一张
+        images = list(self.image_filter.dedup(images))
+        image_pages = [image.page for image in images]
+        
+        for idx, future in ocr_futures.items():
+            ocr = future.result()
+            if len(ocr['text'].strip()) > len(pages[idx].strip()):
+                pages[idx] = ocr['text']
+            page_stats[idx].update(chars=ocr['chars'], latency_ms=ocr['latency_ms'], cached=ocr['cached'])
+        for stats, text in zip(page_stats, pages):
+            stats.setdefault('chars', len(text))
+        
         result = {
-            'text': self.extract_text(file_path),
-            'images': self.extract_images(file_path),
-            'tables': self.extract_tables(file_path)
+            'text': "".join(pages),
+            'pages': pages,
+            'images': images,
+            'image_pages': image_pages,
+            'page_stats': page_stats,
+            # 表格提取逻辑尚未实现
+            'tables': []
         }
         return result
     
+    def iter_pages(self, file_path: str, render: Optional[str] = None,
+                   image_options: Optional[Dict] = None):
+        """逐页产出页文本、渲染结果和嵌入图片"""
+        return self.engine.iter_pages(file_path, render=render, image_options=image_options)
+    
     def extract_text(self, file_path: str) -> str:
-        doc = fitz.open(file_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
+        return "".join(self.process_page_text(page) for page in self.iter_pages(file_path, render="none"))
     
-    def extract_images(self, file_path: str) -> List[Image.Image]:
-        images = convert_from_path(file_path)
-        return images
+    def process_page_text(self, page: Dict) -> str:
+        """页文本，缺少文本层的页使用OCR结果"""
+        if not page['needs_ocr']:
+            return page['text']
+        ocr = self.ocr_pool.submit(page['image'], page['image_hash']).result()
+        return ocr['text'] if len(ocr['text'].strip()) > len(page['text'].strip()) else page['text']
+    
+    def extract_images(self, file_path: str) -> List[EmbeddedImage]:
+        images = []
+        for page in self.iter_pages(file_path, render="none", image_options=self.image_filter.options()):
+            images.extend(page['embedded_images'])
+        return list(self.image_filter.dedup(images))
     
     def extract_tables(self, file_path: str) -> List[Dict]:
-        # 使用PyMuPDF提取表格
-        doc = fitz.open(file_path)
-        tables = []
-        for page in doc:
-            # 这里需要实现表格提取逻辑
-            pass
-        return tables
+        # 这里需要实现表格提取逻辑
+        return []
+    
+    def shutdown(self):
+        self.engine.shutdown(wait=False)
+        if self._owns_ocr_pool:
+            self.ocr_pool.shutdown(wait=False)
 
 class WordProcessor(DocumentProcessor):
     """Word文档处理器"""
@@ -86,9 +136,8 @@ class WordProcessor(DocumentProcessor):
         doc = docx.Document(file_path)
         return "\n".join([paragraph.text for paragraph in doc.paragraphs])
     
-    def extract_images(self, file_path: str) -> List[Image.Image]:
-        # 实现Word文档中的图片提取
-        pass
+    def extract_images(self, file_path: str) -> List[EmbeddedImage]:
+        return list(self.image_filter.dedup(self.image_filter.iter_docx_images(file_path)))
     
     def extract_tables(self, file_path: str) -> List[Dict]:
         doc = docx.Document(file_path)
@@ -101,12 +150,23 @@ class WordProcessor(DocumentProcessor):
         return tables
 
 class ExcelProcessor(DocumentProcessor):
-    """Excel文档处理器"""
+    """Excel文档处理器，以只读模式流式读取工作簿"""
+    
+    def __init__(self, config: Dict, ocr_pool: Optional[OCRPool] = None):
+        super().__init__(config, ocr_pool)
+        excel_config = config['document_processor'].get('excel', {})
+        self.block_rows = excel_config.get('block_rows', 200)
+        self.max_rows = excel_config.get('max_rows', 100000)
+        self.max_columns = excel_config.get('max_columns', 256)
+        self.max_sheets = excel_config.get('max_sheets', 64)
+        self.max_cells = excel_config.get('max_cells', 5000000)
     
     def process(self, file_path: str) -> Dict:
         result = {
             'text': self.extract_text(file_path),
-            'tables': self.extract_tables(file_path)
+            # 行块在建索引时才逐块读取，不会一次性载入整个工作簿
+            'table_blocks': self.iter_row_blocks(file_path),
+            'tables': []
         }
         return result
     
@@ -115,15 +175,62 @@ class ExcelProcessor(DocumentProcessor):
         return ""
     
     def extract_tables(self, file_path: str) -> List[Dict]:
-        wb = openpyxl.load_workbook(file_path)
-        tables = []
-        for sheet in wb.sheetnames:
-            ws = wb[sheet]
-            table_data = []
-            for row in ws.rows:
-                table_data.append([cell.value for cell in row])
-            tables.append({
-                'sheet_name': sheet,
-                'data': table_data
+        tables = {}
+        for block in self.iter_row_blocks(file_path):
+            table = tables.setdefault(block['sheet_name'], {
+                'sheet_name': block['sheet_name'],
+                'data': [block['header']]
             })
-        return tables 
\ No newline at end of file
+            table['data'].extend(block['rows'])
+        return list(tables.values())
+    
+    def iter_row_blocks(self, file_path: str) -> Iterator[Dict]:
+        """逐个工作表按行块产出 {sheet_name, header, rows, row_numbers, start_row}
+
+        跳过空行并去掉行尾的空单元格；超过行数、列数、工作表数或单元格总数
+        上限时提前停止。row_numbers 为每行在工作表中的行号（从1开始）。
+        """
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            cells = 0
+            for sheet_no, sheet in enumerate(wb.sheetnames):
+                if sheet_no >= self.max_sheets or cells >= self.max_cells:
+                    break
+                header = None
+                rows = []
+                row_numbers = []
+                num_rows = 0
+                for row_no, row in enumerate(wb[sheet].iter_rows(values_only=True), start=1):
+                    row = list(row[:self.max_columns])
+                    while row and (row[-1] is None or row[-1] == ""):
+                        row.pop()
+                    if not row:
+                        continue
+                    if header is None:
+                        header = row
+                        continue
+                    if num_rows >= self.max_rows or cells >= self.max_cells:
+                        break
+                    rows.append(row)
+                    row_numbers.append(row_no)
+                    num_rows += 1
+                    cells += len(row)
+                    if len(rows) >= self.block_rows:
+                        yield self._block(sheet, header, rows, row_numbers)
+                        rows = []
+                        row_numbers = []
+                if rows or (header is not None and num_rows == 0):
+                    yield self._block(sheet, header, rows, row_numbers)
+        finally:
+            # 只读模式会保持文件句柄，需要显式关闭
+            wb.close()
+    
+    @staticmethod
+    def _block(sheet: str, header: List, rows: List[List], row_numbers: List[int]) -> Dict:
+        return {
+            'sheet_name': sheet,
+            'header': header,
+            'rows': rows,
+            'row_numbers': row_numbers,
+            'start_row': row_numbers[0] if row_numbers else None
+        }
@@ -0,0 +1,169 @@
+from typing import Dict, Iterable, Iterator, List, Optional
+import hashlib
+import io
+import math
+import zipfile
+
+from PIL import Image
+
+# 感知哈希使用的缩略图边长
+_HASH_SIZE = 8
+
+
+class EmbeddedImage:
+    """文档中嵌入的图片，保存压缩后的原始字节，用到时才解码"""
+
+    def __init__(self, data: bytes, page: int = 0, width: int = 0, height: int = 0,
+                 ext: str = "", name: str = "", content_hash: str = "", phash: int = 0):
+        self.data = data
+        self.page = page
+        self.width = width
+        self.height = height
+        self.ext = ext
+        self.name = name
+        self.content_hash = content_hash
+        self.phash = phash
+
+    def decode(self) -> Image.Image:
+        """解码为RGB图像"""
+        with Image.open(io.BytesIO(self.data)) as image:
+            return image.convert("RGB")
+
+    def to_dict(self) -> Dict:
+        return {
+            "page": self.page,
+            "width": self.width,
+            "height": self.height,
+            "ext": self.ext,
+            "name": self.name,
+            "content_hash": self.content_hash
+        }
+
+
+def image_signature(data: bytes) -> Optional[Dict]:
+    """解码缩略图，计算尺寸、灰度熵和dHash；无法解码时返回None"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            # JPEG可直接按缩小的尺寸解码
+            image.draft("L", (64, 64))
+            thumb = image.convert("L")
+            thumb.thumbnail((64, 64))
+    except Exception:
+        return None
+
+    histogram = thumb.histogram()
+    total = sum(histogram) or 1
+    entropy = -sum(count / total * math.log2(count / total) for count in histogram if count)
+
+    # dHash：比较相邻像素的明暗
+    pixels = list(thumb.resize((_HASH_SIZE + 1, _HASH_SIZE)).getdata())
+    phash = 0
+    for row in range(_HASH_SIZE):
+        for col in range(_HASH_SIZE):
+            left = pixels[row * (_HASH_SIZE + 1) + col]
+            right = pixels[row * (_HASH_SIZE + 1) + col + 1]
+            phash = (phash << 1) | (left > right)
+    return {"width": width, "height": height, "entropy": entropy, "phash": phash}
+
+
+class ImageFilter:
+    """过滤图标和装饰性小图，并按内容哈希和感知哈希去重"""
+
+    def __init__(self, config: Dict):
+        image_config = config['document_processor'].get('images', {})
+        self.min_width = image_config.get('min_width', 64)
+        self.min_height = image_config.get('min_height', 64)
+        self.min_area = image_config.get('min_area', 16384)
+        self.max_aspect_ratio = image_config.get('max_aspect_ratio', 10.0)
+        self.min_entropy = image_config.get('min_entropy', 3.0)
+        # 感知哈希的汉明距离不超过该值视为重复
+        self.phash_distance = image_config.get('phash_distance', 4)
+
+    def options(self) -> Dict:
+        """供工作进程使用的阈值"""
+        return {
+            "min_width": self.min_width,
+            "min_height": self.min_height,
+            "min_area": self.min_area,
+            "max_aspect_ratio": self.max_aspect_ratio,
+            "min_entropy": self.min_entropy
+        }
+
+    def dedup(self, images: Iterable[EmbeddedImage]) -> Iterator[EmbeddedImage]:
+        """去掉内容相同或感知上相同的图片，保留第一次出现的"""
+        seen_hashes = set()
+        seen_phashes = []
+        for image in images:
+            if image.content_hash in seen_hashes:
+                continue
+            if any(bin(image.phash ^ phash).count("1") <= self.phash_distance for phash in seen_phashes):
+                continue
+            seen_hashes.add(image.content_hash)
+            seen_phashes.append(image.phash)
+            yield image
+
+    def iter_docx_images(self, file_path: str) -> Iterator[EmbeddedImage]:
+        """读取DOCX中 word/media 下的图片"""
+        options = self.options()
+        with zipfile.ZipFile(file_path) as archive:
+            for name in sorted(archive.namelist()):
+                if not name.startswith("word/media/"):
+                    continue
+                image = screen_image(archive.read(name), options, name=name,
+                                     ext=name.rsplit(".", 1)[-1].lower())
+                if image is not None:
+                    yield image
+
+
+def passes_size(width: int, height: int, options: Dict) -> bool:
+    if width < options["min_width"] or height < options["min_height"]:
+        return False
+    if width * height < options["min_area"]:
+        return False
+    return max(width, height) / max(min(width, height), 1) <= options["max_aspect_ratio"]
+
+
+def screen_image(data: bytes, options: Dict, page: int = 0, width: int = 0, height: int = 0,
+                 ext: str = "", name: str = "") -> Optional[EmbeddedImage]:
+    """按尺寸和熵筛选一张图片，通过时返回 EmbeddedImage
+
+    已知尺寸时先按尺寸过滤，避免解码明显过小的图片。
+    """
+    if width and height and not passes_size(width, height, options):
+        return None
+    signature = image_signature(data)
+    if signature is None:
+        return None
+    if not passes_size(signature["width"], signature["height"], options):
+        return None
+    if signature["entropy"] < options["min_entropy"]:
+        return None
+    return EmbeddedImage(
+        data, page=page, width=signature["width"], height=signature["height"], ext=ext, name=name,
+        content_hash=hashlib.sha1(data).hexdigest(), phash=signature["phash"]
+    )
+
+
+def extract_pdf_page_images(doc, page, page_no: int, options: Dict,
+                            seen_xrefs: set) -> List[EmbeddedImage]:
+    """按xref提取PDF页中的嵌入图片，同一文档中已处理过的xref不再重复提取"""
+    images = []
+    for info in page.get_images(full=True):
+        xref = info[0]
+        if xref in seen_xrefs:
+            continue
+        seen_xrefs.add(xref)
+        # get_images 返回的宽高可用于在提取字节前过滤
+        if not passes_size(info[2], info[3], options):
+            continue
+        extracted = doc.extract_image(xref)
+        if not extracted:
+            continue
+        image = screen_image(
+            extracted["image"], options, page=page_no, width=extracted["width"],
+            height=extracted["height"], ext=extracted["ext"], name=f"xref-{xref}"
+        )
+        if image is not None:
+            images.append(image)
+    return images
@@ -0,0 +1,101 @@
+from typing import Dict, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import io
+import os
+import subprocess
+import threading
+import time
+
+import pytesseract
+from PIL import Image
+
+from src.vector_store.cache import LRUCache
+
+
+def pixel_hash(mode: str, size: Tuple[int, int], data: bytes) -> str:
+    """页图像的内容哈希（模式、尺寸和像素字节），也是OCR结果缓存的键"""
+    digest = hashlib.sha1(f"{mode}:{tuple(size)}".encode("utf-8"))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def image_hash(image: Image.Image) -> str:
+    """PIL图像的内容哈希，与按渲染结果计算的 pixel_hash 一致"""
+    return pixel_hash(image.mode, image.size, image.tobytes())
+
+
+class OCRPool:
+    """常驻的Tesseract识别池
+
+    每次识别由一个tesseract子进程完成，工作线程只负责调度和等待，
+    因此并发度由线程数决定。识别结果按页图像哈希缓存。各文档处理器
+    共享同一个识别池（见 DocumentProcessor），并发度和缓存都是全局的。
+    """
+
+    def __init__(self, config: Dict):
+        ocr_config = config['document_processor']['ocr']
+        self.language = ocr_config['language']
+        self.dpi = ocr_config['dpi']
+        self.enabled = ocr_config.get('enabled', True)
+        self.workers = ocr_config.get('workers') or os.cpu_count() or 1
+        self._cache = LRUCache.from_config(config, 'ocr', max_size=2048, ttl=None)
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # tesseract默认会再开多线程，多个识别进程并发时限制线程数避免过度订阅；
+        # 只设置在tesseract子进程的环境中，不影响本进程的torch/onnxruntime
+        self.threads = ocr_config.get('threads', 1)
+        self.timeout = ocr_config.get('timeout', 120)
+
+    def submit(self, image: Image.Image, key: Optional[str] = None) -> Future:
+        """提交一张页图像，返回 {text, chars, latency_ms, cached} 的Future；key 须由 pixel_hash 计算"""
+        key = key or image_hash(image)
+        cached = self._cache.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result({"text": cached, "chars": len(cached), "latency_ms": 0.0, "cached": True})
+            return future
+        return self._get_executor().submit(self._recognize, image, key)
+
+    def recognize(self, image: Image.Image) -> Dict:
+        return self.submit(image).result()
+
+    def shutdown(self, wait: bool = True):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def stats(self) -> Dict:
+        return self._cache.stats()
+
+    def _recognize(self, image: Image.Image, key: str) -> Dict:
+        start = time.perf_counter()
+        text = self._run_tesseract(image)
+        latency = (time.perf_counter() - start) * 1000
+        self._cache.put(key, text)
+        return {"text": text, "chars": len(text), "latency_ms": round(latency, 1), "cached": False}
+
+    def _run_tesseract(self, image: Image.Image) -> str:
+        """以PNG经标准输入调用tesseract，子进程使用单独的环境变量"""
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        try:
+            proc = subprocess.run(
+                [pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout",
+                 "-l", self.language, "--dpi", str(self.dpi)],
+                input=buffer.getvalue(), capture_output=True, timeout=self.timeout,
+                env={**os.environ, "OMP_THREAD_LIMIT": str(self.threads)}
+            )
+        except FileNotFoundError:
+            raise pytesseract.TesseractNotFoundError()
+        if proc.returncode:
+            raise pytesseract.TesseractError(proc.returncode, proc.stderr.decode("utf-8", "replace").strip())
+        return proc.stdout.decode("utf-8")
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+            return self._executor
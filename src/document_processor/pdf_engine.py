@@ -0,0 +1,189 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from .images import extract_pdf_page_images
+from .ocr import pixel_hash
+
+# auto：只渲染需要OCR的页；all：渲染所有页；none：不渲染（需要OCR的页除外）
+RENDER_MODES = ("auto", "all", "none")
+
+# 工作进程中缓存的已打开文档：(路径, 修改时间, fitz.Document)
+_worker_doc = None
+
+
+def _open_document(file_path: str):
+    """在工作进程中打开文档，同一文件的后续页段复用已打开的文档"""
+    global _worker_doc
+    stamp = os.stat(file_path).st_mtime_ns
+    if _worker_doc is None or _worker_doc[:2] != (file_path, stamp):
+        if _worker_doc is not None:
+            _worker_doc[2].close()
+        _worker_doc = (file_path, stamp, fitz.open(file_path))
+    return _worker_doc[2]
+
+
+def _process_range(file_path: str, start: int, end: int, options: Dict) -> List[Dict]:
+    """工作进程入口：处理 [start, end) 范围内的页"""
+    # 图片的xref去重只在本页段内进行，跨页段的去重由 iter_pages 完成
+    return list(_iter_page_range(_open_document(file_path), start, end, options, set()))
+
+
+def _iter_page_range(doc, start: int, end: int, options: Dict, seen_xrefs: set) -> Iterator[Dict]:
+    """提取页文本和嵌入图片，检测文本层，并只对需要的页渲染
+
+    文本过少，或图片占据大部分页面而文本层覆盖很小的页判定为需要OCR，
+    按OCR的DPI渲染；render 为 all 时所有页按配置的DPI渲染。渲染结果以
+    (宽, 高, RGB字节) 返回，避免在进程间传递PIL对象。
+    """
+    for page_no in range(start, end):
+        page = doc.load_page(page_no)
+        text = page.get_text()
+        page_area = abs(page.rect) or 1.0
+
+        # 文本层与图片的覆盖率
+        text_area = sum(
+            abs(fitz.Rect(block[:4]) & page.rect)
+            for block in page.get_text("blocks") if block[6] == 0 and block[4].strip()
+        )
+        image_rects = [fitz.Rect(info["bbox"]) & page.rect for info in page.get_image_info()]
+        image_area = sum(abs(rect) for rect in image_rects)
+        text_coverage = min(text_area / page_area, 1.0)
+        image_coverage = min(image_area / page_area, 1.0)
+
+        needs_ocr = options["ocr"] and (
+            len(text.strip()) < options["min_text_chars"]
+            or (image_coverage >= options["ocr_image_coverage"]
+                and text_coverage < options["min_text_coverage"])
+        )
+        has_images = bool(image_rects)
+
+        image = None
+        image_hash = None
+        if needs_ocr or options["render"] == "all":
+            pix = page.get_pixmap(dpi=options["ocr_dpi"] if needs_ocr else options["dpi"], alpha=False)
+            image = (pix.width, pix.height, pix.samples)
+            image_hash = pixel_hash("RGB", (pix.width, pix.height), pix.samples)
+
+        yield {
+            "page": page_no + 1,
+            "text": text,
+            "has_images": has_images,
+            "text_coverage": round(text_coverage, 4),
+            "image_coverage": round(image_coverage, 4),
+            "needs_ocr": needs_ocr,
+            "image": image,
+            "image_hash": image_hash,
+            # 过滤和页段内按xref去重后的嵌入图片
+            "embedded_images": extract_pdf_page_images(
+                doc, page, page_no + 1, options["images"], seen_xrefs
+            ) if options["images"] and has_images else []
+        }
+
+
+class PDFPageEngine:
+    """页级并行的PDF处理引擎
+
+    文档按页段分发到进程池，每个工作进程只打开一次文档并在后续页段中
+    复用；图片按xref直接提取，只有缺少可用文本层的页才会被渲染。结果按
+    页序以生成器逐页产出，同时在途的页段数有上限，内存占用不随页数增长。
+    """
+
+    def __init__(self, config: Dict):
+        pdf_config = config['document_processor'].get('pdf', {})
+        self.workers = pdf_config.get('workers') or os.cpu_count() or 1
+        self.pages_per_task = pdf_config.get('pages_per_task', 8)
+        self.parallel_min_pages = pdf_config.get('parallel_min_pages', 16)
+        self.dpi = pdf_config.get('dpi', 150)
+        self.render = pdf_config.get('render', 'auto')
+        # 文本层检测阈值
+        self.min_text_chars = pdf_config.get('min_text_chars', 50)
+        self.min_text_coverage = pdf_config.get('min_text_coverage', 0.02)
+        self.ocr_image_coverage = pdf_config.get('ocr_image_coverage', 0.5)
+        ocr_config = config['document_processor']['ocr']
+        self.ocr = ocr_config.get('enabled', True)
+        self.ocr_dpi = ocr_config['dpi']
+        # 进程启动方式：服务进程是多线程的，默认不用fork，避免子进程继承被其他线程持有的锁
+        self.start_method = pdf_config.get('start_method', 'spawn')
+        if self.start_method not in multiprocessing.get_all_start_methods():
+            raise ValueError(f"Unsupported start method: {self.start_method}")
+
+        if self.render not in RENDER_MODES:
+            raise ValueError(f"Unsupported render mode: {self.render}")
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def iter_pages(self, file_path: str, render: Optional[str] = None,
+                   image_options: Optional[Dict] = None) -> Iterator[Dict]:
+        """按页序逐页产出页文本、文本层检测结果、渲染的页图像和嵌入图片
+
+        image_options 为 ImageFilter 的阈值，为None时不提取嵌入图片。
+        """
+        options = {
+            "images": image_options,
+            "dpi": self.dpi,
+            "render": render or self.render,
+            "ocr": self.ocr,
+            "ocr_dpi": self.ocr_dpi,
+            "min_text_chars": self.min_text_chars,
+            "min_text_coverage": self.min_text_coverage,
+            "ocr_image_coverage": self.ocr_image_coverage
+        }
+        with fitz.open(file_path) as doc:
+            page_count = doc.page_count
+            # 页数较少时进程间通信的开销大于收益，直接在当前进程处理
+            if self.workers <= 1 or page_count < self.parallel_min_pages:
+                for page in _iter_page_range(doc, 0, page_count, options, set()):
+                    yield self._decode(page)
+                return
+
+        executor = self._get_executor()
+        pending = deque()
+        seen_xrefs = set()
+        for start, end in self._page_ranges(page_count):
+            pending.append(executor.submit(_process_range, file_path, start, end, options))
+            if len(pending) >= self.workers * 2:
+                for page in pending.popleft().result():
+                    yield self._decode(page, seen_xrefs)
+        while pending:
+            for page in pending.popleft().result():
+                yield self._decode(page, seen_xrefs)
+
+    def shutdown(self, wait: bool = True):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        # 页段不超过 pages_per_task，且保证每个工作进程都能分到页段
+        size = max(1, min(self.pages_per_task, -(-page_count // self.workers)))
+        return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method)
+                )
+            return self._executor
+
+    @staticmethod
+    def _decode(page: Dict, seen_xrefs: Optional[set] = None) -> Dict:
+        if seen_xrefs is not None:
+            # 不同页段中出现的同一xref只保留第一次
+            images = [image for image in page["embedded_images"] if image.name not in seen_xrefs]
+            seen_xrefs.update(image.name for image in images)
+            page["embedded_images"] = images
+        if page["image"] is not None:
+            width, height, samples = page["image"]
+            page["image"] = Image.frombytes("RGB", (width, height), samples)
+        return page
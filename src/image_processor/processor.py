@@ -1,31 +1,38 @@
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Optional
 import torch
 from PIL import Image
-# from transformers import Blip2Processor, Blip2ForConditionalGeneration
-import clip
-from lavis.models import load_model_and_preprocess
+
+from src.models.registry import ModelRegistry, default_registry
 
 class ImageProcessor:
-    """图像处理器，支持BLIP2和CLIP模型"""
+    """图像处理器，支持BLIP2和CLIP模型
+
+    模型通过模型注册表在首次处理图片时加载，同一模型在各处理器间共享。
+    """
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, registry: Optional[ModelRegistry] = None):
         self.config = config
         self.device = torch.device(config['image_processor']['device'])
         self.model_name = config['image_processor']['model']
         self.batch_size = config['image_processor']['batch_size']
         self.image_size = config['image_processor']['image_size']
+        self.registry = registry or default_registry
         
-        # 初始化模型
+        # 登记模型，实际加载推迟到首次使用
         if self.model_name == "blip2":
-            self._init_blip2()
+            self.model_key = self.registry.register(
+                f"blip2:pretrain_flant5xl@{self.device}", self._init_blip2, group="vision"
+            )
         elif self.model_name == "clip":
-            self._init_clip()
+            self.model_key = self.registry.register(f"clip:ViT-B/32@{self.device}", self._init_clip, group="vision")
         else:
             raise ValueError(f"Unsupported model: {self.model_name}")
     
     def _init_blip2(self):
         """初始化BLIP2模型"""
-        self.model, self.vis_processors, self.txt_processors = load_model_and_preprocess(
+        from lavis.models import load_model_and_preprocess
+        
+        return load_model_and_preprocess(
             name="blip2_t5",
             model_type="pretrain_flant5xl",
             device=self.device,
@@ -34,26 +41,64 @@ class ImageProcessor:
     
     def _init_clip(self):
         """初始化CLIP模型"""
-        self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)
+        import clip
+        
+        return clip.load("ViT-B/32", device=self.device)
+    
+    @property
+    def model(self):
+        return self.registry.get(self.model_key)[0]
+    
+    @property
+    def vis_processors(self):
+        return self.registry.get(self.model_key)[1]
+    
+    @property
+    def preprocess(self):
+        return self.registry.get(self.model_key)[1]
+    
+    @staticmethod
+    def _decode(image) -> Image.Image:
+        """文档中提取的图片按需解码，已是PIL图像时原样返回"""
+        if isinstance(image, Image.Image):
+            return image
+        return image.decode()
     
     def process_image(self, image: Image.Image) -> Dict:
-        """处理单张图片"""
+        """处理单张图片，结果中的 model 标明特征来自哪个模型"""
+        image = self._decode(image)
         if self.model_name == "blip2":
-            return self._process_blip2(image)
+            result = self._process_blip2(image)
         else:
-            return self._process_clip(image)
+            result = self._process_clip(image)
+        result["model"] = self.model_name
+        return result
     
     def process_batch(self, images: List[Image.Image]) -> List[Dict]:
-        """批量处理图片"""
+        """批量处理图片，每次只解码一个批次"""
         results = []
         for i in range(0, len(images), self.batch_size):
-            batch = images[i:i + self.batch_size]
+            batch = [self._decode(image) for image in images[i:i + self.batch_size]]
             if self.model_name == "blip2":
                 results.extend(self._process_batch_blip2(batch))
             else:
                 results.extend(self._process_batch_clip(batch))
+        for result in results:
+            result["model"] = self.model_name
         return results
     
+    def extract_features(self, image: Image.Image):
+        """只提取单张图片的特征（BLIP2不生成描述），用于以图搜图"""
+        image = self._decode(image)
+        with torch.no_grad():
+            if self.model_name == "blip2":
+                image = self.vis_processors["eval"](image).unsqueeze(0).to(self.device)
+                features = self.model.extract_features({"image": image}).image_embeds[0]
+            else:
+                image = self.preprocess(image).unsqueeze(0).to(self.device)
+                features = self.model.encode_image(image)[0]
+        return features.float().cpu().numpy()
+    
     def _process_blip2(self, image: Image.Image) -> Dict:
         """使用BLIP2处理图片"""
         # 预处理图片
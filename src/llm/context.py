@@ -0,0 +1,324 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import re
+
+from src.models.registry import ModelRegistry, default_registry
+from src.vector_store.cache import normalize_text
+
+# 各模型的默认分词器与上下文窗口；hf 分词器首次使用时通过模型注册表加载
+DEFAULT_TOKENIZERS = {
+    "chatglm3": {"type": "hf", "name": "THUDM/chatglm3-6b"},
+    "qwen": {"type": "hf", "name": "Qwen/Qwen-7B-Chat"},
+    "gpt4": {"type": "tiktoken", "name": "cl100k_base"}
+}
+DEFAULT_CONTEXT_WINDOWS = {"chatglm3": 8192, "qwen": 8000, "gpt4": 8192}
+
+_CJK_RE = re.compile(r'[　-〿一-鿿＀-￯]')
+_WORD_RE = re.compile(r'[0-9A-Za-z]+|[^\s0-9A-Za-z　-〿一-鿿＀-￯]')
+_MARKDOWN_RULE_RE = re.compile(r'^\|(\s*-+\s*\|)+$')
+
+
+def estimate_tokens(text: str) -> int:
+    """分词器不可用时的估计：汉字及全角符号各计一个token，英文单词和数字按每4个字符一个"""
+    cjk = len(_CJK_RE.findall(text))
+    words = sum(max(1, len(word) // 4) for word in _WORD_RE.findall(text))
+    return cjk + words
+
+
+class TokenCounter:
+    """按模型的分词器计数，分词器不可用时退化为估计
+
+    分词器在构造时登记到模型注册表（分组 llm），首次计数或服务预热时加载。
+    需要执行Hub上远程代码的HF分词器（如chatglm3）须在配置中显式设置
+    trust_remote_code，否则加载失败并使用估计。
+    """
+
+    def __init__(self, config: Dict, registry: Optional[ModelRegistry] = None):
+        settings = config['llm'].get('context', {}).get('tokenizers', {})
+        # 按模型合并，只写 trust_remote_code 等个别字段时保留默认的分词器名称
+        self.tokenizers = {
+            model: {**DEFAULT_TOKENIZERS.get(model, {}), **settings.get(model, {})}
+            for model in {**DEFAULT_TOKENIZERS, **settings}
+        }
+        self.registry = registry or default_registry
+        self._unavailable = set()
+        self._keys = {
+            model: self.registry.register(
+                f"tokenizer:{tokenizer['type']}:{tokenizer['name']}",
+                lambda tokenizer=tokenizer: self._load(tokenizer), group="llm"
+            )
+            for model, tokenizer in self.tokenizers.items()
+        }
+
+    def key(self, model: str) -> Optional[str]:
+        """模型分词器在注册表中的名称，用于预热"""
+        return self._keys.get(model)
+
+    def count(self, text: str, model: str) -> int:
+        tokenizer = self._tokenizer(model)
+        if tokenizer is None:
+            return estimate_tokens(text)
+        return len(tokenizer(text))
+
+    def truncate(self, text: str, tokens: int, model: str) -> str:
+        """截断到不超过 tokens 个token"""
+        if self.count(text, model) <= tokens:
+            return text
+        # 二分查找截断位置，分词器不可逆时也适用
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(text[:middle], model) <= tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def _tokenizer(self, model: str) -> Optional[Callable[[str], List]]:
+        key = self._keys.get(model)
+        if key is None or model in self._unavailable:
+            return None
+        try:
+            return self.registry.get(key)
+        except Exception:
+            # 未安装 tiktoken/transformers、无法下载或未允许远程代码时使用估计
+            self._unavailable.add(model)
+            return None
+
+    @staticmethod
+    def _load(settings: Dict) -> Callable[[str], List]:
+        if settings['type'] == "tiktoken":
+            import tiktoken
+            encoding = tiktoken.get_encoding(settings['name'])
+            return encoding.encode
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(
+            settings['name'], trust_remote_code=settings.get('trust_remote_code', False)
+        )
+        return lambda text: tokenizer.encode(text, add_special_tokens=False)
+
+
+def compress_table(text: str) -> str:
+    """压缩表格块：去掉markdown分隔行和多余的竖线与空白，按逗号分隔单元格"""
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if _MARKDOWN_RULE_RE.match(stripped):
+            continue
+        if stripped.startswith("|") and stripped.endswith("|"):
+            cells = [cell.strip().replace("\\|", "|") for cell in re.split(r'(?<!\\)\|', stripped[1:-1])]
+            stripped = ",".join(cells)
+        lines.append(stripped)
+    return "\n".join(lines)
+
+
+def _table_rows(table) -> str:
+    """旧版表格结果（records或columns/rows）以CSV式的紧凑文本渲染，不逐行重复列名"""
+    if isinstance(table, dict):
+        columns = table.get("columns") or []
+        rows = table.get("rows")
+        if rows is None:
+            rows = [[record.get(column) for column in columns] for record in table.get("table", [])]
+    elif isinstance(table, list) and table and isinstance(table[0], dict):
+        columns = list(table[0])
+        rows = [[record.get(column) for column in columns] for record in table]
+    else:
+        return json.dumps(table, ensure_ascii=False, separators=(",", ":"))
+    lines = [",".join(str(column) for column in columns)]
+    lines += [",".join("" if cell is None else str(cell) for cell in row) for row in rows]
+    return "\n".join(lines)
+
+
+class ContextBuilder:
+    """在token预算内组装问答上下文
+
+    检索结果按分数从高到低装入：先取回缺少文本的块，去掉内容重复的块，
+    同一页上相互重叠的文本块拼接为一段，同一表格的多个行块合并并只保留
+    一次表头；表格以紧凑的CSV式文本计数。装不下的块跳过，剩余预算足够时
+    截断最后一块。预算为配置的 max_context_tokens，并且不超过模型上下文
+    窗口减去生成长度和提示词本身。
+    """
+
+    def __init__(self, config: Dict, fetch: Optional[Callable[[List[int]], Dict[int, Dict]]] = None,
+                 registry: Optional[ModelRegistry] = None):
+        llm_config = config['llm']
+        context_config = llm_config.get('context', {})
+        self.model = llm_config['default_model']
+        self.max_tokens = llm_config['max_tokens']
+        self.max_context_tokens = context_config.get('max_context_tokens', 3000)
+        self.context_windows = {**DEFAULT_CONTEXT_WINDOWS, **context_config.get('context_windows', {})}
+        # 截断后少于该token数的块不再放入
+        self.min_chunk_tokens = context_config.get('min_chunk_tokens', 32)
+        self.counter = TokenCounter(config, registry)
+        self.fetch = fetch
+
+    def budget(self, prompt_tokens: int) -> int:
+        window = self.context_windows.get(self.model)
+        budget = self.max_context_tokens
+        if window:
+            budget = min(budget, window - self.max_tokens - prompt_tokens)
+        return max(budget, 0)
+
+    def build(self, hits: List[Dict], prompt_tokens: int = 0) -> Tuple[str, Dict]:
+        """返回 (上下文文本, 统计)，prompt_tokens 为提示词模板和问题占用的token数"""
+        budget = self.budget(prompt_tokens)
+        items = self._merge(self._items(hits))
+
+        used = 0
+        packed = []
+        dropped = 0
+        for item in items:
+            body, footer = self._render(item)
+            tokens = self.counter.count(body + footer, self.model)
+            if used + tokens > budget:
+                # 截断正文，保留来源
+                remaining = budget - used - self.counter.count(footer, self.model)
+                if remaining < self.min_chunk_tokens:
+                    dropped += 1
+                    continue
+                # 省略号占一个token；表格在整行处截断
+                body = self.counter.truncate(body, remaining - 1, self.model)
+                if item["modality"] == "table" and "\n" in body:
+                    body = body[:body.rindex("\n")]
+                body = body.rstrip() + "…\n"
+                tokens = self.counter.count(body + footer, self.model)
+            packed.append(body + footer)
+            used += tokens
+
+        stats = {
+            "budget": budget,
+            "tokens": used,
+            "items": len(packed),
+            "dropped": dropped,
+            "hits": len(hits)
+        }
+        return "".join(packed), stats
+
+    def _items(self, hits: List[Dict]) -> List[Dict]:
+        """统一检索结果的格式：{"score", "text", "metadata"}，缺少文本的按id取回"""
+        missing = [hit["id"] for hit in hits
+                   if "id" in hit and not (hit.get("metadata") or {}).get("text")]
+        fetched = self.fetch(missing) if missing and self.fetch is not None else {}
+
+        items = []
+        seen = set()
+        for rank, hit in enumerate(hits):
+            metadata = hit.get("metadata") or fetched.get(hit.get("id")) or {}
+            if not metadata and "metadata" not in hit:
+                # 直接传入的块（旧格式：text/caption/table在顶层）
+                metadata = hit
+            if "table" in metadata and not metadata.get("text"):
+                text = _table_rows(metadata["table"])
+                modality = "table"
+            elif metadata.get("text"):
+                text = metadata["text"]
+                modality = metadata.get("modality", "text")
+            elif metadata.get("caption"):
+                text = f"[图片描述] {metadata['caption']}"
+                modality = "image"
+            else:
+                continue
+            # 内容完全相同的块（不同文档中的模板段落等）只保留分数最高的一个
+            key = normalize_text(text)
+            if key in seen:
+                continue
+            seen.add(key)
+            items.append({
+                "score": hit.get("score", 0.0),
+                "rank": rank,
+                "text": text,
+                "modality": modality,
+                "metadata": metadata
+            })
+        return items
+
+    def _merge(self, items: List[Dict]) -> List[Dict]:
+        """拼接同一页上重叠的文本块，合并同一表格的行块；合并后的分数取最高者"""
+        merged = []
+        groups = {}
+        for item in items:
+            metadata = item["metadata"]
+            source, page = metadata.get("source", ""), metadata.get("page", 0)
+            if item["modality"] == "table" and metadata.get("table_part") == "rows":
+                key = ("table", source, metadata.get("sheet_name"), metadata.get("table_index"), page)
+            elif item["modality"] == "text" and metadata.get("end") is not None:
+                key = ("text", source, page)
+            else:
+                merged.append(item)
+                continue
+            groups.setdefault(key, []).append(item)
+
+        for key, group in groups.items():
+            if key[0] == "table":
+                merged.append(self._merge_table(group))
+            else:
+                merged.extend(self._merge_text(group))
+        merged.sort(key=lambda item: (-item["score"], item["rank"]))
+        return merged
+
+    @staticmethod
+    def _merge_text(group: List[Dict]) -> List[Dict]:
+        group.sort(key=lambda item: item["metadata"].get("start", 0))
+        spans = []
+        for item in group:
+            start, end = item["metadata"].get("start", 0), item["metadata"]["end"]
+            if spans and start < spans[-1]["end"]:
+                last = spans[-1]
+                if end > last["end"]:
+                    # 按重叠的字符数去掉后一块的开头；文本首尾被裁剪过时退化为查找重叠部分
+                    tail = last["text"][-(last["end"] - start):]
+                    position = item["text"].find(tail.strip()) if tail.strip() else -1
+                    overlap = position + len(tail.strip()) if position >= 0 else 0
+                    last["text"] = last["text"] + ("" if overlap else "\n") + item["text"][overlap:]
+                    last["end"] = end
+                last["score"] = max(last["score"], item["score"])
+                last["rank"] = min(last["rank"], item["rank"])
+                continue
+            spans.append({**item, "end": end})
+        return spans
+
+    @staticmethod
+    def _merge_table(group: List[Dict]) -> Dict:
+        group.sort(key=lambda item: item["metadata"].get("row_start") or 0)
+        first = group[0]
+        lines = compress_table(first["text"]).splitlines()
+        title = lines[0] if lines and lines[0].startswith("[表格内容]") else None
+        body = lines[1:] if title else lines
+        # 行块都以同一表头开头，只保留第一块的表头
+        header = body[0] if body and len(group) > 1 else None
+        rows = list(body)
+        for item in group[1:]:
+            other = compress_table(item["text"]).splitlines()
+            other = other[1:] if other and other[0].startswith("[表格内容]") else other
+            if header is not None and other and other[0] == header:
+                other = other[1:]
+            rows.extend(other)
+        if len(group) > 1 and title:
+            sheet = first["metadata"].get("sheet_name")
+            row_range = f"第{first['metadata'].get('row_start')}-{group[-1]['metadata'].get('row_end')}行"
+            title = f"[表格内容] {sheet + ' ' if sheet else ''}{row_range}"
+        return {
+            **first,
+            "text": "\n".join(([title] if title else []) + rows),
+            "score": max(item["score"] for item in group),
+            "rank": min(item["rank"] for item in group),
+            "compressed": True
+        }
+
+    @staticmethod
+    def _render(item: Dict) -> Tuple[str, str]:
+        """返回 (正文, 来源行)"""
+        text = item["text"]
+        metadata = item["metadata"]
+        if item["modality"] == "table":
+            if not item.get("compressed"):
+                text = compress_table(text)
+            line = f"表格内容：{text.removeprefix('[表格内容] ')}\n"
+        elif item["modality"] == "image":
+            line = f"图片描述：{text.removeprefix('[图片描述] ')}\n"
+        else:
+            line = f"文本内容：{text}\n"
+        source = metadata.get("source", "")
+        if metadata.get("page"):
+            source = f"{source} 第{metadata['page']}页"
+        return line, f"来源：{source}\n---\n"
@@ -0,0 +1,582 @@
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from abc import ABC, abstractmethod
+from collections import deque
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+# 内置提供方：均为OpenAI兼容的对话接口
+DEFAULT_PROVIDERS = {
+    "chatglm3": {
+        "base_url": "https://open.bigmodel.cn/api/paas/v4",
+        "model": "chatglm3",
+        "api_key": "zhipu"
+    },
+    "qwen": {
+        "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+        "model": "qwen-max",
+        "api_key": "qwen"
+    },
+    "gpt4": {
+        "base_url": "https://api.openai.com/v1",
+        "model": "gpt-4",
+        "api_key": "openai"
+    }
+}
+
+
+class LLMError(RuntimeError):
+    """LLM调用失败"""
+
+
+class RetryableError(LLMError):
+    """可重试的失败：超时、连接错误、限流和服务端错误"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(LLMError):
+    """请求的截止时间已到"""
+
+
+class TokenBudget:
+    """按分钟补充的令牌桶，用于请求数和token数限流"""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0 if per_minute else None
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float, deadline: float):
+        """等待直到预算足够，截止时间前无法满足时抛出 DeadlineExceeded"""
+        if self.capacity is None:
+            return
+        # 单次请求超过桶容量时按容量计，避免永远等待
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+                if time.monotonic() + wait > deadline:
+                    raise DeadlineExceeded("Rate limit budget exhausted before the deadline")
+                await asyncio.sleep(wait)
+
+    def refund(self, amount: float):
+        """按实际用量退回多预扣的部分"""
+        if self.capacity is not None and amount > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def level(self) -> Optional[float]:
+        if self.capacity is None:
+            return None
+        self._refill()
+        return round(self.tokens, 1)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class LatencyTracker:
+    """最近若干次调用的耗时，用于计算分位数"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Provider(ABC):
+    """一个LLM提供方：调用接口加上限流、并发上限和统计"""
+
+    def __init__(self, name: str, settings: Dict):
+        self.name = name
+        self.timeout = settings.get('timeout', 30.0)
+        self.max_tokens = settings.get('max_tokens')
+        self._semaphore = asyncio.Semaphore(settings.get('max_concurrency', 16))
+        self.requests = TokenBudget(settings.get('requests_per_minute'))
+        self.tokens = TokenBudget(settings.get('tokens_per_minute'))
+        # 连续失败达到阈值后在冷却时间内跳过该提供方
+        self.failure_threshold = settings.get('failure_threshold', 3)
+        self.cooldown = settings.get('cooldown', 30.0)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+        self.latency = LatencyTracker()
+        self.ttft = LatencyTracker()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedged = 0
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def record(self, ok: bool):
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.cooldown_until = time.monotonic() + self.cooldown
+
+    @abstractmethod
+    async def complete(self, messages: List[Dict], max_tokens: int, temperature: float,
+                       timeout: float) -> Tuple[str, Optional[int]]:
+        """返回 (答案文本, 实际使用的token数)"""
+
+    @abstractmethod
+    def stream(self, messages: List[Dict], max_tokens: int, temperature: float,
+               timeout: float) -> AsyncIterator[str]:
+        """逐段产出答案文本，timeout 为相邻两段之间的最长等待"""
+
+    async def aclose(self):
+        pass
+
+    def stats(self) -> Dict:
+        p50, p95 = self.latency.percentile(0.5), self.latency.percentile(0.95)
+        ttft_p95 = self.ttft.percentile(0.95)
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "available": self.available(),
+            "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "ttft_p95_ms": round(ttft_p95 * 1000, 1) if ttft_p95 is not None else None,
+            "request_budget": self.requests.level(),
+            "token_budget": self.tokens.level()
+        }
+
+
+class OpenAICompatibleProvider(Provider):
+    """OpenAI兼容的对话接口（智谱、通义千问兼容模式、OpenAI），复用连接池"""
+
+    def __init__(self, name: str, settings: Dict, api_key: str):
+        if not api_key:
+            raise ValueError(f"LLM provider {name} has no API key (llm.api_keys.{settings.get('api_key')})")
+        super().__init__(name, settings)
+        self.base_url = settings['base_url'].rstrip("/")
+        self.model = settings['model']
+        self.api_key = api_key
+        self.limits = httpx.Limits(
+            max_connections=settings.get('max_connections', 32),
+            max_keepalive_connections=settings.get('max_keepalive', 16),
+            keepalive_expiry=settings.get('keepalive_expiry', 30.0)
+        )
+        self._client = None
+        self._client_loop = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # 连接池绑定在事件循环上，换了事件循环（如同步调用）时重新创建
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, limits=self.limits,
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+            self._client_loop = loop
+        return self._client
+
+    def _payload(self, messages: List[Dict], max_tokens: int, temperature: float, stream: bool) -> Dict:
+        return {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": self.max_tokens or max_tokens,
+            "temperature": temperature,
+            "stream": stream
+        }
+
+    @staticmethod
+    def _check(response: httpx.Response, body: bytes):
+        if response.status_code < 400:
+            return
+        message = f"HTTP {response.status_code}: {body[:200].decode('utf-8', 'replace')}"
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get("retry-after")
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            raise RetryableError(message, retry_after)
+        raise LLMError(message)
+
+    async def complete(self, messages: List[Dict], max_tokens: int, temperature: float,
+                       timeout: float) -> Tuple[str, Optional[int]]:
+        try:
+            response = await self._get_client().post(
+                "/chat/completions", json=self._payload(messages, max_tokens, temperature, False),
+                timeout=timeout
+            )
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise RetryableError(f"{type(e).__name__}: {e}")
+        self._check(response, response.content)
+        data = response.json()
+        return data["choices"][0]["message"]["content"], (data.get("usage") or {}).get("total_tokens")
+
+    async def stream(self, messages: List[Dict], max_tokens: int, temperature: float,
+                     timeout: float) -> AsyncIterator[str]:
+        try:
+            async with self._get_client().stream(
+                "POST", "/chat/completions", json=self._payload(messages, max_tokens, temperature, True),
+                timeout=timeout
+            ) as response:
+                self._check(response, await response.aread() if response.status_code >= 400 else b"")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        return
+                    choices = json.loads(data).get("choices") or []
+                    text = choices[0].get("delta", {}).get("content") if choices else None
+                    if text:
+                        yield text
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise RetryableError(f"{type(e).__name__}: {e}")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class StubProvider(Provider):
+    """本地模拟的提供方，用于测试和压测
+
+    latency 为完整回答的耗时，ttft 为首段耗时，jitter 为随机抖动比例，
+    error_rate 为返回可重试错误的概率。
+    """
+
+    def __init__(self, name: str, settings: Dict):
+        super().__init__(name, settings)
+        self.latency_seconds = settings.get('latency', 0.5)
+        self.ttft_seconds = settings.get('ttft', 0.1)
+        self.jitter = settings.get('jitter', 0.2)
+        self.error_rate = settings.get('error_rate', 0.0)
+        self.answer = settings.get('answer', "这是来自本地模拟模型的回答。")
+        self.chunk_size = settings.get('chunk_size', 4)
+
+    def _delay(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _maybe_fail(self):
+        if random.random() < self.error_rate:
+            raise RetryableError(f"Stub provider {self.name} failed")
+
+    async def complete(self, messages: List[Dict], max_tokens: int, temperature: float,
+                       timeout: float) -> Tuple[str, Optional[int]]:
+        delay = self._delay(self.latency_seconds)
+        if delay > timeout:
+            await asyncio.sleep(timeout)
+            raise RetryableError(f"Stub provider {self.name} timed out")
+        await asyncio.sleep(delay)
+        self._maybe_fail()
+        return self.answer, len(self.answer)
+
+    async def stream(self, messages: List[Dict], max_tokens: int, temperature: float,
+                     timeout: float) -> AsyncIterator[str]:
+        chunks = [self.answer[i:i + self.chunk_size] for i in range(0, len(self.answer), self.chunk_size)]
+        first = self._delay(self.ttft_seconds)
+        if first > timeout:
+            await asyncio.sleep(timeout)
+            raise RetryableError(f"Stub provider {self.name} timed out")
+        await asyncio.sleep(first)
+        self._maybe_fail()
+        rest = max(self.latency_seconds - self.ttft_seconds, 0.0) / max(len(chunks), 1)
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(self._delay(rest))
+            yield chunk
+
+
+class _OpenStream:
+    """已取得首段的流，结束或关闭时释放提供方的并发名额"""
+
+    def __init__(self, provider: Provider, stream: AsyncIterator[str], start: float):
+        self.provider = provider
+        self._stream = stream
+        self._start = start
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self._stream.__anext__()
+        except StopAsyncIteration:
+            self.provider.latency.add(time.monotonic() - self._start)
+            await self.aclose()
+            raise
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            await self._stream.aclose()
+            self.provider._semaphore.release()
+
+
+class LLMGateway:
+    """多提供方LLM网关
+
+    每个提供方有独立的连接池、并发上限以及请求数/token数预算。一次请求在
+    整体截止时间内按顺序尝试各提供方：可重试的错误在同一提供方内退避重试
+    （剩余时间不够时不再重试），失败后切换到下一个提供方；连续失败的提供方
+    进入冷却。启用对冲时，当前提供方超过其p95耗时（流式为首段耗时）仍未
+    返回，就同时向下一个提供方发出请求，先成功的结果胜出，另一个被取消。
+    """
+
+    def __init__(self, config: Dict):
+        llm_config = config['llm']
+        gateway_config = llm_config.get('gateway', {})
+        api_keys = llm_config.get('api_keys', {})
+        self.max_tokens = llm_config['max_tokens']
+        self.temperature = llm_config['temperature']
+        self.deadline = gateway_config.get('deadline', 60.0)
+        self.max_retries = gateway_config.get('max_retries', 2)
+        self.backoff = gateway_config.get('backoff', 0.5)
+        hedge = gateway_config.get('hedge', {})
+        self.hedge = hedge.get('enabled', False)
+        self.hedge_percentile = hedge.get('percentile', 0.95)
+        self.hedge_min_samples = hedge.get('min_samples', 20)
+        # 样本不足时的对冲等待时间，None表示样本不足时不对冲
+        self.hedge_delay = hedge.get('delay')
+
+        settings = {name: dict(value) for name, value in DEFAULT_PROVIDERS.items()}
+        for name, value in gateway_config.get('providers', {}).items():
+            settings[name] = {**settings.get(name, {}), **value}
+        self.providers = {}
+        for name, value in settings.items():
+            if value.get('type') == "stub":
+                self.providers[name] = StubProvider(name, value)
+            elif api_keys.get(value.get('api_key')) or value.get('type') == "openai":
+                # 显式配置为 openai 类型却没有密钥时在构造时报错，内置提供方没有密钥时跳过
+                self.providers[name] = OpenAICompatibleProvider(name, value, api_keys.get(value.get('api_key')))
+
+        # 回退顺序：默认模型在前，其余按配置顺序；没有密钥的提供方被跳过
+        order = gateway_config.get('order') or list(settings)
+        default = llm_config.get('default_model')
+        if default in order:
+            order = [default] + [name for name in order if name != default]
+        self.order = [name for name in order if name in self.providers]
+        if not self.order:
+            raise ValueError("No LLM provider is configured (missing API keys?)")
+
+    def _messages_tokens(self, messages: List[Dict], max_tokens: int) -> int:
+        # 中文约一字一token，按字符数粗略预估
+        return sum(len(message["content"]) for message in messages) + max_tokens
+
+    def _candidates(self, providers: Optional[List[str]]) -> List[Provider]:
+        names = providers or self.order
+        candidates = [self.providers[name] for name in names if name in self.providers]
+        available = [provider for provider in candidates if provider.available()]
+        # 全部在冷却中时仍按顺序尝试
+        return available or candidates
+
+    def _hedge_after(self, provider: Provider, streaming: bool) -> Optional[float]:
+        if not self.hedge:
+            return None
+        tracker = provider.ttft if streaming else provider.latency
+        if len(tracker) >= self.hedge_min_samples:
+            return tracker.percentile(self.hedge_percentile)
+        return self.hedge_delay
+
+    async def _admit(self, provider: Provider, messages: List[Dict], max_tokens: int, deadline: float) -> int:
+        estimate = self._messages_tokens(messages, max_tokens)
+        await provider.requests.acquire(1, deadline)
+        await provider.tokens.acquire(estimate, deadline)
+        return estimate
+
+    async def _with_retries(self, provider: Provider, attempt, deadline: float):
+        """在截止时间内重试可重试的错误，剩余时间不足一次退避时直接放弃"""
+        for retry in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{provider.name}: deadline exceeded")
+            try:
+                result = await attempt(min(provider.timeout, remaining))
+                provider.record(True)
+                return result
+            except RetryableError as e:
+                provider.record(False)
+                wait = e.retry_after if e.retry_after is not None else self.backoff * 2 ** retry
+                wait *= random.uniform(0.8, 1.2)
+                if retry == self.max_retries or time.monotonic() + wait >= deadline:
+                    raise
+                provider.retries += 1
+                await asyncio.sleep(wait)
+            except LLMError:
+                provider.record(False)
+                raise
+
+    async def _complete_one(self, provider: Provider, messages: List[Dict], max_tokens: int,
+                            temperature: float, deadline: float) -> Dict:
+        async with provider._semaphore:
+            estimate = await self._admit(provider, messages, max_tokens, deadline)
+            provider.calls += 1
+            start = time.monotonic()
+
+            async def attempt(timeout):
+                return await provider.complete(messages, max_tokens, temperature, timeout)
+
+            text, used = await self._with_retries(provider, attempt, deadline)
+            provider.latency.add(time.monotonic() - start)
+            if used is not None:
+                provider.tokens.refund(estimate - used)
+            return {"answer": text, "model": provider.name}
+
+    async def _open_stream(self, provider: Provider, messages: List[Dict], max_tokens: int,
+                           temperature: float, deadline: float) -> Tuple[str, AsyncIterator[str]]:
+        """打开流并取得首段文本；首段之前的失败可以重试，之后不再重试"""
+        await provider._semaphore.acquire()
+        stream = None
+        try:
+            await self._admit(provider, messages, max_tokens, deadline)
+            provider.calls += 1
+            start = time.monotonic()
+
+            async def attempt(timeout):
+                nonlocal stream
+                stream = provider.stream(messages, max_tokens, temperature, timeout)
+                try:
+                    return await stream.__anext__()
+                except StopAsyncIteration:
+                    return ""
+                except BaseException:
+                    await stream.aclose()
+                    raise
+
+            first = await self._with_retries(provider, attempt, deadline)
+            provider.ttft.add(time.monotonic() - start)
+            return first, _OpenStream(provider, stream, start)
+        except BaseException:
+            provider._semaphore.release()
+            raise
+
+    async def _race(self, candidates: List[Provider], start_call, streaming: bool):
+        """按顺序尝试提供方，可选对冲，返回 (提供方, 结果)"""
+        deadline = time.monotonic() + self.deadline
+        pending = {}
+        errors = []
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            provider = candidates[next_index]
+            next_index += 1
+            pending[asyncio.ensure_future(start_call(provider, deadline))] = provider
+            return provider
+
+        current = launch()
+        current_started = time.monotonic()
+        try:
+            while pending:
+                now = time.monotonic()
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"LLM request exceeded {self.deadline}s: {errors}")
+                # 只有一个请求在途且还有后备提供方时才对冲
+                hedge_at = None
+                hedge_after = self._hedge_after(current, streaming)
+                if hedge_after is not None and len(pending) == 1 and next_index < len(candidates):
+                    hedge_at = current_started + hedge_after
+                wait = remaining if hedge_at is None else min(remaining, max(hedge_at - now, 0.0))
+                done, _ = await asyncio.wait(set(pending), timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge_at is not None and time.monotonic() >= hedge_at:
+                        current.hedged += 1
+                        current = launch()
+                        current_started = time.monotonic()
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        return provider, task.result()
+                    errors.append(f"{provider.name}: {task.exception()}")
+                if not pending and next_index < len(candidates):
+                    current = launch()
+                    current_started = time.monotonic()
+            raise LLMError(f"All LLM providers failed: {errors}")
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                try:
+                    result = await task
+                except BaseException:
+                    continue
+                # 对冲中落败但已打开的流需要关闭以释放连接
+                if streaming:
+                    await result[1].aclose()
+
+    async def complete(self, messages: List[Dict], max_tokens: Optional[int] = None,
+                       temperature: Optional[float] = None, providers: Optional[List[str]] = None) -> Dict:
+        """返回 {"answer", "model"}，model 为实际作答的提供方"""
+        max_tokens = max_tokens or self.max_tokens
+        temperature = self.temperature if temperature is None else temperature
+
+        async def start_call(provider, deadline):
+            return await self._complete_one(provider, messages, max_tokens, temperature, deadline)
+
+        _, result = await self._race(self._candidates(providers), start_call, streaming=False)
+        return result
+
+    async def stream(self, messages: List[Dict], max_tokens: Optional[int] = None,
+                     temperature: Optional[float] = None, providers: Optional[List[str]] = None,
+                     info: Optional[Dict] = None) -> AsyncIterator[str]:
+        """流式返回答案；回退和对冲只发生在首段之前，info 中记录实际作答的提供方"""
+        max_tokens = max_tokens or self.max_tokens
+        temperature = self.temperature if temperature is None else temperature
+
+        async def start_call(provider, deadline):
+            return await self._open_stream(provider, messages, max_tokens, temperature, deadline)
+
+        provider, (first, rest) = await self._race(self._candidates(providers), start_call, streaming=True)
+        if info is not None:
+            info["model"] = provider.name
+        try:
+            if first:
+                yield first
+            async for text in rest:
+                yield text
+        finally:
+            await rest.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            "order": self.order,
+            "hedge": self.hedge,
+            "providers": {name: provider.stats() for name, provider in self.providers.items()}
+        }
+
+    async def aclose(self):
+        for provider in self.providers.values():
+            await provider.aclose()
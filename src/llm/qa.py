@@ -1,125 +1,116 @@
-from typing import List, Dict, Optional
-import json
-import zhipuai
-from dashscope import Generation
-import openai
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
+from typing import Callable, List, Dict, Optional, AsyncIterator
+from concurrent.futures import Executor
+import asyncio
+import functools
+
+from src.vector_store.cache import LRUCache, normalize_text, text_key
+from .context import ContextBuilder
+from .gateway import LLMGateway
+
+SYSTEM_PROMPT = "你是一个专业的问答助手，擅长基于给定信息回答问题。"
 
 class LLMQA:
-    """大语言模型问答类，支持多种模型"""
+    """大语言模型问答类，支持多种模型
+
+    请求经 LLMGateway 发出：默认模型优先，失败或超时时自动回退到其他
+    已配置的模型（chatglm3、qwen、gpt4），可选对冲请求。检索结果由
+    ContextBuilder 在token预算内组装为上下文；fetch_metadata 用于取回
+    检索结果中缺少的块文本（通常为 VectorStore.get_metadata）。组装上下文
+    要读元数据和分词，在 executor 中执行（默认为事件循环的默认线程池）。
+    """
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, fetch_metadata: Optional[Callable[[List[int]], Dict[int, Dict]]] = None,
+                 executor: Optional[Executor] = None):
         self.config = config
         self.model_name = config['llm']['default_model']
         self.temperature = config['llm']['temperature']
         self.max_tokens = config['llm']['max_tokens']
+        self.gateway = LLMGateway(config)
+        self.context_builder = ContextBuilder(config, fetch=fetch_metadata)
+        self.executor = executor
         
-        # 初始化API密钥
-        self._init_api_keys()
-        
-        # 初始化模型
-        self._init_model()
+        # 答案缓存：(查询, 上下文哈希, 模型, 温度) -> 答案
+        self._answer_cache = LRUCache.from_config(config, 'answer', max_size=1024, ttl=600)
+    
+    def generate_answer(self, query: str, context: List[Dict]) -> Dict:
+        """生成答案（同步接口，供没有事件循环的调用方使用）"""
+        return asyncio.run(self.agenerate_answer(query, context))
     
-    def _init_api_keys(self):
-        """初始化各模型的API密钥"""
-        api_keys = self.config['llm']['api_keys']
+    async def agenerate_answer(self, query: str, context: List[Dict]) -> Dict:
+        """异步生成答案，返回 {"answer", "model"}，model 为实际作答的模型"""
+        context_text = await self._aprepare_context(query, context)
         
-        # OpenAI
-        if api_keys.get('openai'):
-            openai.api_key = api_keys['openai']
+        cache_key = self._answer_key(query, context_text)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        # 智谱AI
-        if api_keys.get('zhipu'):
-            zhipuai.api_key = api_keys['zhipu']
+        answer = await self.gateway.complete(self._messages(query, context_text))
+        self._cache_answer(cache_key, answer)
+        return answer
+    
+    async def astream_answer(self, query: str, context: List[Dict],
+                             info: Optional[Dict] = None) -> AsyncIterator[str]:
+        """以异步生成器逐段产出答案文本
+
+        命中答案缓存时一次产出完整答案；完整生成后写入答案缓存。info 中
+        记录实际作答的模型。
+        """
+        info = {} if info is None else info
+        context_text = await self._aprepare_context(query, context, info)
         
-        # 通义千问
-        if api_keys.get('qwen'):
-            Generation.set_api_key(api_keys['qwen'])
+        cache_key = self._answer_key(query, context_text)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            info["model"] = cached["model"]
+            yield cached["answer"]
+            return
+        
+        parts = []
+        async for text in self.gateway.stream(self._messages(query, context_text), info=info):
+            parts.append(text)
+            yield text
+        self._cache_answer(cache_key, {"answer": "".join(parts), "model": info.get("model")})
     
-    def _init_model(self):
-        """初始化选定的模型"""
-        if self.model_name == "chatglm3":
-            self.model = self._init_chatglm3()
-        elif self.model_name == "qwen":
-            self.model = self._init_qwen()
-        elif self.model_name == "gpt4":
-            self.model = self._init_gpt4()
-        else:
-            raise ValueError(f"Unsupported model: {self.model_name}")
+    def _cache_answer(self, cache_key: tuple, answer: Dict):
+        """缓存键按默认模型计算，回退或对冲到其他模型作答时不写入缓存"""
+        if answer.get("model") == self.model_name:
+            self._answer_cache.put(cache_key, answer)
     
-    def _init_chatglm3(self):
-        """初始化ChatGLM3模型"""
-        return zhipuai.ZhipuAI()
+    def _messages(self, query: str, context_text: str) -> List[Dict]:
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": self._prompt(query, context_text)}
+        ]
     
-    def _init_qwen(self):
-        """初始化通义千问模型"""
-        return Generation()
+    def cache_stats(self) -> Dict:
+        """返回答案缓存的命中统计和各模型的调用统计"""
+        return {"answer": self._answer_cache.stats(), "llm": self.gateway.stats()}
     
-    def _init_gpt4(self):
-        """初始化GPT-4模型"""
-        return ChatOpenAI(
-            model_name="gpt-4",
-            temperature=self.temperature,
-            max_tokens=self.max_tokens
-        )
+    def _answer_key(self, query: str, context_text: str) -> tuple:
+        """答案缓存键"""
+        return (normalize_text(query), text_key(context_text), self.model_name, self.temperature)
     
-    def generate_answer(self, query: str, context: List[Dict]) -> Dict:
-        """生成答案"""
-        # 准备上下文
-        context_text = self._prepare_context(context)
-        
-        # 根据不同的模型生成答案
-        if self.model_name == "chatglm3":
-            return self._generate_chatglm3(query, context_text)
-        elif self.model_name == "qwen":
-            return self._generate_qwen(query, context_text)
-        else:
-            return self._generate_gpt4(query, context_text)
+    async def _aprepare_context(self, query: str, context: List[Dict], info: Optional[Dict] = None) -> str:
+        """在线程池中组装上下文，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(self._prepare_context, query, context, info)
+        )
     
-    def _prepare_context(self, context: List[Dict]) -> str:
-        """准备上下文文本"""
-        context_text = ""
-        for item in context:
-            if "text" in item:
-                context_text += f"文本内容：{item['text']}\n"
-            if "caption" in item:
-                context_text += f"图片描述：{item['caption']}\n"
-            if "table" in item:
-                context_text += f"表格内容：{json.dumps(item['table'], ensure_ascii=False)}\n"
-            context_text += f"来源：{item.get('source', '')}\n"
-            context_text += "---\n"
+    def _prepare_context(self, query: str, context: List[Dict], info: Optional[Dict] = None) -> str:
+        """在token预算内组装上下文文本，info 中记录装入的块数和token数"""
+        builder = self.context_builder
+        prompt_tokens = builder.counter.count(SYSTEM_PROMPT + self._prompt(query, ""), builder.model)
+        context_text, stats = builder.build(context, prompt_tokens)
+        if info is not None:
+            info["context"] = stats
         return context_text
     
-    def _generate_chatglm3(self, query: str, context: str) -> Dict:
-        """使用ChatGLM3生成答案"""
-        prompt = f"""基于以下参考信息回答问题。如果参考信息不足以回答问题，请说明无法回答。
-
-参考信息：
-{context}
-
-问题：{query}
-
-请给出详细、准确的回答，并标注信息来源。"""
-        
-        response = self.model.chat.completions.create(
-            model="chatglm3",
-            messages=[
-                {"role": "system", "content": "你是一个专业的问答助手，擅长基于给定信息回答问题。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=self.temperature,
-            max_tokens=self.max_tokens
-        )
-        
-        return {
-            "answer": response.choices[0].message.content,
-            "model": "chatglm3"
-        }
-    
-    def _generate_qwen(self, query: str, context: str) -> Dict:
-        """使用通义千问生成答案"""
-        prompt = f"""基于以下参考信息回答问题。如果参考信息不足以回答问题，请说明无法回答。
+    @staticmethod
+    def _prompt(query: str, context: str) -> str:
+        """构造问答提示词"""
+        return f"""基于以下参考信息回答问题。如果参考信息不足以回答问题，请说明无法回答。
 
 参考信息：
 {context}
@@ -127,36 +118,3 @@ class LLMQA:
 问题：{query}
 
 请给出详细、准确的回答，并标注信息来源。"""
-        
-        response = self.model.call(
-            model="qwen-max",
-            prompt=prompt,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens
-        )
-        
-        return {
-            "answer": response.output.text,
-            "model": "qwen"
-        }
-    
-    def _generate_gpt4(self, query: str, context: str) -> Dict:
-        """使用GPT-4生成答案"""
-        messages = [
-            SystemMessage(content="你是一个专业的问答助手，擅长基于给定信息回答问题。"),
-            HumanMessage(content=f"""基于以下参考信息回答问题。如果参考信息不足以回答问题，请说明无法回答。
-
-参考信息：
-{context}
-
-问题：{query}
-
-请给出详细、准确的回答，并标注信息来源。""")
-        ]
-        
-        response = self.model(messages)
-        
-        return {
-            "answer": response.content,
-            "model": "gpt4"
-        } 
\ No newline at end of file
@@ -0,0 +1,165 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import os
+import threading
+import time
+
+# 各模型分组，warmup 配置按分组或模型名选择
+MODEL_GROUPS = ("text", "vision", "table", "llm")
+
+
+def _rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存，无法获取时返回None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _param_bytes(value: Any) -> Optional[int]:
+    """统计PyTorch模型的参数和缓冲区大小，value 可以是包含模型的元组"""
+    values = value if isinstance(value, (tuple, list)) else (value,)
+    total = None
+    for item in values:
+        module = getattr(item, "model", item)
+        if not hasattr(module, "parameters"):
+            continue
+        tensors = list(module.parameters()) + list(getattr(module, "buffers", lambda: [])())
+        total = (total or 0) + sum(t.numel() * t.element_size() for t in tensors)
+    return total
+
+
+class _Entry:
+    def __init__(self, name: str, loader: Callable[[], Any], group: str):
+        self.name = name
+        self.loader = loader
+        self.group = group
+        self.value = None
+        self.loaded = False
+        self.error = None
+        self.load_seconds = None
+        self.rss_delta_bytes = None
+        self.param_bytes = None
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """模型注册表：首次使用时加载，同名模型在各处理器间共享同一个实例
+
+    处理器只登记加载函数，模型在第一次 get 时加载；warmup 在后台线程中
+    预先加载。并发加载按模型加锁，同一模型只加载一次。统计中的内存增量
+    为加载前后进程常驻内存之差，多个模型同时加载时只是近似值。
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._warmup_threads = []
+
+    def register(self, name: str, loader: Callable[[], Any], group: str = "text") -> str:
+        """登记模型；同名模型已登记时保留原有的加载函数和实例"""
+        if group not in MODEL_GROUPS:
+            raise ValueError(f"Unsupported model group: {group}")
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = _Entry(name, loader, group)
+        return name
+
+    def get(self, name: str) -> Any:
+        """取得模型实例，未加载时在当前线程中加载"""
+        entry = self._entry(name)
+        if entry.loaded:
+            return entry.value
+        with entry.lock:
+            if not entry.loaded:
+                rss_before = _rss_bytes()
+                start = time.perf_counter()
+                try:
+                    entry.value = entry.loader()
+                except Exception as e:
+                    entry.error = str(e)
+                    raise
+                entry.load_seconds = round(time.perf_counter() - start, 3)
+                rss_after = _rss_bytes()
+                if rss_before is not None and rss_after is not None:
+                    entry.rss_delta_bytes = rss_after - rss_before
+                entry.param_bytes = _param_bytes(entry.value)
+                entry.error = None
+                entry.loaded = True
+        return entry.value
+
+    def is_loaded(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.loaded
+
+    def unload(self, name: str):
+        """释放模型实例，下次使用时重新加载"""
+        entry = self._entry(name)
+        with entry.lock:
+            entry.value = None
+            entry.loaded = False
+
+    def names(self, selectors: Iterable[str] = ("all",)) -> List[str]:
+        """按模型名或分组选择已登记的模型，"all" 表示全部"""
+        selectors = set(selectors)
+        with self._lock:
+            return [
+                name for name, entry in self._entries.items()
+                if "all" in selectors or name in selectors or entry.group in selectors
+            ]
+
+    def warmup(self, selectors: Iterable[str] = ("all",), background: bool = True) -> List[str]:
+        """预加载选中的模型；background 为 True 时在后台线程中依次加载，加载失败只记录错误"""
+        names = self.names(selectors)
+
+        def load_all():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception:
+                    pass
+
+        if background:
+            thread = threading.Thread(target=load_all, name="model-warmup", daemon=True)
+            thread.start()
+            self._warmup_threads.append(thread)
+        else:
+            load_all()
+        return names
+
+    def stats(self) -> Dict:
+        """每个模型的加载状态、加载耗时和内存占用"""
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            "rss_bytes": _rss_bytes(),
+            "models": [
+                {
+                    "name": entry.name,
+                    "group": entry.group,
+                    "loaded": entry.loaded,
+                    "loading": entry.lock.locked(),
+                    "load_seconds": entry.load_seconds,
+                    "rss_delta_bytes": entry.rss_delta_bytes,
+                    "param_bytes": entry.param_bytes,
+                    "error": entry.error
+                }
+                for entry in entries
+            ]
+        }
+
+    def _entry(self, name: str) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f"Model not registered: {name}")
+        return entry
+
+
+# 进程内共享的默认注册表
+default_registry = ModelRegistry()
@@ -1,96 +1,193 @@
-from typing import List, Dict, Union
+from typing import List, Dict, Tuple, Union, Optional
 import pandas as pd
 import torch
-from transformers import TapasTokenizer, TapasForQuestionAnswering
 import numpy as np
 
+from src.vector_store.cache import LRUCache, text_key
+from src.models.registry import ModelRegistry, default_registry
+
+TAPAS_MODEL = "google/tapas-base-finetuned-wtq"
+
 class TableProcessor:
-    """表格处理器，使用TAPAS模型进行表格问答"""
+    """表格处理器，使用TAPAS模型进行表格问答
+
+    问答按 (表格, 问题) 批量执行：同一表格的多个问题一次编码，编码结果按
+    长度分桶后补齐为批次推理；编码结果和答案按表格内容哈希缓存。
+    """
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, registry: Optional[ModelRegistry] = None):
         self.config = config
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.max_rows = config['table_processor']['max_rows']
         self.max_columns = config['table_processor']['max_columns']
+        self.batch_size = config['table_processor'].get('batch_size', 8)
         
-        # 初始化TAPAS模型
-        self.tokenizer = TapasTokenizer.from_pretrained("google/tapas-base-finetuned-wtq")
-        self.model = TapasForQuestionAnswering.from_pretrained("google/tapas-base-finetuned-wtq")
-        self.model.to(self.device)
-    
-    def process_table(self, table_data: List[List[str]], question: str = None) -> Dict:
-        """处理表格数据，可选进行问答"""
-        # 转换为DataFrame
-        df = pd.DataFrame(table_data[1:], columns=table_data[0])
-        
-        # 如果表格太大，进行截断
-        if len(df) > self.max_rows:
-            df = df.head(self.max_rows)
-        if len(df.columns) > self.max_columns:
-            df = df.iloc[:, :self.max_columns]
-        
-        result = {
-            "table": df.to_dict(orient="records"),
-            "columns": df.columns.tolist(),
-            "shape": df.shape
-        }
+        # TAPAS模型在首次问答时通过模型注册表加载，只做表格转换时不会加载
+        self.registry = registry or default_registry
+        self.model_key = self.registry.register(f"tapas:{TAPAS_MODEL}@{self.device}", self._init_tapas, group="table")
         
-        # 如果提供了问题，进行问答
-        if question:
-            answer = self.answer_question(df, question)
-            result["qa"] = answer
+        # 表格内容哈希 -> 转为字符串的DataFrame；(表格哈希, 问题) -> 编码结果 / 答案
+        self._frame_cache = LRUCache.from_config(config, 'table_frame', max_size=256)
+        self._encoding_cache = LRUCache.from_config(config, 'table_encoding', max_size=2048)
+        self._answer_cache = LRUCache.from_config(config, 'table_answer', max_size=2048, ttl=3600)
+    
+    def _init_tapas(self):
+        """初始化TAPAS模型"""
+        from transformers import TapasTokenizer, TapasForQuestionAnswering
         
-        return result
+        tokenizer = TapasTokenizer.from_pretrained(TAPAS_MODEL)
+        model = TapasForQuestionAnswering.from_pretrained(TAPAS_MODEL)
+        model.to(self.device)
+        model.eval()
+        return tokenizer, model
+    
+    @property
+    def tokenizer(self):
+        return self.registry.get(self.model_key)[0]
+    
+    @property
+    def model(self):
+        return self.registry.get(self.model_key)[1]
+    
+    def process_table(self, table_data: List[List[str]],
+                      question: Union[str, List[str], None] = None) -> Dict:
+        """处理表格数据，可选进行问答（可同时提出多个问题）"""
+        return self.batch_process_tables([table_data], [question])[0]
     
     def answer_question(self, df: pd.DataFrame, question: str) -> Dict:
         """使用TAPAS模型回答关于表格的问题"""
-        # 准备输入
-        inputs = self.tokenizer(
-            table=df,
-            queries=question,
-            return_tensors="pt",
-            truncation=True
-        )
+        return self.answer_questions([(df, question)])[0]
+    
+    def answer_questions(self, items: List[Tuple[pd.DataFrame, str]]) -> List[Dict]:
+        """批量回答 (表格, 问题)，同一表格的问题共享编码"""
+        results = [None] * len(items)
+        pending = {}
+        for i, (df, question) in enumerate(items):
+            table_key = self._frame_key(df)
+            answer = self._answer_cache.get((table_key, question))
+            if answer is not None:
+                results[i] = answer
+            else:
+                pending.setdefault(table_key, (df, {}))[1].setdefault(question, []).append(i)
+        if not pending:
+            return results
         
-        # 将输入移到设备
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        # 编码：每个表格的未缓存问题一次完成
+        encoded = []
+        for table_key, (df, questions) in pending.items():
+            frame = self._prepare_frame(table_key, df)
+            missing = [q for q in questions if self._encoding_cache.get((table_key, q)) is None]
+            if missing:
+                encodings = self.tokenizer(table=frame, queries=missing, truncation=True, padding=False)
+                for j, question in enumerate(missing):
+                    self._encoding_cache.put(
+                        (table_key, question), {name: values[j] for name, values in encodings.items()}
+                    )
+            for question, indices in questions.items():
+                encoded.append((table_key, frame, question, indices,
+                                self._encoding_cache.get((table_key, question))))
         
-        # 获取预测
-        with torch.no_grad():
-            outputs = self.model(**inputs)
+        # 按编码长度分桶，每个批次补齐到批内最大长度
+        encoded.sort(key=lambda item: len(item[4]["input_ids"]))
+        for start in range(0, len(encoded), self.batch_size):
+            batch = encoded[start:start + self.batch_size]
+            answers = self._predict_batch(batch)
+            for (table_key, _, question, indices, _), answer in zip(batch, answers):
+                self._answer_cache.put((table_key, question), answer)
+                for i in indices:
+                    results[i] = answer
+        return results
+    
+    def _predict_batch(self, batch: List) -> List[Dict]:
+        """对一个批次补齐后执行一次前向推理"""
+        inputs = self._pad([encoding for _, _, _, _, encoding in batch])
+        with torch.inference_mode():
+            outputs = self.model(**{k: v.to(self.device) for k, v in inputs.items()})
         
         # 处理预测结果
-        predicted_answer_coordinates, predicted_aggregation_indices = self.model.convert_logits_to_predictions(
-            inputs, outputs.logits, outputs.logits_aggregation
+        predicted_answer_coordinates, predicted_aggregation_indices = self.tokenizer.convert_logits_to_predictions(
+            inputs, outputs.logits.cpu(), outputs.logits_aggregation.cpu()
         )
         
-        # 获取答案
-        answers = []
-        for coordinates in predicted_answer_coordinates:
-            if len(coordinates) == 1:
-                # 单个单元格答案
-                row, col = coordinates[0]
-                answers.append(str(df.iloc[row, col]))
-            else:
-                # 多个单元格答案
-                cell_values = [str(df.iloc[row, col]) for row, col in coordinates]
-                answers.append(", ".join(cell_values))
-        
         # 获取聚合操作
         aggregation_operations = ["NONE", "SUM", "AVERAGE", "COUNT"]
-        aggregation = aggregation_operations[predicted_aggregation_indices[0]]
-        
+        answers = []
+        for (_, frame, _, _, _), coordinates, aggregation in zip(
+            batch, predicted_answer_coordinates, predicted_aggregation_indices
+        ):
+            cell_values = [str(frame.iloc[row, col]) for row, col in coordinates]
+            answers.append({
+                "answer": cell_values[0] if len(cell_values) == 1 else ", ".join(cell_values),
+                "aggregation": aggregation_operations[aggregation],
+                "coordinates": [list(coordinate) for coordinate in coordinates]
+            })
+        return answers
+    
+    def _pad(self, encodings: List[Dict]) -> Dict[str, torch.Tensor]:
+        """补齐到批内最大长度，token_type_ids 为每个token的多维类型"""
+        max_len = max(len(encoding["input_ids"]) for encoding in encodings)
+        type_dims = len(encodings[0]["token_type_ids"][0])
+        input_ids, attention_mask, token_type_ids = [], [], []
+        for encoding in encodings:
+            pad = max_len - len(encoding["input_ids"])
+            input_ids.append(list(encoding["input_ids"]) + [self.tokenizer.pad_token_id] * pad)
+            attention_mask.append(list(encoding["attention_mask"]) + [0] * pad)
+            token_type_ids.append([list(t) for t in encoding["token_type_ids"]] + [[0] * type_dims] * pad)
         return {
-            "answer": answers[0] if len(answers) == 1 else answers,
-            "aggregation": aggregation,
-            "coordinates": predicted_answer_coordinates[0].tolist()
+            "input_ids": torch.tensor(input_ids, dtype=torch.long),
+            "attention_mask": torch.tensor(attention_mask, dtype=torch.long),
+            "token_type_ids": torch.tensor(token_type_ids, dtype=torch.long)
         }
     
-    def batch_process_tables(self, tables: List[List[List[str]]], questions: List[str] = None) -> List[Dict]:
-        """批量处理多个表格"""
+    def _prepare_frame(self, table_key: str, df: pd.DataFrame) -> pd.DataFrame:
+        """TAPAS要求单元格均为字符串"""
+        frame = self._frame_cache.get(table_key)
+        if frame is None:
+            frame = df.fillna("").astype(str)
+            frame.columns = [str(column) for column in frame.columns]
+            self._frame_cache.put(table_key, frame)
+        return frame
+    
+    @staticmethod
+    def _frame_key(df: pd.DataFrame) -> str:
+        """表格内容哈希"""
+        return text_key(list(df.columns), pd.util.hash_pandas_object(df.astype(str), index=False).values.tobytes())
+    
+    def batch_process_tables(self, tables: List[Union[List[List[str]], Dict]],
+                             questions: List[Union[str, List[str], None]] = None) -> List[Dict]:
+        """批量处理多个表格，所有表格的问题合并为批次推理
+
+        表格以列名加数据行的紧凑形式返回，不在每行重复列名；输入为
+        {sheet_name, page, data} 时保留表格位置信息。
+        """
         results = []
+        items = []
+        owners = []
         for i, table in enumerate(tables):
-            question = questions[i] if questions else None
-            result = self.process_table(table, question)
+            table_data = table["data"] if isinstance(table, dict) else table
+            # 先截断再转换，避免复制整个表格
+            rows = [list(row[:self.max_columns]) for row in table_data[1:self.max_rows + 1]]
+            df = pd.DataFrame(rows, columns=list(table_data[0][:self.max_columns]))
+            result = {
+                "columns": df.columns.tolist(),
+                "rows": rows,
+                "shape": df.shape
+            }
+            if isinstance(table, dict):
+                result.update({key: table[key] for key in ("sheet_name", "page") if key in table})
             results.append(result)
-        return results 
\ No newline at end of file
+            
+            question = questions[i] if questions else None
+            if not question:
+                continue
+            for q in [question] if isinstance(question, str) else question:
+                items.append((df, q))
+                owners.append((i, isinstance(question, str)))
+        
+        # 单个问题时 qa 为答案，多个问题时为答案列表
+        for (i, single), answer in zip(owners, self.answer_questions(items) if items else []):
+            if single:
+                results[i]["qa"] = answer
+            else:
+                results[i].setdefault("qa", []).append(answer)
+        return results
@@ -0,0 +1,78 @@
+from typing import Callable, Dict, List
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+
+class QueryBatcher:
+    """查询微批处理器
+
+    收集一个很短的时间窗口内到达的查询（不超过最大批大小），合并为一次
+    编码和一次FAISS检索，再把结果分发给各个调用方。
+    """
+
+    def __init__(self, search_fn: Callable[..., List[List[Dict]]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.search_fn = search_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, query: str, top_k: int, **search_kwargs) -> List[Dict]:
+        """提交一条查询并阻塞等待结果，top_k 和 search_kwargs 都相同的查询才会合并"""
+        future = Future()
+        self._queue.put((query, top_k, search_kwargs, future))
+        return future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+
+            # 在时间窗口内继续收集查询
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._dispatch(batch)
+                    return
+                batch.append(item)
+
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List):
+        """按top_k和检索参数分组执行查询
+
+        混合检索的候选数由top_k决定，不同top_k的查询合并会改变彼此的结果，因此不合并。
+        """
+        groups = {}
+        for item in batch:
+            groups.setdefault((item[1], tuple(sorted(item[2].items()))), []).append(item)
+
+        for (top_k, _), group in groups.items():
+            queries = [query for query, _, _, _ in group]
+            try:
+                results = self.search_fn(queries, top_k, **group[0][2])
+            except Exception as e:
+                for _, _, _, future in group:
+                    future.set_exception(e)
+                continue
+
+            for (_, _, _, future), hits in zip(group, results):
+                future.set_result(hits)
@@ -0,0 +1,99 @@
+from typing import Any, Dict, Hashable, Optional
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+import time
+
+import numpy as np
+
+_MISSING = object()
+
+
+class LRUCache:
+    """线程安全的LRU缓存，支持按容量和TTL淘汰，并统计命中情况"""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_config(cls, config: Dict, name: str, **defaults) -> "LRUCache":
+        """按 config['cache'][name] 创建缓存，cache.enabled 为 False 时容量为0"""
+        cache_config = config.get('cache', {})
+        settings = {**defaults, **cache_config.get(name, {})}
+        if not cache_config.get('enabled', True):
+            settings['max_size'] = 0
+        return cls(max_size=settings.get('max_size', 1024), ttl=settings.get('ttl'))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+def normalize_text(text: str) -> str:
+    """归一化查询文本：去除首尾空白、合并连续空白、统一小写"""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def text_key(*parts: Any) -> str:
+    """对若干字段计算稳定的哈希键"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def embedding_key(embedding: np.ndarray, decimals: int = 4) -> str:
+    """对向量取整后哈希，几乎相同的向量得到同一个键"""
+    rounded = np.round(np.asarray(embedding, dtype=np.float32), decimals) + 0.0
+    return hashlib.sha1(rounded.tobytes()).hexdigest()
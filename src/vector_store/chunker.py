@@ -0,0 +1,270 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import re
+
+# 连续的非空行视为一个段落
+_PARAGRAPH_RE = re.compile(r'[^\n]*\S[^\n]*(?:\n[^\n]*\S[^\n]*)*')
+
+TABLE_FORMATS = ("markdown", "csv")
+
+
+def column_letter(index: int) -> str:
+    """列序号（从1开始）转为Excel列名"""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+class TextChunker:
+    """文档分块器，支持按页、段落或表格行切分"""
+
+    def __init__(self, config: Dict):
+        chunker_config = config.get('chunker', {})
+        self.chunk_size = chunker_config.get('chunk_size', 512)
+        self.chunk_overlap = chunker_config.get('chunk_overlap', 64)
+        self.split_by = chunker_config.get('split_by', 'paragraph')
+        # 表格以紧凑的markdown/CSV渲染，每块若干行并重复表头
+        self.table_format = chunker_config.get('table_format', 'markdown')
+        self.table_rows_per_chunk = chunker_config.get('table_rows_per_chunk', 20)
+
+        if self.split_by not in ("page", "paragraph"):
+            raise ValueError(f"Unsupported split mode: {self.split_by}")
+        if self.table_format not in TABLE_FORMATS:
+            raise ValueError(f"Unsupported table format: {self.table_format}")
+        if not 0 <= self.chunk_overlap < self.chunk_size:
+            raise ValueError("chunk_overlap must be in [0, chunk_size)")
+
+    def split(self, document: Dict) -> Iterator[Dict]:
+        """将文档切分为块，逐个产出带元数据的块
+
+        start/end 为块在所属页（无分页时为整篇文本）中的字符偏移；表格块另有
+        sheet_name、row_start/row_end 和 cell_range 指向原表格中的位置。
+        """
+        source = document.get("source", "")
+        doc_type = document.get("type", "text")
+
+        # 文本：有分页信息时逐页切分
+        if document.get("pages"):
+            for page_no, page_text in enumerate(document["pages"], start=1):
+                yield from self._split_text(page_text, source, doc_type, page_no)
+        elif document.get("text"):
+            yield from self._split_text(
+                document["text"], source, doc_type, document.get("page", 0)
+            )
+
+        # 表格：每个表格一个列结构块，数据按行分组切分
+        tables = list(document.get("tables") or [])
+        if "table" in document:
+            tables.append(document["table"])
+        for table_no, table in enumerate(tables):
+            header, rows, row_numbers, info = self._table_rows(table)
+            info["table_index"] = table_no
+            if header:
+                yield self._schema_chunk(header, len(rows), info, source, doc_type)
+            yield from self._split_rows(header, rows, row_numbers, info, source, doc_type)
+
+        # 流式读取的表格行块（ExcelProcessor），列结构块在工作表读完后产出
+        sheet = None
+        for block in document.get("table_blocks") or ():
+            if sheet is None or block.get("sheet_name") != sheet[0].get("sheet_name"):
+                if sheet is not None and sheet[1]:
+                    yield self._schema_chunk(sheet[1], sheet[2], sheet[0], source, doc_type)
+                info = {"sheet_name": block.get("sheet_name"), "page": block.get("page", 0),
+                        "table_index": 0 if sheet is None else sheet[0]["table_index"] + 1}
+                sheet = [info, block.get("header") or [], 0]
+            rows = block["rows"]
+            row_numbers = block.get("row_numbers") or list(
+                range(block.get("start_row") or 1, (block.get("start_row") or 1) + len(rows))
+            )
+            sheet[2] += len(rows)
+            yield from self._split_rows(sheet[1], rows, row_numbers, sheet[0], source, doc_type)
+        if sheet is not None and sheet[1]:
+            yield self._schema_chunk(sheet[1], sheet[2], sheet[0], source, doc_type)
+
+        # 图片：每条图片描述作为一个块；带图像特征的图片即使没有描述（CLIP）也产出一个块，
+        # 特征放在 features 中，由向量存储写入图像索引。没有描述的图片块标记 image_only，
+        # 只进入图像索引，占位文本不做文本编码；image_hash 为图片内容哈希，图片替换后块随之变化
+        images = list(document.get("images") or [])
+        if "caption" in document:
+            images.append({"caption": document["caption"]})
+        for image_no, image in enumerate(images):
+            if not isinstance(image, dict):
+                continue
+            caption = image.get("caption")
+            page = image.get("page", document.get("page", 0))
+            if caption:
+                text = f"[图片描述] {caption}"
+            elif image.get("features") is not None:
+                text = f"[图片] 第{page}页 图{image_no + 1}" if page else f"[图片] 图{image_no + 1}"
+            else:
+                continue
+            chunk = self._make_chunk(text, source, doc_type, "image", page, 0, len(caption or "")) | {
+                "image_index": image_no
+            }
+            if image.get("content_hash"):
+                chunk["image_hash"] = image["content_hash"]
+            if image.get("features") is not None:
+                chunk["features"] = image["features"]
+                chunk["image_model"] = image.get("model")
+                if not caption:
+                    chunk["image_only"] = True
+            yield chunk
+
+    def _split_text(self, text: str, source: str, doc_type: str, page: int) -> Iterator[Dict]:
+        """切分一段文本"""
+        if self.split_by == "page":
+            spans = [(0, len(text))] if text.strip() else []
+        else:
+            spans = [m.span() for m in _PARAGRAPH_RE.finditer(text)]
+
+        for start, end in self._pack(spans):
+            chunk_text = text[start:end].strip()
+            if chunk_text:
+                yield self._make_chunk(chunk_text, source, doc_type, "text", page, start, end)
+
+    def _split_rows(self, header: List, rows: List[List], row_numbers: List[int], info: Dict,
+                    source: str, doc_type: str) -> Iterator[Dict]:
+        """按行分组切分表格数据，每块不超过 table_rows_per_chunk 行和 chunk_size 字符，并重复表头"""
+        header_text = self._render_rows([header], with_header=True) if header else ""
+        group = []
+        size = 0
+        for row, row_no in zip(rows, row_numbers):
+            line = self._render_rows([row])
+            if group and (len(group) >= self.table_rows_per_chunk
+                          or size + len(line) + 1 > self.chunk_size):
+                yield self._row_chunk(header, header_text, group, info, source, doc_type)
+                group = []
+                size = len(header_text)
+            if not group:
+                size = len(header_text)
+            group.append((row_no, row, line))
+            size += len(line) + 1
+        if group:
+            yield self._row_chunk(header, header_text, group, info, source, doc_type)
+
+    def _row_chunk(self, header: List, header_text: str, group: List, info: Dict,
+                   source: str, doc_type: str) -> Dict:
+        row_start, row_end = group[0][0], group[-1][0]
+        width = max([len(header)] + [len(row) for _, row, _ in group])
+        title = f"第{row_start}-{row_end}行"
+        if info.get("sheet_name"):
+            title = f"{info['sheet_name']} {title}"
+        body = "\n".join(filter(None, [header_text] + [line for _, _, line in group]))
+        text = f"[表格内容] {title}\n{body}"
+        chunk = self._make_chunk(text, source, doc_type, "table", info.get("page", 0), 0, len(body))
+        chunk.update(
+            sheet_name=info.get("sheet_name"),
+            table_index=info.get("table_index"),
+            table_part="rows",
+            row_start=row_start,
+            row_end=row_end,
+            cell_range=f"A{row_start}:{column_letter(max(width, 1))}{row_end}"
+        )
+        return chunk
+
+    def _schema_chunk(self, header: List, num_rows: int, info: Dict, source: str, doc_type: str) -> Dict:
+        """表格的列结构块：表名、列名和行数"""
+        columns = ", ".join(self._cell(cell) for cell in header)
+        title = f"工作表 {info['sheet_name']}" if info.get("sheet_name") else "表格"
+        text = f"[表格结构] {title}；列：{columns}；共{num_rows}行"
+        chunk = self._make_chunk(text, source, doc_type, "table", info.get("page", 0), 0, len(columns))
+        chunk.update(
+            sheet_name=info.get("sheet_name"),
+            table_index=info.get("table_index"),
+            table_part="schema",
+            columns=[self._cell(cell) for cell in header],
+            num_rows=num_rows
+        )
+        return chunk
+
+    def _render_rows(self, rows: List[List], with_header: bool = False) -> str:
+        """以markdown或CSV渲染若干行，with_header 时附加markdown分隔行"""
+        if self.table_format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator="\n").writerows(
+                [[self._cell(cell) for cell in row] for row in rows]
+            )
+            return buffer.getvalue().rstrip("\n")
+        lines = ["| " + " | ".join(self._cell(cell).replace("|", "\\|") for cell in row) + " |"
+                 for row in rows]
+        if with_header:
+            lines.append("|" + " --- |" * len(rows[-1]))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _cell(cell) -> str:
+        if cell is None:
+            return ""
+        return str(cell).replace("\r", " ").replace("\n", " ").strip()
+
+    def _pack(self, spans: List[Tuple[int, int]]) -> Iterator[Tuple[int, int]]:
+        """将相邻片段合并为不超过chunk_size的块，块之间保留chunk_overlap重叠"""
+        start = end = None
+        for span_start, span_end in spans:
+            # 超长片段按滑动窗口切分
+            if span_end - span_start > self.chunk_size:
+                if start is not None:
+                    yield start, end
+                    start = None
+                yield from self._window(span_start, span_end)
+                continue
+
+            if start is None:
+                start, end = span_start, span_end
+            elif span_end - start <= self.chunk_size:
+                end = span_end
+            else:
+                yield start, end
+                start = max(end - self.chunk_overlap, span_end - self.chunk_size, start)
+                end = span_end
+
+        if start is not None:
+            yield start, end
+
+    def _window(self, start: int, end: int) -> Iterator[Tuple[int, int]]:
+        """滑动窗口切分"""
+        step = self.chunk_size - self.chunk_overlap
+        for pos in range(start, end, step):
+            yield pos, min(pos + self.chunk_size, end)
+            if pos + self.chunk_size >= end:
+                break
+
+    @staticmethod
+    def _table_rows(table) -> Tuple[List, List[List], List[int], Dict]:
+        """将不同来源的表格统一为 (表头, 数据行, 行号, 表格信息)，首行为表头、行号从2开始"""
+        info = {}
+        if isinstance(table, dict):
+            info = {"sheet_name": table.get("sheet_name"), "page": table.get("page", 0)}
+            if "data" in table:
+                # ExcelProcessor / WordProcessor 的输出
+                rows = table["data"]
+            elif "rows" in table:
+                # TableProcessor.process_table 的输出
+                rows = [table.get("columns") or []] + table["rows"]
+            elif "table" in table:
+                # 旧版 TableProcessor 输出的records
+                columns = table.get("columns") or []
+                rows = [columns] + [[record.get(col) for col in columns] for record in table["table"]]
+            else:
+                rows = []
+        else:
+            rows = table or []
+        if not rows:
+            return [], [], [], info
+        return list(rows[0]), rows[1:], list(range(2, len(rows) + 1)), info
+
+    @staticmethod
+    def _make_chunk(text: str, source: str, doc_type: str, modality: str,
+                    page: int, start: int, end: int) -> Dict:
+        return {
+            "text": text,
+            "source": source,
+            "type": doc_type,
+            "modality": modality,
+            "page": page,
+            "start": start,
+            "end": end
+        }
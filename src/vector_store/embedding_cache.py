@@ -0,0 +1,225 @@
+from typing import Dict, List, Optional, Sequence
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# SQLite单条语句的参数个数上限（旧版本为999）
+_MAX_PARAMS = 500
+
+
+def content_key(text: str) -> bytes:
+    """块文本的内容哈希：只合并空白，不改变大小写，保证命中时向量与重新编码一致"""
+    return hashlib.sha1(re.sub(r"\s+", " ", text).strip().encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """磁盘上按内容寻址的文档块向量缓存，可被多个导入进程共享
+
+    每个编码器（模型名和后端）一个目录：向量以float16存放在按槽位寻址的
+    内存映射文件中，SQLite记录 内容哈希 -> 槽位 以及最近使用时间。条目数
+    超过 max_entries 时淘汰最久未使用的条目并复用其槽位。
+
+    写入分两步：先在事务中分配槽位（条目标记为未就绪），再写向量，最后
+    标记就绪；读取向量后再次核对条目仍指向原槽位，因此与其他进程的淘汰
+    和写入并发时不会读到被覆盖的向量。
+    """
+
+    def __init__(self, path: str, model_id: str, dimension: int, max_entries: int = 500000,
+                 touch_interval: float = 60.0):
+        self.model_id = model_id
+        self.dimension = dimension
+        self.max_entries = max_entries
+        # 命中时最近使用时间的更新粒度，减少写事务
+        self.touch_interval = touch_interval
+        self.directory = os.path.join(path, re.sub(r"[^0-9A-Za-z_.-]+", "__", model_id))
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors_path = os.path.join(self.directory, f"vectors-{dimension}.f16")
+
+        self._conn = sqlite3.connect(
+            os.path.join(self.directory, "index.db"), timeout=30, check_same_thread=False,
+            isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key BLOB PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, used REAL NOT NULL, "
+            "ready INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._lock = threading.Lock()
+        self._vectors = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config: Dict, model_id: str, dimension: int) -> Optional["EmbeddingCache"]:
+        """按 vector_store.embedding_cache 创建缓存；未配置路径且没有 persist_dir 时返回None"""
+        cache_config = config['vector_store'].get('embedding_cache', {})
+        if not cache_config.get('enabled', True) or not config.get('cache', {}).get('enabled', True):
+            return None
+        path = cache_config.get('path')
+        if path is None and config['vector_store'].get('persist_dir'):
+            path = os.path.join(config['vector_store']['persist_dir'], "embedding_cache")
+        if path is None:
+            return None
+        return cls(
+            path, model_id, dimension,
+            max_entries=cache_config.get('max_entries', 500000),
+            touch_interval=cache_config.get('touch_interval', 60.0)
+        )
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """按内容哈希批量读取向量（float32），未命中的位置为None"""
+        results = [None] * len(keys)
+        if not keys:
+            return results
+        with self._lock:
+            slots = self._lookup(keys)
+            if slots:
+                vectors = self._map(max(slots.values()) + 1)
+                found = {key: np.asarray(vectors[slot], dtype=np.float32) for key, slot in slots.items()}
+                # 读取期间条目可能已被其他进程淘汰并覆盖，只保留仍指向原槽位的
+                current = self._lookup(list(found))
+                found = {key: vector for key, vector in found.items() if current.get(key) == slots[key]}
+                self._touch(list(found))
+            else:
+                found = {}
+        for i, key in enumerate(keys):
+            results[i] = found.get(key)
+        hits = sum(vector is not None for vector in results)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return results
+
+    def put_many(self, keys: Sequence[bytes], vectors: np.ndarray):
+        """写入一批向量，已存在的键跳过；超出容量时按最近使用时间淘汰"""
+        items = dict(zip(keys, vectors))
+        if not items:
+            return
+        with self._lock:
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self._lookup(list(items), ready_only=False)
+                keys = [key for key in items if key not in existing]
+                slots = self._allocate(len(keys), now)
+                # 容量小于单批数量时，多出的部分不缓存
+                keys = keys[:len(slots)]
+                self._conn.executemany(
+                    "INSERT INTO entries (key, slot, used, ready) VALUES (?, ?, ?, 0)",
+                    [(key, slot, now) for key, slot in zip(keys, slots)]
+                )
+                # 扩容在写事务中进行，多个进程不会同时修改文件大小
+                vectors = self._map(max(slots) + 1) if slots else None
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if not keys:
+                return
+
+            vectors[slots] = np.stack([items[key] for key in keys]).astype(np.float16)
+            vectors.flush()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE entries SET ready = 1 WHERE key = ? AND slot = ?", list(zip(keys, slots))
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM entries WHERE ready = 1").fetchone()[0]
+        return {
+            "model": self.model_id,
+            "size": size,
+            "max_size": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions
+        }
+
+    def close(self):
+        with self._lock:
+            self._vectors = None
+            self._conn.close()
+
+    def _lookup(self, keys: Sequence[bytes], ready_only: bool = True) -> Dict[bytes, int]:
+        condition = " AND ready = 1" if ready_only else ""
+        slots = {}
+        for start in range(0, len(keys), _MAX_PARAMS):
+            batch = keys[start:start + _MAX_PARAMS]
+            rows = self._conn.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))}){condition}",
+                batch
+            )
+            slots.update(rows)
+        return slots
+
+    def _touch(self, keys: List[bytes]):
+        """更新命中条目的最近使用时间；写冲突时放弃，不影响读取"""
+        if not keys:
+            return
+        now = time.time()
+        try:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                batch = keys[start:start + _MAX_PARAMS]
+                self._conn.execute(
+                    f"UPDATE entries SET used = ? WHERE key IN ({','.join('?' * len(batch))}) AND used < ?",
+                    [now, *batch, now - self.touch_interval]
+                )
+        except sqlite3.OperationalError:
+            pass
+
+    def _allocate(self, count: int, now: float) -> List[int]:
+        """在写事务中分配槽位：先用未分配的槽位，不足时淘汰最久未使用的条目"""
+        if count <= 0:
+            return []
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'next_slot'").fetchone()
+        next_slot = row[0] if row else 0
+        fresh = list(range(next_slot, min(next_slot + count, self.max_entries)))
+        if fresh:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('next_slot', ?)", (fresh[-1] + 1,)
+            )
+        needed = count - len(fresh)
+        if not needed:
+            return fresh
+        # 未就绪的条目可能正由其他进程写入，超时后才视为崩溃遗留并回收
+        evicted = self._conn.execute(
+            "SELECT key, slot FROM entries WHERE ready = 1 OR used < ? ORDER BY used LIMIT ?",
+            (now - 300, needed)
+        ).fetchall()
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+        self.evictions += len(evicted)
+        return fresh + [slot for _, slot in evicted]
+
+    def _map(self, rows: int) -> np.memmap:
+        """映射向量文件，文件不足 rows 个槽位时按块扩容"""
+        if self._vectors is not None and self._vectors.shape[0] >= rows:
+            return self._vectors
+        row_bytes = self.dimension * 2
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        if size < rows * row_bytes:
+            capacity = min(max(rows, size // row_bytes * 2, 1024), self.max_entries)
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+            size = os.path.getsize(self._vectors_path)
+        self._vectors = np.memmap(
+            self._vectors_path, dtype=np.float16, mode="r+", shape=(size // row_bytes, self.dimension)
+        )
+        return self._vectors
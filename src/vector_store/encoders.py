@@ -0,0 +1,316 @@
+from typing import Dict, List, Optional, Sequence
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+ENCODER_BACKENDS = ("torch", "onnx")
+
+
+class TorchEncoder:
+    """PyTorch fp32 编码器（SentenceTransformer），作为基准
+
+    torch 的线程数是进程级的，由 serving.torch_threads 统一设置（见 set_torch_threads），
+    不随单个模型配置。
+    """
+
+    def __init__(self, model_name: str, device: str = "cpu"):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.backend = "torch"
+        self.model = SentenceTransformer(model_name, device=device)
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64, convert_to_numpy: bool = True,
+               **kwargs) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=convert_to_numpy, **kwargs)
+
+
+class ONNXEncoder:
+    """ONNX Runtime 编码器，可选动态int8量化
+
+    首次使用时把HuggingFace模型导出为ONNX并量化，结果缓存在 onnx_dir 中。
+    池化方式与归一化需与原模型一致（BGE为CLS池化加L2归一化）。
+    """
+
+    def __init__(self, model_name: str, onnx_dir: str, quantize: bool = True,
+                 threads: Optional[int] = None, pooling: str = "cls", normalize: bool = True,
+                 max_length: int = 512):
+        import onnxruntime as ort
+        from transformers import AutoModel, AutoTokenizer
+
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"Unsupported pooling: {pooling}")
+        self.model_name = model_name
+        self.backend = "onnx-int8" if quantize else "onnx"
+        self.pooling = pooling
+        self.normalize = normalize
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        model_path = export_onnx(model_name, onnx_dir, quantize, AutoModel, (["导出"],),
+                                 {"last_hidden_state": {0: "batch", 1: "sequence"}})
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {item.name for item in self.session.get_inputs()}
+        self._dimension = None
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self.encode(["dimension"]).shape[1]
+        return self._dimension
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64, convert_to_numpy: bool = True,
+               **kwargs) -> np.ndarray:
+        texts = list(texts)
+        outputs = []
+        # 按长度排序后分批，减少补齐
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+            inputs = self.tokenizer(batch, padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            feeds = {name: value.astype(np.int64) for name, value in inputs.items() if name in self._input_names}
+            hidden = self.session.run(None, feeds)[0]
+            if self.pooling == "cls":
+                embeddings = hidden[:, 0]
+            else:
+                mask = inputs["attention_mask"][..., None].astype(np.float32)
+                embeddings = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            outputs.append(embeddings)
+
+        if not outputs:
+            return np.zeros((0, self._dimension or 0), dtype=np.float32)
+        embeddings = np.empty((len(texts), outputs[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(outputs)
+        if self.normalize:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+
+def onnx_model_dir(onnx_dir: str, model_name: str) -> str:
+    """导出的ONNX模型及其对照报告所在的目录"""
+    return os.path.join(onnx_dir, model_name.replace("/", "__"))
+
+
+def export_onnx(model_name: str, onnx_dir: str, quantize: bool, model_cls, sample_inputs: Sequence,
+                output_names: Dict[str, Dict[int, str]]) -> str:
+    """导出ONNX模型（以及动态int8量化模型），已存在时直接复用，返回要加载的模型路径
+
+    model_cls 为 transformers 的模型类（如 AutoModel），sample_inputs 为导出时传给分词器的
+    位置参数，output_names 为 输出名 -> 动态维度。
+    """
+    model_dir = onnx_model_dir(onnx_dir, model_name)
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    int8_path = os.path.join(model_dir, "model-int8.onnx")
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoTokenizer
+
+        os.makedirs(model_dir, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = model_cls.from_pretrained(model_name).eval()
+        sample = tokenizer(*sample_inputs, return_tensors="pt")
+        names = list(sample.keys())
+        tmp_path = fp32_path + ".tmp"
+        with torch.inference_mode():
+            torch.onnx.export(
+                model, tuple(sample[name] for name in names), tmp_path,
+                input_names=names, output_names=list(output_names),
+                dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in names}, **output_names},
+                opset_version=14
+            )
+        os.replace(tmp_path, fp32_path)
+    if not quantize:
+        return fp32_path
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp_path = int8_path + ".tmp"
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+def set_torch_threads(config: Dict):
+    """按 serving.torch_threads 设置 torch 的进程级线程数，未配置时保持默认；只在服务启动时调用一次"""
+    threads = config.get('serving', {}).get('torch_threads')
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def encoder_id(config: Dict, **overrides) -> str:
+    """编码器标识（模型名:后端），不加载模型，用于共享模型和按模型区分缓存"""
+    encoder_config = {**config['vector_store'].get('encoder', {}), **overrides}
+    backend = encoder_config.get('backend', 'torch')
+    if backend == "onnx" and encoder_config.get('quantize', True):
+        backend = "onnx-int8"
+    return f"{encoder_config.get('model', 'BAAI/bge-large-zh')}:{backend}"
+
+
+def create_encoder(config: Dict, **overrides):
+    """按 vector_store.encoder 配置创建编码器
+
+    backend 为 torch（fp32基准）或 onnx（quantize 为 True 时使用动态int8量化）；
+    model 可换成更小的蒸馏模型，此时 vector_store.dimension 需与之一致。
+    """
+    encoder_config = {**config['vector_store'].get('encoder', {}), **overrides}
+    backend = encoder_config.get('backend', 'torch')
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unsupported encoder backend: {backend}")
+    model_name = encoder_config.get('model', 'BAAI/bge-large-zh')
+    if backend == "torch":
+        return TorchEncoder(model_name, device=encoder_config.get('device', 'cpu'))
+    return ONNXEncoder(
+        model_name,
+        onnx_dir=encoder_config.get('onnx_dir', 'models/onnx'),
+        quantize=encoder_config.get('quantize', True),
+        threads=encoder_config.get('threads'),
+        pooling=encoder_config.get('pooling', 'cls'),
+        normalize=encoder_config.get('normalize', True),
+        max_length=encoder_config.get('max_length', 512)
+    )
+
+
+def _top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    k = min(k, corpus.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def parity_check(reference, candidate, queries: List[str], corpus: List[str], k: int = 10,
+                 relevant: Optional[List[List[int]]] = None, batch_size: int = 64) -> Dict:
+    """比较候选编码器与fp32基准的检索一致性和速度
+
+    relevant 为每个查询的相关文档下标（留出集标注），提供时分别计算两者的
+    recall@k 及其差值；否则以基准的前k个结果为标准计算候选的重合率。
+    """
+    timings = {}
+    embeddings = {}
+    for name, encoder in (("reference", reference), ("candidate", candidate)):
+        start = time.perf_counter()
+        corpus_embeddings = encoder.encode(corpus, batch_size=batch_size, convert_to_numpy=True)
+        query_embeddings = encoder.encode(queries, batch_size=batch_size, convert_to_numpy=True)
+        timings[name] = time.perf_counter() - start
+        embeddings[name] = (np.asarray(query_embeddings, dtype=np.float32),
+                            np.asarray(corpus_embeddings, dtype=np.float32))
+
+    ref_top = _top_k(*embeddings["reference"], k)
+    cand_top = _top_k(*embeddings["candidate"], k)
+    overlap = float(np.mean([len(set(r) & set(c)) / len(r) for r, c in zip(ref_top, cand_top)]))
+
+    report = {
+        "k": k,
+        "queries": len(queries),
+        "corpus": len(corpus),
+        "reference": getattr(reference, "backend", "reference"),
+        "candidate": getattr(candidate, "backend", "candidate"),
+        "overlap_at_k": round(overlap, 4),
+        "reference_seconds": round(timings["reference"], 3),
+        "candidate_seconds": round(timings["candidate"], 3),
+        "speedup": round(timings["reference"] / max(timings["candidate"], 1e-9), 2)
+    }
+    if relevant is not None:
+        def recall(top):
+            return float(np.mean([
+                len(set(row) & set(rel)) / len(rel) for row, rel in zip(top, relevant) if rel
+            ]))
+        report["reference_recall_at_k"] = round(recall(ref_top), 4)
+        report["candidate_recall_at_k"] = round(recall(cand_top), 4)
+        report["recall_delta"] = round(report["candidate_recall_at_k"] - report["reference_recall_at_k"], 4)
+    else:
+        # 没有标注时，以与基准结果的重合率衡量召回损失
+        report["recall_delta"] = round(overlap - 1.0, 4)
+    return report
+
+
+def load_parity_set(path: str) -> Dict:
+    """读取留出集：{"queries": [...], "corpus": [...], "relevant": [[...], ...]}，relevant可省略"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parity_report_path(encoder_config: Dict) -> str:
+    """导出模型的对照报告路径，int8与fp32模型各一份"""
+    model_dir = onnx_model_dir(encoder_config.get('onnx_dir', 'models/onnx'),
+                               encoder_config.get('model', 'BAAI/bge-large-zh'))
+    return os.path.join(model_dir, "parity-int8.json" if encoder_config.get('quantize', True) else "parity.json")
+
+
+def encoder_parity(config: Dict, candidate=None, force: bool = False) -> Optional[Dict]:
+    """导出模型与fp32基准的对照报告，每个导出模型只计算一次并记录在模型旁边
+
+    未配置 parity_set 或使用 torch 后端时返回None。已有报告且留出集、k 和基准
+    模型都相同时直接读取，不再加载基准模型；force 为 True 时重新计算。
+    """
+    encoder_config = config['vector_store'].get('encoder', {})
+    if not encoder_config.get('parity_set') or encoder_config.get('backend', 'torch') == "torch":
+        return None
+    settings = {
+        "parity_set": os.path.abspath(encoder_config['parity_set']),
+        "k": encoder_config.get('parity_k', 10),
+        "reference_model": encoder_config.get('reference_model', 'BAAI/bge-large-zh')
+    }
+    path = parity_report_path(encoder_config)
+    if not force and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        if report.get("settings") == settings:
+            return report
+
+    data = load_parity_set(settings["parity_set"])
+    reference = create_encoder(config, backend="torch", model=settings["reference_model"])
+    candidate = candidate or create_encoder(config)
+    report = parity_check(reference, candidate, data["queries"], data["corpus"], k=settings["k"],
+                          relevant=data.get("relevant"))
+    report["settings"] = settings
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="对比编码器后端与fp32基准的召回和速度，ONNX后端的结果记录在导出模型旁边"
+    )
+    parser.add_argument("parity_set", help="留出集JSON文件")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    import yaml
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    set_torch_threads(config)
+    encoder_config = config['vector_store'].setdefault('encoder', {})
+    encoder_config.update(parity_set=args.parity_set, parity_k=args.k)
+    report = encoder_parity(config, force=True)
+    if report is None:
+        # torch 后端与基准相同，只打印对照结果
+        data = load_parity_set(args.parity_set)
+        reference = create_encoder(config, backend="torch",
+                                   model=encoder_config.get('reference_model', 'BAAI/bge-large-zh'))
+        report = parity_check(reference, create_encoder(config), data["queries"], data["corpus"],
+                              k=args.k, relevant=data.get("relevant"))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import threading
+
+import faiss
+import numpy as np
+
+from src.models.registry import ModelRegistry, default_registry
+
+def pool_features(features) -> np.ndarray:
+    """把图像特征整理为单个L2归一化向量：CLIP为(d,)或(1, d)，BLIP2的查询token特征(32, d)取平均"""
+    features = np.asarray(features, dtype=np.float32)
+    vector = features.reshape(-1, features.shape[-1]).mean(axis=0)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class _ModelIndex:
+    """一种图像模型的向量索引：float16标量量化，可选PCA降维
+
+    配置了PCA时，训练前向量先以全维度float16缓存在 _buffer 中（仍可检索），
+    数量达到 pca_train_size 后训练PCA并迁移，之后每个向量只占 2*pca_dim 字节。
+    """
+
+    def __init__(self, dimension: int, pca_dim: int = 0, pca_train_size: int = 1024, index=None):
+        self.dimension = dimension
+        self.pca_dim = pca_dim if 0 < pca_dim < dimension else 0
+        self.pca_train_size = max(pca_train_size, self.pca_dim)
+        factory = f"IDMap2,PCA{self.pca_dim},SQfp16" if self.pca_dim else "IDMap2,SQfp16"
+        self.index = index or faiss.index_factory(dimension, factory, faiss.METRIC_INNER_PRODUCT)
+        self._buffer = faiss.index_factory(dimension, "IDMap2,SQfp16", faiss.METRIC_INNER_PRODUCT)
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal + self._buffer.ntotal
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray):
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, ids)
+            return
+        self._buffer.add_with_ids(vectors, ids)
+        if self._buffer.ntotal >= self.pca_train_size:
+            buffered = faiss.vector_to_array(self._buffer.id_map).astype(np.int64)
+            vectors = self._buffer.reconstruct_batch(buffered)
+            self.index.train(vectors)
+            self.index.add_with_ids(vectors, buffered)
+            self._buffer.reset()
+
+    def remove_ids(self, ids: np.ndarray):
+        selector = faiss.IDSelectorArray(ids)
+        self.index.remove_ids(selector)
+        self._buffer.remove_ids(selector)
+
+    def search(self, queries: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        results = [[] for _ in range(len(queries))]
+        for index in (self.index, self._buffer):
+            if not index.ntotal:
+                continue
+            scores, ids = index.search(queries, min(k, index.ntotal))
+            for hits, row_scores, row_ids in zip(results, scores, ids):
+                hits.extend((int(idx), float(score)) for idx, score in zip(row_ids, row_scores) if idx != -1)
+        return [sorted(hits, key=lambda hit: -hit[1])[:k] for hits in results]
+
+    def snapshot(self):
+        """可写入磁盘的索引：PCA未训练时为全维度的缓存索引"""
+        return self.index if self.index.is_trained else self._buffer
+
+
+class ImageIndex:
+    """图像向量索引，每种图像模型（clip、blip2）一个FAISS索引
+
+    向量的id即对应图片块的块id，检索结果可以直接与文本检索结果融合、按id
+    读取元数据。向量以float16存放，配置 pca_dim 时先做PCA降维。clip索引与
+    CLIP的文本塔对齐，支持以文搜图；所有索引都支持以图搜图（查询特征须来自
+    同一模型）。图片数量远小于文本块，有变化的模型在保存时整体写为新文件，
+    由向量存储的manifest引用（见 SegmentStore.commit）。
+
+    只读副本默认不做以文搜图，避免每个副本都加载CLIP；需要时配置
+    replica_text_to_image。CLIP在第一次以文搜图时才登记和加载。
+    """
+
+    def __init__(self, config: Dict, registry: Optional[ModelRegistry] = None):
+        index_config = config['vector_store'].get('image_index', {})
+        self.enabled = index_config.get('enabled', True)
+        self.pca_dim = index_config.get('pca_dim', 0)
+        self.pca_train_size = index_config.get('pca_train_size', 1024)
+        # 以文搜图使用的CLIP模型，须与导入时提取特征的模型一致；BLIP2部署默认不加载CLIP
+        image_model = config.get('image_processor', {}).get('model', 'clip')
+        self.text_to_image = index_config.get('text_to_image', image_model == "clip")
+        self.replica_text_to_image = index_config.get('replica_text_to_image', False)
+        self.clip_model = index_config.get('clip_model', 'ViT-B/32')
+        self.device = config.get('image_processor', {}).get('device', 'cpu')
+        self.registry = registry or default_registry
+        self._indexes = {}
+        self._lock = threading.Lock()
+        # 各模型已加载的索引文件名（来自manifest），以及保存后又有变化的模型
+        self._files = {}
+        self._dirty = set()
+        self.clip_key = None
+
+    def _init_clip(self):
+        import clip
+
+        return clip.load(self.clip_model, device=self.device)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(index.ntotal for index in self._indexes.values())
+
+    def models(self) -> List[str]:
+        return [name for name, index in self._indexes.items() if index.ntotal]
+
+    def searchable_by_text(self, read_only: bool = False) -> bool:
+        """是否可以以文搜图：已启用、有clip向量，只读副本还需显式开启"""
+        if not (self.enabled and self.text_to_image) or (read_only and not self.replica_text_to_image):
+            return False
+        return "clip" in self.models()
+
+    def add(self, model: str, ids: Iterable[int], features: Iterable) -> int:
+        """添加一批图片特征，model 为提取特征的图像模型名"""
+        if not self.enabled:
+            return 0
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return 0
+        vectors = np.stack([pool_features(f) for f in features]).astype(np.float32)
+        with self._lock:
+            index = self._indexes.get(model)
+            if index is None:
+                index = self._indexes[model] = _ModelIndex(vectors.shape[1], self.pca_dim, self.pca_train_size)
+            if vectors.shape[1] != index.dimension:
+                raise ValueError(
+                    f"Image feature dimension {vectors.shape[1]} does not match the {model} index ({index.dimension})"
+                )
+            index.add(vectors, ids)
+            self._dirty.add(model)
+        return len(ids)
+
+    def remove_ids(self, ids: Iterable[int]):
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return
+        with self._lock:
+            for model, index in self._indexes.items():
+                before = index.ntotal
+                index.remove_ids(ids)
+                if index.ntotal != before:
+                    self._dirty.add(model)
+
+    def search_features(self, model: str, features, top_k: int) -> List[Tuple[int, float]]:
+        """以图搜图：按一张图片的特征检索同一模型索引中的图片"""
+        with self._lock:
+            index = self._indexes.get(model)
+            if index is None or not index.ntotal:
+                return []
+            return index.search(pool_features(features)[None], top_k)[0]
+
+    def search_text(self, queries: List[str], top_k: int) -> List[List[Tuple[int, float]]]:
+        """以文搜图：用CLIP文本塔编码查询，在clip索引中检索"""
+        with self._lock:
+            index = self._indexes.get("clip")
+            if index is None or not index.ntotal:
+                return [[] for _ in queries]
+        embeddings = self.encode_text(queries)
+        with self._lock:
+            return index.search(embeddings, top_k)
+
+    def encode_text(self, queries: List[str]) -> np.ndarray:
+        import clip
+        import torch
+
+        if self.clip_key is None:
+            # 与 ImageProcessor 同名登记，两处共享同一个CLIP模型实例
+            self.clip_key = self.registry.register(
+                f"clip:{self.clip_model}@{self.device}", self._init_clip, group="vision"
+            )
+        model = self.registry.get(self.clip_key)[0]
+        tokens = clip.tokenize(queries, truncate=True).to(self.device)
+        with torch.no_grad():
+            embeddings = model.encode_text(tokens).float().cpu().numpy()
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings.astype(np.float32)
+
+    def dirty_snapshots(self) -> Dict:
+        """上次保存后有变化的模型及其可写入磁盘的索引"""
+        with self._lock:
+            return {model: self._indexes[model].snapshot() for model in self._dirty}
+
+    def mark_saved(self, files: Dict[str, str]):
+        """提交成功后记录各模型的文件名；dirty_snapshots 之后的修改须在同一把锁下进行"""
+        with self._lock:
+            self._files = dict(files)
+            self._dirty.clear()
+
+    def clear(self):
+        with self._lock:
+            self._indexes = {}
+            self._files = {}
+            self._dirty = set()
+
+    def adopt(self, loaded: Dict[str, Tuple[str, object]]) -> bool:
+        """换上从磁盘读取的索引（SegmentStore.load_image_indexes 的结果），返回是否有变化"""
+        indexes = {}
+        for model, (name, index) in loaded.items():
+            if _has_pca(index) or not self.pca_dim:
+                indexes[model] = _ModelIndex(index.d, self.pca_dim, self.pca_train_size, index=index)
+            else:
+                # 保存时PCA尚未训练，写入的是全维度缓存
+                indexes[model] = _ModelIndex(index.d, self.pca_dim, self.pca_train_size)
+                indexes[model]._buffer = index
+        with self._lock:
+            self._indexes.update(indexes)
+            self._files.update({model: name for model, (name, _) in loaded.items()})
+            self._dirty.difference_update(loaded)
+        return bool(loaded)
+
+    @property
+    def files(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._files)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                model: {
+                    "vectors": index.ntotal,
+                    "dimension": index.dimension,
+                    "pca_dim": index.pca_dim or None,
+                    "pca_trained": bool(index.pca_dim) and index.index.is_trained
+                }
+                for model, index in self._indexes.items()
+            }
+
+
+def _has_pca(index) -> bool:
+    """索引（IDMap2外包）是否带PCA预变换"""
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    return isinstance(inner, faiss.IndexPreTransform)
@@ -0,0 +1,282 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import math
+
+import faiss
+import numpy as np
+
+# 预置的索引结构，{nlist}/{pq_m}/{hnsw_m} 在构建时替换
+INDEX_PRESETS = {
+    "Flat": "Flat",
+    "IVF-Flat": "IVF{nlist},Flat",
+    "IVF-PQ": "IVF{nlist},PQ{pq_m}",
+    "HNSW": "HNSW{hnsw_m}",
+    "OPQ-IVF-PQ": "OPQ{pq_m},IVF{nlist},PQ{pq_m}",
+}
+
+METRICS = {
+    "L2": faiss.METRIC_L2,
+    "IP": faiss.METRIC_INNER_PRODUCT,
+}
+
+
+def merge_search_results(results: List[Tuple[np.ndarray, np.ndarray]], k: int,
+                         metric: int) -> Tuple[np.ndarray, np.ndarray]:
+    """合并多个子索引的检索结果，返回每个查询的前k个"""
+    distances = np.concatenate([d for d, _ in results], axis=1)
+    indices = np.concatenate([i for _, i in results], axis=1)
+
+    # 无效结果排到最后
+    if metric == faiss.METRIC_INNER_PRODUCT:
+        keys = np.where(indices == -1, np.inf, -distances)
+    else:
+        keys = np.where(indices == -1, np.inf, distances)
+    order = np.argsort(keys, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def set_query_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """设置查询参数，对不适用的索引类型忽略"""
+    params = faiss.ParameterSpace()
+    if nprobe and faiss.try_extract_index_ivf(index) is not None:
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search:
+        try:
+            params.set_index_parameter(index, "efSearch", ef_search)
+        except RuntimeError:
+            pass
+
+
+def iter_index_vectors(index, batch_size: int = 65536) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """按批取出索引中的 (向量, id)，PQ索引取出的是近似重建值"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        # Flat/HNSW 外层为IDMap2，内部位置与id_map一一对应
+        inner = index.index
+        id_map = faiss.vector_to_array(index.id_map)
+        for start in range(0, index.ntotal, batch_size):
+            count = min(batch_size, index.ntotal - start)
+            yield inner.reconstruct_n(start, count), id_map[start:start + count]
+        return
+
+    # IVF 自带id，按倒排表收集id后通过direct map重建
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    invlists = ivf.invlists
+    ids = []
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ptr = invlists.get_ids(list_no)
+            ids.append(faiss.rev_swig_ptr(ptr, size).copy())
+            invlists.release_ids(list_no, ptr)
+    ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        yield index.reconstruct_batch(batch), batch
+
+
+class ManagedIndex:
+    """带训练生命周期的FAISS索引
+
+    所有向量以稳定的int64 id存放：IVF类索引自带id，其余索引外包IDMap2。
+    需要训练的索引（IVF/PQ）在向量数量足够之前先把向量缓存在一个Flat
+    索引中（仍可检索），达到训练规模后自动训练并迁移；语料增长到上次
+    训练规模的 retrain_factor 倍时重新训练并迁移到新的索引。
+    """
+
+    def __init__(self, config: Dict):
+        store_config = config['vector_store']
+        self.dimension = store_config['dimension']
+        index_type = store_config['index_type']
+        if index_type not in METRICS:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        self.metric = METRICS[index_type]
+
+        # 兼容旧配置：未指定index_factory时，nlist>0表示IVF-Flat
+        self.nlist = store_config.get('nlist', 0)
+        default_factory = "IVF-Flat" if self.nlist > 0 else "Flat"
+        self.factory = store_config.get('index_factory', default_factory)
+        self.pq_m = store_config.get('pq_m', 64)
+        self.hnsw_m = store_config.get('hnsw_m', 32)
+        self.retrain_factor = store_config.get('retrain_factor', 4.0)
+        self.max_train_samples = store_config.get('max_train_samples', 65536)
+        self.min_train_size = store_config.get('min_train_size', 0)
+
+        # 查询参数默认值，可在查询时覆盖
+        self.nprobe = store_config.get('nprobe', 1)
+        self.ef_search = store_config.get('ef_search', 64)
+
+        self._trained_on = 0
+        self.index = self._build(self._expected_nlist(0))
+        self._buffer = faiss.index_factory(self.dimension, "IDMap2,Flat", self.metric)
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal + self._buffer.ntotal
+
+    @property
+    def trained_on(self) -> int:
+        """上次训练时的向量数"""
+        return self._trained_on
+
+    @property
+    def factory_string(self) -> str:
+        return self._factory_string(self._expected_nlist(self._trained_on))
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray):
+        """按id添加向量，未训练时先缓存"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, ids)
+        else:
+            self._buffer.add_with_ids(vectors, ids)
+            if self._buffer.ntotal >= self._train_size():
+                self._train_from_buffer()
+
+        if self._needs_retrain():
+            self.retrain()
+
+    def remove_ids(self, ids: Iterable[int]) -> bool:
+        """删除向量；索引不支持删除（如HNSW）时返回False"""
+        # 哈希direct map只支持IDSelectorArray
+        id_array = np.asarray(list(ids), dtype=np.int64)
+        selector = faiss.IDSelectorArray(id_array)
+        try:
+            self.index.remove_ids(selector)
+        except RuntimeError:
+            return False
+        self._buffer.remove_ids(selector)
+        return True
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """检索，nprobe/efSearch 可在查询时指定"""
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        results = []
+        if self.index.ntotal:
+            set_query_params(self.index, nprobe or self.nprobe, ef_search or self.ef_search)
+            results.append(self.index.search(queries, k))
+        if self._buffer.ntotal:
+            results.append(self._buffer.search(queries, k))
+        if not results:
+            return (np.full((len(queries), k), np.inf, dtype=np.float32),
+                    np.full((len(queries), k), -1, dtype=np.int64))
+        return merge_search_results(results, k, self.metric)
+
+    def snapshot(self):
+        """返回当前持有向量的FAISS索引（训练前为缓存索引）"""
+        return self._buffer if self._buffer.ntotal else self.index
+
+    def clear(self):
+        """清空向量，保留训练结果，供下一个增量分段使用"""
+        self.index.reset()
+        self._buffer.reset()
+
+    def trained_template(self):
+        """已训练的空索引；不需要训练或尚未训练时返回None"""
+        if not self.index.is_trained or self._trained_on == 0:
+            return None
+        if faiss.try_extract_index_ivf(self.index) is None and "PQ" not in self.factory_string:
+            return None
+        template = faiss.clone_index(self.index)
+        template.reset()
+        return template
+
+    def adopt(self, index, trained_on: int = 0):
+        """接管一个已有的FAISS索引（已训练的空模板或旧格式的索引）"""
+        self.index = index
+        self._buffer.reset()
+        self._trained_on = trained_on if index.is_trained else 0
+
+    def to_score(self, distance: float) -> float:
+        """把距离转换为越大越相似的分数"""
+        if self.metric == faiss.METRIC_INNER_PRODUCT:
+            return float(distance)
+        return float(1 / (1 + distance))
+
+    def retrain(self):
+        """按当前语料规模重新训练，并把已有向量迁移到新索引"""
+        ntotal = self.ntotal
+        index = self._build(self._expected_nlist(ntotal))
+        if not index.is_trained:
+            index.train(self._sample_vectors(self.max_train_samples))
+        for vectors, ids in self.iter_vectors():
+            index.add_with_ids(vectors, ids)
+        self.index = index
+        self._buffer.reset()
+        self._trained_on = ntotal
+
+    def iter_vectors(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """按批取出所有 (向量, id)"""
+        for source in (self.index, self._buffer):
+            yield from iter_index_vectors(source)
+
+    def _train_from_buffer(self):
+        """用缓存的向量训练索引，并把缓存迁移进去"""
+        vectors, ids = next(iter_index_vectors(self._buffer, batch_size=self._buffer.ntotal))
+        self.index = self._build(self._expected_nlist(len(vectors)))
+        sample = vectors
+        if len(vectors) > self.max_train_samples:
+            picks = np.random.default_rng(0).choice(len(vectors), self.max_train_samples, replace=False)
+            sample = vectors[np.sort(picks)]
+        self.index.train(sample)
+        self.index.add_with_ids(vectors, ids)
+        self._buffer.reset()
+        self._trained_on = len(vectors)
+
+    def _needs_retrain(self) -> bool:
+        if not self.retrain_factor or not self.index.is_trained or not self._trained_on:
+            return False
+        # 只有nlist随规模变化的索引才需要重新训练
+        if "{nlist}" not in INDEX_PRESETS.get(self.factory, self.factory) or self.nlist > 0:
+            return False
+        return self.ntotal >= self._trained_on * self.retrain_factor
+
+    def _train_size(self) -> int:
+        """训练所需的最少向量数"""
+        nlist = self._expected_nlist(0) or 1
+        size = 39 * nlist
+        if "PQ" in self._factory_string(nlist):
+            size = max(size, 256 * 39)
+        if self.nlist <= 0:
+            # nlist由规模估计时，先积累足够的向量再训练
+            size = max(size, 1024)
+        return max(size, self.min_train_size)
+
+    def _expected_nlist(self, ntotal: int) -> int:
+        """nlist未配置时按 4*sqrt(N) 估计"""
+        if self.nlist > 0:
+            return self.nlist
+        if not ntotal:
+            return 0
+        return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39 or 1))
+
+    def _factory_string(self, nlist: int) -> str:
+        template = INDEX_PRESETS.get(self.factory, self.factory)
+        return template.format(nlist=nlist or 1, pq_m=self.pq_m, hnsw_m=self.hnsw_m)
+
+    def _build(self, nlist: int):
+        factory = self._factory_string(nlist)
+        if "IVF" not in factory:
+            factory = "IDMap2," + factory
+        index = faiss.index_factory(self.dimension, factory, self.metric)
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            # 哈希direct map同时支持按id重建和删除
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+
+    def _sample_vectors(self, n: int) -> np.ndarray:
+        """均匀抽取至多n个向量用于训练"""
+        ntotal = self.ntotal
+        keep = np.ones(ntotal, dtype=bool)
+        if ntotal > n:
+            keep[:] = False
+            keep[np.random.default_rng(0).choice(ntotal, n, replace=False)] = True
+        samples = []
+        offset = 0
+        for vectors, _ in self.iter_vectors():
+            samples.append(vectors[keep[offset:offset + len(vectors)]])
+            offset += len(vectors)
+        return np.concatenate(samples)
@@ -0,0 +1,187 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from array import array
+
+# 以列存储的字段，其余字段放在稀疏的extra字典中
+_CORE_FIELDS = ("text", "source", "type", "modality", "page", "start", "end", "hash")
+
+
+class StringPool:
+    """字符串驻留池，相同字符串只保存一份，以整数编码引用"""
+
+    def __init__(self):
+        self._strings = []
+        self._codes = {}
+
+    def code(self, value: str) -> Optional[int]:
+        """已驻留字符串的编码，不存在时返回None"""
+        return self._codes.get(value)
+
+    def intern(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._strings)
+            self._strings.append(value)
+            self._codes[value] = code
+        return code
+
+    def __getitem__(self, code: int) -> str:
+        return self._strings[code]
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+
+class ColumnarMetadata:
+    """紧凑的列式元数据存储
+
+    来源、文件类型、模态以驻留字符串编码保存；页码和字符偏移保存在
+    定长整数数组中；块文本以UTF-8连续存放在字符串堆里。行的id从start_id
+    起连续分配，按id读取为O(1)；删除只做标记。
+    """
+
+    def __init__(self, rows: Iterable[Dict] = (), start_id: int = 0):
+        self.start_id = start_id
+        self._sources = StringPool()
+        self._types = StringPool()
+        self._modalities = StringPool()
+
+        self._source = array('i')
+        self._type = array('h')
+        self._modality = array('h')
+        self._page = array('i')
+        self._start = array('q')
+        self._end = array('q')
+        # 块内容哈希（64位）
+        self._hash = array('Q')
+
+        # 文本堆：第i行文本为 _text[_text_offsets[i]:_text_offsets[i + 1]]
+        self._text = bytearray()
+        self._text_offsets = array('q', [0])
+
+        self._extra = {}
+        self._deleted = set()
+        # 按来源聚合：来源编码 -> 行号列表
+        self._rows_by_source = {}
+
+        self.extend(rows)
+
+    def append(self, row: Dict) -> int:
+        """追加一行，返回其id"""
+        idx = len(self._source)
+        source = self._sources.intern(row.get("source", ""))
+        modality = self._modalities.intern(row.get("modality", "text"))
+        self._source.append(source)
+        self._type.append(self._types.intern(row.get("type", "text")))
+        self._modality.append(modality)
+        self._page.append(row.get("page") or 0)
+        self._start.append(row.get("start") or 0)
+        self._end.append(row.get("end") or 0)
+        self._text.extend(row.get("text", "").encode("utf-8"))
+        self._text_offsets.append(len(self._text))
+
+        self._hash.append(int(row.get("hash") or "0", 16))
+
+        extra = {key: value for key, value in row.items() if key not in _CORE_FIELDS}
+        if extra:
+            self._extra[idx] = extra
+
+        self._rows_by_source.setdefault(source, array('i')).append(idx)
+        return self.start_id + idx
+
+    def extend(self, rows: Iterable[Dict]):
+        for row in rows:
+            self.append(row)
+
+    def text(self, idx: int) -> str:
+        return self._text[self._text_offsets[idx]:self._text_offsets[idx + 1]].decode("utf-8")
+
+    def __getitem__(self, idx: int) -> Dict:
+        """按行号读取"""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        row = {
+            "text": self.text(idx),
+            "source": self._sources[self._source[idx]],
+            "type": self._types[self._type[idx]],
+            "modality": self._modalities[self._modality[idx]],
+            "page": self._page[idx],
+            "start": self._start[idx],
+            "end": self._end[idx],
+            "hash": f"{self._hash[idx]:016x}",
+        }
+        row.update(self._extra.get(idx, {}))
+        return row
+
+    def get(self, chunk_id: int) -> Optional[Dict]:
+        """按id读取，已删除或不存在时返回None"""
+        idx = chunk_id - self.start_id
+        if not 0 <= idx < len(self) or idx in self._deleted:
+            return None
+        return self[idx]
+
+    def __contains__(self, chunk_id: int) -> bool:
+        idx = chunk_id - self.start_id
+        return 0 <= idx < len(self) and idx not in self._deleted
+
+    def delete(self, chunk_id: int):
+        idx = chunk_id - self.start_id
+        if 0 <= idx < len(self):
+            self._deleted.add(idx)
+
+    def __len__(self) -> int:
+        return len(self._source)
+
+    @property
+    def next_id(self) -> int:
+        return self.start_id + len(self)
+
+    def items(self) -> Iterator[Tuple[int, Dict]]:
+        """遍历未删除的 (id, 行)"""
+        for idx in range(len(self)):
+            if idx not in self._deleted:
+                yield self.start_id + idx, self[idx]
+
+    def __iter__(self) -> Iterator[Dict]:
+        for _, row in self.items():
+            yield row
+
+    def chunk_hashes(self, source: str) -> List[Tuple[int, str]]:
+        """某个文档未删除的 (块id, 内容哈希)"""
+        code = self._sources.code(source)
+        if code is None:
+            return []
+        return [
+            (self.start_id + idx, f"{self._hash[idx]:016x}")
+            for idx in self._rows_by_source.get(code, ())
+            if idx not in self._deleted
+        ]
+
+    def document_pages(self, source: str) -> Set[int]:
+        """某个文档未删除的块所在的页码（不含0）"""
+        code = self._sources.code(source)
+        if code is None:
+            return set()
+        return {self._page[idx] for idx in self._rows_by_source.get(code, ()) if idx not in self._deleted} - {0}
+
+    def documents(self) -> List[Dict]:
+        """按来源聚合：每个文档一行，包含块数、页数和模态"""
+        documents = []
+        for code, rows in self._rows_by_source.items():
+            live = [idx for idx in rows if idx not in self._deleted]
+            if not live:
+                continue
+            documents.append({
+                "source": self._sources[code],
+                "chunks": len(live),
+                "pages": len({self._page[idx] for idx in live} - {0}),
+                "modalities": sorted({self._modalities[self._modality[idx]] for idx in live})
+            })
+        return documents
+
+    def nbytes(self) -> int:
+        """列数据占用的字节数（不含驻留字符串和extra字段）"""
+        columns = (self._source, self._type, self._modality, self._page,
+                   self._start, self._end, self._hash, self._text_offsets)
+        return sum(col.itemsize * len(col) for col in columns) + len(self._text)
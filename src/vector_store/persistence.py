@@ -0,0 +1,395 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+
+import faiss
+
+MANIFEST_NAME = "manifest.json"
+SEGMENT_DIR = "segments"
+METADATA_DB = "metadata.db"
+IMAGE_INDEX_DIR = "image_index"
+FORMAT_VERSION = 2
+
+
+class Segment:
+    """只读的索引分段，向量以稳定的id存放"""
+
+    def __init__(self, name: str, index):
+        self.name = name
+        self.index = index
+
+    @property
+    def count(self) -> int:
+        return self.index.ntotal
+
+
+class MetadataDB:
+    """SQLite元数据存储，按id惰性读取"""
+
+    def __init__(self, path: str, cache_size: int = 4096, read_only: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        if read_only:
+            # 只读副本不修改表结构，由写入进程负责建表和迁移
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        # 聚合与去重查询用到的字段单独成列
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        for name, decl in (("source", "TEXT"), ("modality", "TEXT"), ("page", "INTEGER"), ("hash", "TEXT")):
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE chunks ADD COLUMN {name} {decl}")
+                self._conn.execute(f"UPDATE chunks SET {name} = json_extract(data, '$.{name}')")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (source TEXT PRIMARY KEY, content_hash TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, ids: List[int]) -> Dict[int, Dict]:
+        """批量读取元数据"""
+        found = {}
+        missing = []
+        with self._lock:
+            for idx in ids:
+                if idx in self._cache:
+                    self._cache.move_to_end(idx)
+                    found[idx] = self._cache[idx]
+                else:
+                    missing.append(idx)
+            if missing:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._conn.execute(
+                    f"SELECT id, data FROM chunks WHERE id IN ({placeholders})", missing
+                ).fetchall()
+                for idx, data in rows:
+                    found[idx] = json.loads(data)
+                    self._cache[idx] = found[idx]
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return found
+
+    def get(self, idx: int) -> Optional[Dict]:
+        return self.get_many([idx]).get(idx)
+
+    def iter_rows(self, limit: Optional[int] = None) -> Iterator[Dict]:
+        """按id顺序遍历，limit为已提交的最大id（不含）"""
+        with self._lock:
+            query = "SELECT data FROM chunks ORDER BY id"
+            params = ()
+            if limit is not None:
+                query = "SELECT data FROM chunks WHERE id < ? ORDER BY id"
+                params = (limit,)
+            rows = self._conn.execute(query, params).fetchall()
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def iter_texts(self, limit: int, batch_size: int = 10000,
+                   start: int = 0) -> Iterator[Tuple[List[int], List[str]]]:
+        """按id顺序分批读取 [start, limit) 范围内的块文本，不含只有图像特征的图片块"""
+        last_id = start - 1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, json_extract(data, '$.text') FROM chunks WHERE id > ? AND id < ? "
+                    "AND json_extract(data, '$.image_only') IS NULL ORDER BY id LIMIT ?",
+                    (last_id, limit, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [idx for idx, _ in rows], [text or "" for _, text in rows]
+
+    def chunk_hashes(self, source: str, limit: int) -> List[Tuple[int, str]]:
+        """某个文档已提交的 (块id, 内容哈希)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, hash FROM chunks WHERE source = ? AND id < ?", (source, limit)
+            ).fetchall()
+
+    def document_rows(self, source: str, limit: int) -> List[Tuple[int, int, str]]:
+        """某个文档已提交的 (块id, 页码, 模态)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, page, modality FROM chunks WHERE source = ? AND id < ?", (source, limit)
+            ).fetchall()
+
+    def document_hash(self, source: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash FROM documents WHERE source = ?", (source,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def documents(self, limit: int) -> List[Dict]:
+        """按来源聚合id小于limit的行"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, COUNT(*), COUNT(DISTINCT NULLIF(page, 0)), GROUP_CONCAT(DISTINCT modality) "
+                "FROM chunks WHERE id < ? GROUP BY source ORDER BY MIN(id)",
+                (limit,)
+            ).fetchall()
+        return [
+            {
+                "source": source or "",
+                "chunks": chunks,
+                "pages": pages,
+                "modalities": sorted(filter(None, (modalities or "").split(",")))
+            }
+            for source, chunks, pages, modalities in rows
+        ]
+
+    def append(self, min_id: int, items: Iterable[Tuple[int, Dict]]):
+        """追加元数据；先清理上次崩溃残留的未提交行（id >= min_id）"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM chunks WHERE id >= ?", (min_id,))
+                self._conn.executemany(
+                    "INSERT INTO chunks (id, source, modality, page, hash, data) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        (idx, row.get("source", ""), row.get("modality", "text"), row.get("page", 0),
+                         row.get("hash"), json.dumps(row, ensure_ascii=False))
+                        for idx, row in items
+                    )
+                )
+
+    def delete(self, ids: Iterable[int]):
+        """删除已提交的行，可重复执行"""
+        ids = list(ids)
+        with self._lock:
+            with self._conn:
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    self._conn.execute(
+                        f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                    )
+            for idx in ids:
+                self._cache.pop(idx, None)
+
+    def set_document_hashes(self, hashes: Dict[str, Optional[str]]):
+        """更新文档内容哈希，值为None表示文档已删除"""
+        with self._lock:
+            with self._conn:
+                for source, content_hash in hashes.items():
+                    if content_hash is None:
+                        self._conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+                    else:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO documents (source, content_hash) VALUES (?, ?)",
+                            (source, content_hash)
+                        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SegmentStore:
+    """分段式磁盘格式
+
+    目录结构：
+        manifest.json      已提交的分段、删除标记和下一个可用id，每次提交原子替换
+        segments/*.faiss   只读的索引分段，新数据写为增量分段
+        template-*.faiss   已训练但不含向量的空索引，供后续增量分段复用
+        image_index/*.faiss 各图像模型的图像索引，文件名带代数，由manifest引用
+        metadata.db        SQLite元数据，按id惰性读取
+
+    read_only 为 True 时用于只读副本：不创建文件、不做崩溃后的补做，只能加载，
+    通过 reload_manifest 的 generation 变化发现写入进程提交的新快照。
+    """
+
+    def __init__(self, path: str, mmap: bool = True, read_only: bool = False):
+        self.path = path
+        self.mmap = mmap
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(os.path.join(path, SEGMENT_DIR), exist_ok=True)
+        self.metadata = MetadataDB(os.path.join(path, METADATA_DB), read_only=read_only)
+        self.manifest = self._read_manifest()
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported vector store format {self.manifest.get('format')} in {path}"
+            )
+
+    @property
+    def generation(self) -> int:
+        return self.manifest["generation"]
+
+    @property
+    def next_id(self) -> int:
+        return self.manifest["next_id"]
+
+    @property
+    def deleted(self) -> Set[int]:
+        return set(self.manifest["deleted"])
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, MANIFEST_NAME))
+
+    def load_segments(self, opened: Optional[List[Segment]] = None) -> List[Segment]:
+        """按manifest加载所有分段，索引以内存映射方式打开；opened 中同名的分段直接复用"""
+        # 提交时可能在删除元数据之前崩溃，加载时补做
+        if not self.read_only:
+            self.metadata.delete(self.manifest["deleted"])
+        opened = {segment.name: segment for segment in opened or []}
+        return [opened.get(entry["name"]) or Segment(entry["name"], self._read_index(entry["name"]))
+                for entry in self.manifest["segments"]]
+
+    def load_template(self):
+        if not self.manifest.get("template"):
+            return None
+        return faiss.read_index(os.path.join(self.path, self.manifest["template"]))
+
+    def commit(self, delta_index, rows: Iterable[Tuple[int, Dict]], next_id: int,
+               deleted: Set[int], template=None, trained_on: int = 0,
+               documents: Optional[Dict[str, Optional[str]]] = None,
+               image_indexes: Optional[Dict] = None) -> Optional[Segment]:
+        """写入一个增量分段和删除标记，并原子地提交新的manifest"""
+        manifest = self._next_manifest(next_id, deleted, template, trained_on)
+        self._write_image_indexes(manifest, image_indexes)
+        segment = None
+        if delta_index is not None and delta_index.ntotal > 0:
+            segment = Segment(f"seg-{manifest['generation']:06d}.faiss", delta_index)
+            manifest["segments"] = manifest["segments"] + [
+                {"name": segment.name, "count": delta_index.ntotal}
+            ]
+            self._write_index(delta_index, os.path.join(SEGMENT_DIR, segment.name))
+
+        # 先写分段和元数据，最后替换manifest；中途崩溃时旧manifest仍然一致
+        self.metadata.append(self.next_id, rows)
+        newly_deleted = deleted - self.deleted
+        self._swap_manifest(manifest)
+        self._apply(newly_deleted, documents)
+
+        if segment is not None:
+            segment.index = self._read_index(segment.name)
+        return segment
+
+    def rewrite(self, index, rows: Iterable[Tuple[int, Dict]], next_id: int,
+                deleted: Set[int], template=None, trained_on: int = 0,
+                documents: Optional[Dict[str, Optional[str]]] = None,
+               image_indexes: Optional[Dict] = None) -> Optional[Segment]:
+        """压缩：用一个新分段替换全部分段，清除删除标记和被删除的元数据"""
+        manifest = self._next_manifest(next_id, set(), template, trained_on)
+        self._write_image_indexes(manifest, image_indexes)
+        manifest["segments"] = []
+        segment = None
+        if index is not None and index.ntotal > 0:
+            segment = Segment(f"seg-{manifest['generation']:06d}.faiss", index)
+            manifest["segments"] = [{"name": segment.name, "count": index.ntotal}]
+            self._write_index(index, os.path.join(SEGMENT_DIR, segment.name))
+        self.metadata.append(self.next_id, rows)
+        # 新manifest不再带删除标记，被删除的元数据必须在替换之前清除；
+        # 中途崩溃时旧分段中的这些向量因缺少元数据而不会出现在检索结果中
+        self.metadata.delete(deleted | self.deleted)
+
+        old_segments = [entry["name"] for entry in self.manifest["segments"]]
+        self._swap_manifest(manifest)
+        self._apply(set(), documents)
+
+        # 新manifest生效后再删除旧分段
+        for name in old_segments:
+            os.remove(os.path.join(self.path, SEGMENT_DIR, name))
+        if segment is not None:
+            segment.index = self._read_index(segment.name)
+        return segment
+
+    def _next_manifest(self, next_id: int, deleted: Set[int], template, trained_on: int) -> Dict:
+        if self.read_only:
+            raise ValueError(f"Vector store at {self.path} is opened read-only")
+        manifest = dict(self.manifest)
+        manifest["generation"] = self.generation + 1
+        manifest["next_id"] = next_id
+        manifest["deleted"] = sorted(deleted)
+        if template is not None:
+            manifest["template"] = f"template-{manifest['generation']:06d}.faiss"
+            manifest["trained_on"] = trained_on
+            self._write_index(template, manifest["template"])
+        return manifest
+
+    def _write_image_indexes(self, manifest: Dict, image_indexes: Optional[Dict]):
+        """把有变化的图像索引写为带代数的新文件，未变化的模型沿用旧文件
+
+        旧文件在新manifest生效后才删除，中途崩溃时旧manifest引用的图像索引
+        仍与其 next_id 一致，不会出现id超出已提交范围的图像向量。
+        """
+        if not image_indexes:
+            return
+        os.makedirs(os.path.join(self.path, IMAGE_INDEX_DIR), exist_ok=True)
+        files = dict(manifest.get("image_indexes") or {})
+        for model, index in image_indexes.items():
+            files[model] = os.path.join(IMAGE_INDEX_DIR, f"{model}-{manifest['generation']:06d}.faiss")
+            self._write_index(index, files[model])
+        manifest["image_indexes"] = files
+
+    def load_image_indexes(self, loaded: Optional[Dict[str, str]] = None) -> Dict[str, Tuple[str, object]]:
+        """按manifest读取图像索引，返回 {模型: (文件名, 索引)}；loaded 中文件名相同的模型跳过"""
+        loaded = loaded or {}
+        return {
+            model: (name, faiss.read_index(os.path.join(self.path, name)))
+            for model, name in (self.manifest.get("image_indexes") or {}).items()
+            if loaded.get(model) != name
+        }
+
+    def _swap_manifest(self, manifest: Dict):
+        old_template = self.manifest.get("template")
+        old_images = set((self.manifest.get("image_indexes") or {}).values())
+        self._write_manifest(manifest)
+        if old_template and old_template != manifest.get("template"):
+            os.remove(os.path.join(self.path, old_template))
+        for name in old_images - set((manifest.get("image_indexes") or {}).values()):
+            os.remove(os.path.join(self.path, name))
+
+    def _apply(self, deleted: Set[int], documents: Optional[Dict[str, Optional[str]]]):
+        """manifest生效后删除元数据行并更新文档哈希
+
+        在此之前崩溃时，删除会在下次加载时补做，文档则会在下次导入时重新比对。
+        """
+        if deleted:
+            self.metadata.delete(deleted)
+        if documents:
+            self.metadata.set_document_hashes(documents)
+
+    def _read_index(self, name: str):
+        path = os.path.join(self.path, SEGMENT_DIR, name)
+        if self.mmap:
+            # 不支持内存映射的索引类型会退化为普通读取
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        return faiss.read_index(path)
+
+    def _write_index(self, index, relative_path: str):
+        path = os.path.join(self.path, relative_path)
+        tmp_path = path + ".tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _read_manifest(self) -> Dict:
+        path = os.path.join(self.path, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return {"format": FORMAT_VERSION, "generation": 0, "next_id": 0,
+                    "segments": [], "deleted": [], "template": None}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def reload_manifest(self) -> Dict:
+        self.manifest = self._read_manifest()
+        return self.manifest
+
+    def _write_manifest(self, manifest: Dict):
+        path = os.path.join(self.path, MANIFEST_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.manifest = manifest
@@ -0,0 +1,170 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import time
+
+import numpy as np
+
+from src.models.registry import ModelRegistry, default_registry
+from .encoders import ENCODER_BACKENDS, export_onnx
+
+
+class TorchCrossEncoder:
+    """PyTorch 交叉编码器（sentence_transformers.CrossEncoder），线程数由 serving.torch_threads 统一设置"""
+
+    def __init__(self, model_name: str, device: str = "cpu", max_length: int = 512):
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.backend = "torch"
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+
+    def score(self, pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """返回每个 (查询, 文本) 对的相关性概率（单输出模型默认经sigmoid）"""
+        scores = self.model.predict(list(pairs), batch_size=len(pairs), convert_to_numpy=True,
+                                    show_progress_bar=False)
+        return np.asarray(scores, dtype=np.float32).reshape(len(pairs))
+
+
+class ONNXCrossEncoder:
+    """ONNX Runtime 交叉编码器，可选动态int8量化，导出结果缓存在 onnx_dir 中"""
+
+    def __init__(self, model_name: str, onnx_dir: str, quantize: bool = True,
+                 threads: Optional[int] = None, max_length: int = 512):
+        import onnxruntime as ort
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self.model_name = model_name
+        self.backend = "onnx-int8" if quantize else "onnx"
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        model_path = export_onnx(model_name, onnx_dir, quantize, AutoModelForSequenceClassification,
+                                 (["查询"], ["导出"]), {"logits": {0: "batch"}})
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {item.name for item in self.session.get_inputs()}
+
+    def score(self, pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """返回每个 (查询, 文本) 对的相关性概率（logit经sigmoid）"""
+        queries, texts = zip(*pairs)
+        inputs = self.tokenizer(list(queries), list(texts), padding=True, truncation="only_second",
+                                max_length=self.max_length, return_tensors="np")
+        feeds = {name: value.astype(np.int64) for name, value in inputs.items() if name in self._input_names}
+        logits = self.session.run(None, feeds)[0].reshape(len(pairs), -1)[:, 0]
+        return (1 / (1 + np.exp(-logits))).astype(np.float32)
+
+
+def create_cross_encoder(rerank_config: Dict):
+    """按 vector_store.rerank 配置创建交叉编码器，后端与文本编码器相同（torch 或 onnx）"""
+    backend = rerank_config.get('backend', 'onnx')
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unsupported reranker backend: {backend}")
+    model_name = rerank_config.get('model', 'BAAI/bge-reranker-base')
+    max_length = rerank_config.get('max_length', 512)
+    if backend == "torch":
+        return TorchCrossEncoder(model_name, device=rerank_config.get('device', 'cpu'), max_length=max_length)
+    # threads 只作用于本模型的ONNX会话
+    return ONNXCrossEncoder(
+        model_name,
+        onnx_dir=rerank_config.get('onnx_dir', 'models/onnx'),
+        quantize=rerank_config.get('quantize', True),
+        threads=rerank_config.get('threads', 4),
+        max_length=max_length
+    )
+
+
+class Reranker:
+    """交叉编码器重排：先用向量/BM25检索取较多候选，再按 (查询, 块文本) 相关性重排取前 top_k 个
+
+    候选按检索名次分批打分，每批耗时计入延迟预算（budget_ms）；预计下一批
+    会超出预算时停止，未打分的候选按检索名次排在已打分候选之后。分数为
+    相关性概率，低于 min_score 的结果被截掉（至少保留 min_keep 个）。
+    模型通过模型注册表在首次重排时加载。
+    """
+
+    def __init__(self, config: Dict, registry: Optional[ModelRegistry] = None):
+        rerank_config = config['vector_store'].get('rerank', {})
+        self.config = rerank_config
+        self.enabled = rerank_config.get('enabled', False)
+        self.candidates = rerank_config.get('candidates', 100)
+        self.top_k = rerank_config.get('top_k', 5)
+        self.batch_size = rerank_config.get('batch_size', 16)
+        self.budget_ms = rerank_config.get('budget_ms', 300)
+        self.min_score = rerank_config.get('min_score')
+        self.min_keep = rerank_config.get('min_keep', 1)
+        # 块文本按字符预先截断，分词器只需处理前面一部分
+        self.max_chars = rerank_config.get('max_chars', 1024)
+        self.registry = registry or default_registry
+        self.model_key = None
+        if not self.enabled:
+            return
+
+        backend = rerank_config.get('backend', 'onnx')
+        if backend == "onnx" and rerank_config.get('quantize', True):
+            backend = "onnx-int8"
+        self.model_key = self.registry.register(
+            f"reranker:{rerank_config.get('model', 'BAAI/bge-reranker-base')}:{backend}",
+            lambda: create_cross_encoder(self.config), group="text"
+        )
+
+    @property
+    def model(self):
+        return self.registry.get(self.model_key)
+
+    def rerank(self, query: str, hits: List[Dict], top_k: Optional[int] = None) -> Tuple[List[Dict], Dict]:
+        """重排检索结果，返回 (前 top_k 个结果, 统计)
+
+        结果的 score 为重排分数，原检索分数保存在 retrieval_score 中；
+        不修改传入的结果（检索结果可能来自缓存）。
+        """
+        top_k = top_k or self.top_k
+        # 首次加载模型的耗时不计入预算
+        model = self.model
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000
+
+        scores = {}
+        batch_seconds = 0.0
+        for batch_start in range(0, len(hits), self.batch_size):
+            # 按最慢一批的耗时预估，来不及打分的候选不再处理
+            if batch_start and time.perf_counter() + batch_seconds > deadline:
+                break
+            batch = hits[batch_start:batch_start + self.batch_size]
+            batch_begin = time.perf_counter()
+            batch_scores = model.score([(query, self._text(hit)) for hit in batch])
+            batch_seconds = max(batch_seconds, time.perf_counter() - batch_begin)
+            for offset, score in enumerate(batch_scores):
+                scores[batch_start + offset] = float(score)
+
+        scored = sorted(scores, key=lambda i: -scores[i])
+        # 预算内没打分的候选按检索名次补足，分数不高于已打分的结果
+        unscored = list(range(len(scores), len(hits)))
+        floor = min(scores.values()) if scores else None
+        if self.min_score is not None:
+            kept = [i for i in scored if scores[i] >= self.min_score]
+            if len(kept) < len(scored):
+                # 已有低于阈值的结果时，名次更靠后的未打分候选也不再补入
+                unscored = []
+            scored = kept if len(kept) >= self.min_keep else scored[:self.min_keep]
+
+        results = []
+        for i in (scored + unscored)[:top_k]:
+            hit = {**hits[i], "retrieval_score": hits[i]["score"], "rerank_score": scores.get(i)}
+            hit["score"] = scores[i] if i in scores else (floor if floor is not None else hits[i]["score"])
+            results.append(hit)
+
+        stats = {
+            "candidates": len(hits),
+            "scored": len(scores),
+            "returned": len(results),
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+            "budget_exhausted": len(scores) < len(hits)
+        }
+        return results, stats
+
+    def _text(self, hit: Dict) -> str:
+        metadata = hit.get("metadata") or {}
+        return (metadata.get("text") or metadata.get("caption") or "")[:self.max_chars]
@@ -0,0 +1,179 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from array import array
+import math
+import re
+
+import numpy as np
+
+# 连续的字母数字（型号、编码、数值）作为一个整体词元，中文按字切分
+_TOKEN_RE = re.compile(r'[0-9A-Za-z][0-9A-Za-z_.\-/]*|[一-鿿]')
+
+
+class Tokenizer:
+    """BM25分词器：中文用字的一元和二元组（或jieba分词），字母数字串保留原样"""
+
+    def __init__(self, mode: str = "ngram"):
+        if mode not in ("ngram", "jieba"):
+            raise ValueError(f"Unsupported tokenizer: {mode}")
+        self.mode = mode
+        self._jieba = None
+        if mode == "jieba":
+            import jieba
+            self._jieba = jieba
+
+    def __call__(self, text: str) -> List[str]:
+        text = text.lower()
+        if self._jieba is not None:
+            return [token for token in self._jieba.cut_for_search(text) if token.strip()]
+
+        tokens = []
+        prev_cjk = None
+        for match in _TOKEN_RE.finditer(text):
+            token = match.group()
+            if len(token) == 1 and "一" <= token <= "鿿":
+                tokens.append(token)
+                # 相邻的汉字组成二元组
+                if prev_cjk is not None and prev_cjk == match.start() - 1:
+                    tokens.append(text[prev_cjk] + token)
+                prev_cjk = match.start()
+            else:
+                tokens.append(token.strip("._-/"))
+                prev_cjk = None
+        return [token for token in tokens if token]
+
+
+class BM25Index:
+    """BM25稀疏倒排索引
+
+    每个词的倒排表由两个定长数组（块id、词频）组成，块长度按id保存在
+    数组中。删除只把块长度置零，检索时过滤，compact 时清除。
+    """
+
+    def __init__(self, config: Dict):
+        sparse_config = config['vector_store'].get('sparse', {})
+        self.k1 = sparse_config.get('k1', 1.5)
+        self.b = sparse_config.get('b', 0.75)
+        self.tokenizer = Tokenizer(sparse_config.get('tokenizer', 'ngram'))
+
+        self._postings = {}
+        self._doc_len = array('I')
+        self._num_docs = 0
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return self._num_docs
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]):
+        for chunk_id, text in zip(ids, texts):
+            tokens = self.tokenizer(text)
+            if chunk_id >= len(self._doc_len):
+                self._doc_len.extend([0] * (chunk_id + 1 - len(self._doc_len)))
+            if self._doc_len[chunk_id]:
+                continue
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                posting = self._postings.get(token)
+                if posting is None:
+                    posting = self._postings[token] = (array('q'), array('I'))
+                posting[0].append(chunk_id)
+                posting[1].append(tf)
+            # 空文本也占一个长度，保证能被删除和统计
+            self._doc_len[chunk_id] = max(len(tokens), 1)
+            self._num_docs += 1
+            self._total_len += len(tokens)
+
+    def remove(self, ids: Iterable[int]):
+        for chunk_id in ids:
+            if 0 <= chunk_id < len(self._doc_len) and self._doc_len[chunk_id]:
+                self._total_len -= self._doc_len[chunk_id]
+                self._num_docs -= 1
+                self._doc_len[chunk_id] = 0
+
+    def compact(self):
+        """从倒排表中清除已删除的块"""
+        doc_len = np.frombuffer(self._doc_len, dtype=np.uint32) if len(self._doc_len) else np.zeros(0, np.uint32)
+        for token in list(self._postings):
+            ids, tfs = self._postings[token]
+            ids_np = np.frombuffer(ids, dtype=np.int64)
+            keep = doc_len[ids_np] > 0
+            if keep.all():
+                continue
+            if not keep.any():
+                del self._postings[token]
+                continue
+            self._postings[token] = (
+                array('q', ids_np[keep].tobytes()),
+                array('I', np.frombuffer(tfs, dtype=np.uint32)[keep].tobytes())
+            )
+
+    def clear(self):
+        self._postings = {}
+        self._doc_len = array('I')
+        self._num_docs = 0
+        self._total_len = 0
+
+    def search(self, query: str, top_k: int) -> Tuple[List[Tuple[int, float]], int]:
+        """返回按BM25分数降序的 (块id, 分数)，以及包含全部查询词的块数"""
+        terms = [term for term in dict.fromkeys(self.tokenizer(query)) if term in self._postings]
+        if not terms or not self._num_docs:
+            return [], 0
+
+        doc_len = np.frombuffer(self._doc_len, dtype=np.uint32).astype(np.float32)
+        avgdl = max(self._total_len / self._num_docs, 1.0)
+        all_ids = []
+        all_scores = []
+        for term in terms:
+            ids, tfs = self._postings[term]
+            ids = np.frombuffer(ids, dtype=np.int64)
+            tfs = np.frombuffer(tfs, dtype=np.uint32).astype(np.float32)
+            lengths = doc_len[ids]
+            live = lengths > 0
+            ids, tfs, lengths = ids[live], tfs[live], lengths[live]
+            if not len(ids):
+                continue
+            idf = math.log(1 + (self._num_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = tfs + self.k1 * (1 - self.b + self.b * lengths / avgdl)
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (self.k1 + 1) / norm)
+        if not all_ids:
+            return [], 0
+
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        matched = np.bincount(inverse, minlength=len(ids))
+        exact = int((matched == len(terms)).sum()) if len(terms) == len(set(self.tokenizer(query))) else 0
+
+        k = min(top_k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top], exact
+
+
+def fuse_results(dense: List[Tuple[int, float]], sparse: List[Tuple[int, float]], top_k: int,
+                 method: str = "rrf", rrf_k: int = 60, dense_weight: float = 1.0,
+                 sparse_weight: float = 1.0) -> List[Tuple[int, float, Optional[float], Optional[float]]]:
+    """融合稠密与稀疏检索结果，返回 (块id, 融合分数, 稠密分数, 稀疏分数)"""
+    fused = {}
+    legs = ((0, dense, dense_weight), (1, sparse, sparse_weight))
+    for leg, hits, weight in legs:
+        if not hits:
+            continue
+        if method == "rrf":
+            contributions = [weight / (rrf_k + rank + 1) for rank in range(len(hits))]
+        elif method == "weighted":
+            # 各路分数按最大最小值归一化后加权
+            scores = [score for _, score in hits]
+            low, high = min(scores), max(scores)
+            contributions = [weight * ((score - low) / (high - low) if high > low else 1.0) for score in scores]
+        else:
+            raise ValueError(f"Unsupported fusion method: {method}")
+        for (chunk_id, score), contribution in zip(hits, contributions):
+            entry = fused.setdefault(chunk_id, [0.0, None, None])
+            entry[0] += contribution
+            entry[leg + 1] = score
+
+    ranked = sorted(fused.items(), key=lambda item: -item[1][0])[:top_k]
+    return [(chunk_id, total, dense_score, sparse_score)
+            for chunk_id, (total, dense_score, sparse_score) in ranked]
@@ -1,20 +1,41 @@
-from typing import List, Dict, Union, Optional
+from typing import List, Dict, Union, Optional, Iterable, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import numpy as np
 import faiss
 import json
 import os
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModel
+import shutil
+import threading
+
+from .chunker import TextChunker
+from .batcher import QueryBatcher
+from .cache import LRUCache, normalize_text, embedding_key, text_key
+from .index_factory import ManagedIndex, merge_search_results, set_query_params, iter_index_vectors
+from .persistence import SegmentStore, MANIFEST_NAME, METADATA_DB, SEGMENT_DIR
+from .metadata import ColumnarMetadata
+from .sparse import BM25Index, fuse_results
+from .encoders import create_encoder, encoder_id, encoder_parity
+from .embedding_cache import EmbeddingCache, content_key
+from .image_index import ImageIndex
+from src.models.registry import ModelRegistry, default_registry
+
+SEARCH_MODES = ("dense", "sparse", "hybrid")
 
 class VectorStore:
     """向量存储类，使用FAISS进行向量索引和检索"""
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, registry: Optional[ModelRegistry] = None):
         self.config = config
+        self.registry = registry or default_registry
         self.dimension = config['vector_store']['dimension']
         self.index_type = config['vector_store']['index_type']
         self.nlist = config['vector_store']['nlist']
         self.nprobe = config['vector_store']['nprobe']
+        self.encode_batch_size = config['vector_store'].get('encode_batch_size', 64)
+        
+        # 初始化文档分块器
+        self.chunker = TextChunker(config)
         
         # 初始化向量索引
         self._init_index()
@@ -22,95 +43,785 @@ class VectorStore:
         # 初始化文本编码器
         self._init_encoder()
         
-        # 存储文档元数据
-        self.metadata = []
+        # 图像向量索引（以块id对齐图片块），以文搜图的结果与文本检索融合
+        self.image_index = ImageIndex(config, self.registry)
+        self.image_weight = config['vector_store'].get('image_index', {}).get('weight', 1.0)
+        
+        # BM25稀疏索引与融合检索，稀疏检索与查询编码并行执行
+        sparse = config['vector_store'].get('sparse', {})
+        hybrid = config['vector_store'].get('hybrid', {})
+        self.sparse = BM25Index(config) if sparse.get('enabled', True) else None
+        self.search_mode = hybrid.get('mode', 'hybrid' if self.sparse is not None else 'dense')
+        self.fusion = hybrid.get('fusion', 'rrf')
+        self.rrf_k = hybrid.get('rrf_k', 60)
+        self.dense_weight = hybrid.get('dense_weight', 1.0)
+        self.sparse_weight = hybrid.get('sparse_weight', 1.0)
+        self.hybrid_candidates = hybrid.get('candidates', 2)
+        self._sparse_executor = None
+        if self.sparse is not None:
+            self._sparse_executor = ThreadPoolExecutor(
+                max_workers=sparse.get('workers', 2), thread_name_prefix="bm25"
+            )
+        
+        # 存储文档元数据（列式存储，仅包含尚未提交到磁盘的部分）
+        self.metadata = ColumnarMetadata()
+        
+        # 已提交到磁盘的只读分段；块id全局递增、删除后不复用
+        self.mmap = config['vector_store'].get('mmap', True)
+        self._store = None
+        self._segments = []
+        self._next_id = 0
+        # 无法物理删除的向量（磁盘分段、HNSW）记为删除标记，压缩时清除
+        self._deleted = set()
+        # 尚未提交的文档内容哈希，None表示文档已删除
+        self._doc_hashes = {}
+        self.max_oversample = config['vector_store'].get('max_oversample', 256)
+        
+        compaction = config['vector_store'].get('compaction', {})
+        self.compact_deleted_ratio = compaction.get('deleted_ratio', 0.2)
+        self.compact_max_segments = compaction.get('max_segments', 16)
+        
+        # 后台导入与查询并发访问索引时加锁
+        self._lock = threading.RLock()
+        # 同一文档的导入和删除按文档串行：来源 -> [锁, 使用者数]
+        self._source_locks = {}
+        self._source_locks_guard = threading.Lock()
+        
+        # 查询缓存：查询文本 -> 向量，(向量, top_k, 索引版本) -> 检索结果
+        self.index_version = 0
+        self._embedding_cache = LRUCache.from_config(config, 'embedding', max_size=4096, ttl=3600)
+        self._search_cache = LRUCache.from_config(config, 'search', max_size=4096, ttl=600)
+        
+        # 查询微批处理：并发查询合并为一次编码和一次检索
+        batching = config['vector_store'].get('batching', {})
+        self._batcher = None
+        if batching.get('enabled', False):
+            self._batcher = QueryBatcher(
+                self.search_batch,
+                max_batch_size=batching.get('max_batch_size', 32),
+                max_wait_ms=batching.get('max_wait_ms', 5)
+            )
     
     def _init_index(self):
-        """初始化FAISS索引"""
-        if self.index_type == "L2":
-            self.index = faiss.IndexFlatL2(self.dimension)
-        elif self.index_type == "IP":
-            self.index = faiss.IndexFlatIP(self.dimension)
-        else:
-            raise ValueError(f"Unsupported index type: {self.index_type}")
-        
-        # 如果使用IVF索引
-        if self.nlist > 0:
-            self.index = faiss.IndexIVFFlat(
-                self.index, self.dimension, self.nlist, faiss.METRIC_L2
-            )
-            self.index.nprobe = self.nprobe
+        """初始化FAISS索引，索引结构由 index_factory 配置（预置名称或FAISS工厂字符串）"""
+        self.index = ManagedIndex(self.config)
     
     def _init_encoder(self):
-        """初始化文本编码器"""
-        # 使用BGE模型进行文本编码
-        self.encoder = SentenceTransformer('BAAI/bge-large-zh')
-    
-    def add_documents(self, documents: List[Dict]):
-        """添加文档到向量存储"""
-        # 提取文本和元数据
-        texts = []
-        for doc in documents:
-            # 组合文本内容
-            text = ""
-            if "text" in doc:
-                text += doc["text"]
-            if "caption" in doc:
-                text += f" [图片描述] {doc['caption']}"
-            if "table" in doc:
-                text += f" [表格内容] {json.dumps(doc['table'], ensure_ascii=False)}"
-            
-            texts.append(text)
-            self.metadata.append({
-                "source": doc.get("source", ""),
-                "type": doc.get("type", "text"),
-                "page": doc.get("page", 0)
-            })
+        """登记文本编码器，后端由 vector_store.encoder 配置（默认BGE的PyTorch fp32模型）
+
+        编码器通过模型注册表在首次编码时加载。
+        """
+        self.encoder_parity = None
+        self.encoder_key = self.registry.register(
+            f"encoder:{encoder_id(self.config)}", self._load_encoder, group="text"
+        )
         
-        # 编码文本
-        embeddings = self.encoder.encode(texts, convert_to_numpy=True)
+        # 磁盘上的文档块向量缓存，在第一次导入时才创建（见 embedding_store）
+        self._embedding_store = None
+        self._embedding_store_created = False
+        self._embedding_store_lock = threading.Lock()
+    
+    def _load_encoder(self):
+        encoder = create_encoder(self.config)
+        if encoder.dimension != self.dimension:
+            raise ValueError(
+                f"Encoder {encoder.model_name} produces {encoder.dimension}-d vectors, "
+                f"but vector_store.dimension is {self.dimension}"
+            )
+        
+        # 非基准后端配置了留出集时，按导出模型记录的对照报告检查召回损失，超出上限则拒绝加载；
+        # 报告只在模型导出后第一次加载（或运行 encoders 命令行）时计算
+        self.encoder_parity = encoder_parity(self.config, candidate=encoder)
+        if self.encoder_parity is not None:
+            max_drop = self.config['vector_store'].get('encoder', {}).get('max_recall_drop', 0.02)
+            if -self.encoder_parity["recall_delta"] > max_drop:
+                raise ValueError(
+                    f"Encoder backend {encoder.backend} loses "
+                    f"{-self.encoder_parity['recall_delta']:.4f} recall@k against fp32 (limit {max_drop})"
+                )
+        return encoder
+    
+    @property
+    def encoder(self):
+        return self.registry.get(self.encoder_key)
+    
+    @property
+    def embedding_store(self) -> Optional[EmbeddingCache]:
+        """文档块向量缓存，按 (模型, 文本哈希) 寻址，跨导入任务和进程共享
+
+        只在导入时用到：第一次访问时才创建缓存目录和SQLite文件，只读副本不创建。
+        """
+        if self.read_only:
+            return None
+        with self._embedding_store_lock:
+            if not self._embedding_store_created:
+                self._embedding_store = EmbeddingCache.from_config(
+                    self.config, encoder_id(self.config), self.dimension
+                )
+                self._embedding_store_created = True
+            return self._embedding_store
+    
+    def add_documents(self, documents: List[Dict]) -> int:
+        """添加文档到向量存储，每个文档块对应一个向量
+
+        同名文档按 upsert_document 更新。返回新增的块数。
+        """
+        return sum(self.upsert_document(doc) for doc in documents)
+    
+    def upsert_document(self, document: Dict, content_hash: Optional[str] = None) -> int:
+        """新增或更新一个文档
+
+        content_hash 与上次导入相同时直接跳过；否则重新切分，内容未变的块
+        保留原有向量和id，只编码新的块，并删除不再出现的旧块。文档块以
+        有界批次流式送入编码器，内存占用不随文档长度增长。返回新增的块数。
+        """
+        source = document.get("source", "")
+        # 读取现有块到删除旧块之间会释放存储锁，同一文档的并发导入须串行，否则新块会重复
+        with self._source_lock(source):
+            return self._upsert_document(document, source, content_hash)
+    
+    @contextmanager
+    def _source_lock(self, source: str):
+        """按文档来源加锁，不再使用的锁随即移除"""
+        with self._source_locks_guard:
+            entry = self._source_locks.setdefault(source, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._source_locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._source_locks[source]
+    
+    def _upsert_document(self, document: Dict, source: str, content_hash: Optional[str]) -> int:
+        with self._lock:
+            if self.has_document(source, content_hash):
+                return 0
+            # 内容哈希 -> 现有块id
+            existing = {}
+            for chunk_id, chunk_hash in self._chunk_hashes(source):
+                existing.setdefault(chunk_hash, []).append(chunk_id)
+        
+        batch = []
+        added = 0
+        for chunk in self.chunker.split(document):
+            chunk["hash"] = self._chunk_hash(chunk)
+            if existing.get(chunk["hash"]):
+                existing[chunk["hash"]].pop()
+                continue
+            batch.append(chunk)
+            if len(batch) >= self.encode_batch_size:
+                added += self._add_chunks(batch)
+                batch = []
+        if batch:
+            added += self._add_chunks(batch)
+        
+        with self._lock:
+            self._delete_ids([chunk_id for ids in existing.values() for chunk_id in ids])
+            self._doc_hashes[source] = content_hash
+            self._bump_version()
+        return added
+    
+    def delete_document(self, source: str) -> int:
+        """删除一个文档的所有块，返回删除的块数"""
+        with self._source_lock(source), self._lock:
+            ids = [chunk_id for chunk_id, _ in self._chunk_hashes(source)]
+            self._delete_ids(ids)
+            self._doc_hashes[source] = None
+            self._bump_version()
+        return len(ids)
+    
+    def has_document(self, source: str, content_hash: Optional[str]) -> bool:
+        """文档是否已以相同内容导入"""
+        if content_hash is None:
+            return False
+        with self._lock:
+            if source in self._doc_hashes:
+                return self._doc_hashes[source] == content_hash
+            return self._store is not None and self._store.metadata.document_hash(source) == content_hash
+    
+    @staticmethod
+    def _chunk_hash(chunk: Dict) -> str:
+        """块的内容哈希：模态、页码和文本相同即视为同一块，图片块还须图片内容相同"""
+        # 旧格式的元数据没有保存块文本
+        parts = [chunk.get("modality", "text"), chunk.get("page", 0), chunk.get("text", "")]
+        if chunk.get("image_hash"):
+            parts.append(chunk["image_hash"])
+        return text_key(*parts)[:16]
+    
+    def _chunk_hashes(self, source: str) -> List:
+        """某个文档现有的 (块id, 内容哈希)，不含已删除的块"""
+        rows = []
+        if self._store is not None:
+            rows = [
+                (chunk_id, chunk_hash)
+                for chunk_id, chunk_hash in self._store.metadata.chunk_hashes(source, self.metadata.start_id)
+                if chunk_id not in self._deleted
+            ]
+        return rows + self.metadata.chunk_hashes(source)
+    
+    def _delete_ids(self, ids: Iterable[int]):
+        """删除块：内存中的向量直接移除，其余记为删除标记"""
+        ids = list(ids)
+        if self.sparse is not None:
+            self.sparse.remove(ids)
+        self.image_index.remove_ids(ids)
+        live = []
+        for chunk_id in ids:
+            if chunk_id in self.metadata:
+                self.metadata.delete(chunk_id)
+                live.append(chunk_id)
+            else:
+                self._deleted.add(chunk_id)
+        if live and not self.index.remove_ids(live):
+            self._deleted.update(live)
+    
+    def _add_chunks(self, chunks: List[Dict]) -> int:
+        """编码一批文档块并以新的id加入索引，图片块的图像特征写入图像索引
+
+        只有图像特征的块（image_only）不编码文本、不进入文本索引。
+        """
+        features = [chunk.pop("features", None) for chunk in chunks]
+        positions = [i for i, chunk in enumerate(chunks) if not chunk.get("image_only")]
+        texts = [chunks[i]["text"] for i in positions]
+        embeddings = self._encode_texts(texts) if texts else None
         
         # 添加到索引
-        self.index.add(embeddings.astype(np.float32))
+        with self._lock:
+            ids = np.arange(self._next_id, self._next_id + len(chunks), dtype=np.int64)
+            if embeddings is not None:
+                self.index.add(embeddings.astype(np.float32), ids[positions])
+                if self.sparse is not None:
+                    self.sparse.add(ids[positions].tolist(), texts)
+            images = {}
+            for chunk_id, chunk, feature in zip(ids.tolist(), chunks, features):
+                if feature is not None:
+                    images.setdefault(chunk.get("image_model") or "clip", []).append((chunk_id, feature))
+            for model, items in images.items():
+                self.image_index.add(model, [chunk_id for chunk_id, _ in items], [f for _, f in items])
+            self.metadata.extend(chunks)
+            self._next_id += len(chunks)
+            self._bump_version()
+        return len(chunks)
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """搜索相似文档"""
-        # 编码查询
-        query_embedding = self.encoder.encode([query], convert_to_numpy=True)
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """编码文档块文本，先查磁盘向量缓存，未命中的文本合并为一批编码"""
+        embedding_store = self.embedding_store
+        if embedding_store is None:
+            return self.encoder.encode(texts, batch_size=self.encode_batch_size, convert_to_numpy=True)
         
-        # 搜索最相似的文档
-        distances, indices = self.index.search(
-            query_embedding.astype(np.float32), top_k
-        )
+        keys = [content_key(text) for text in texts]
+        embeddings = embedding_store.get_many(keys)
+        # 同一批中重复的文本只编码一次
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(keys[i], []).append(i)
+        if missing:
+            encoded = np.asarray(self.encoder.encode(
+                [texts[indices[0]] for indices in missing.values()],
+                batch_size=self.encode_batch_size,
+                convert_to_numpy=True
+            ), dtype=np.float32)
+            embedding_store.put_many(list(missing), encoded)
+            for indices, embedding in zip(missing.values(), encoded):
+                for i in indices:
+                    embeddings[i] = embedding
+        return np.stack(embeddings).astype(np.float32)
+    
+    def _bump_version(self):
+        """索引内容变化后更新版本号，使旧的检索缓存失效"""
+        self.index_version += 1
+        self._search_cache.clear()
+    
+    def search(self, query: str, top_k: int = 5, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, mode: Optional[str] = None) -> List[Dict]:
+        """搜索相似文档
+
+        mode 为 dense（向量）、sparse（BM25）或 hybrid（两路融合），默认取配置；
+        nprobe/ef_search 用于在查询时调整IVF/HNSW的检索精度。
+        """
+        if self._batcher is not None:
+            return self._batcher.submit(query, top_k, nprobe=nprobe, ef_search=ef_search, mode=mode)
+        return self.search_batch([query], top_k, nprobe=nprobe, ef_search=ef_search, mode=mode)[0]
+    
+    def search_batch(self, queries: List[str], top_k: int = 5, nprobe: Optional[int] = None,
+                     ef_search: Optional[int] = None, mode: Optional[str] = None) -> List[List[Dict]]:
+        """批量搜索，一次编码和一次检索处理所有未命中缓存的查询"""
+        mode = mode or self.search_mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unsupported search mode: {mode}")
+        if mode != "dense" and self.sparse is None:
+            raise ValueError("Sparse retrieval is disabled")
+        candidates = top_k * self.hybrid_candidates if mode == "hybrid" else top_k
         
-        # 准备结果
-        results = []
-        for i, (distance, idx) in enumerate(zip(distances[0], indices[0])):
-            if idx != -1:  # 有效的索引
-                results.append({
-                    "score": float(1 / (1 + distance)),  # 转换为相似度分数
-                    "metadata": self.metadata[idx]
-                })
+        # 稀疏检索在后台执行，同时编码查询
+        sparse_future = None
+        if mode != "dense":
+            sparse_future = self._sparse_executor.submit(self._search_sparse, queries, candidates)
+        query_embeddings = self._encode_queries(queries) if mode != "sparse" else None
+        
+        # 先查缓存，以文搜图只为未命中的查询编码
+        index_version = self.index_version
+        keys = [
+            (
+                embedding_key(query_embeddings[i]) if mode == "dense" else normalize_text(query),
+                top_k, nprobe, ef_search, mode, index_version
+            )
+            for i, query in enumerate(queries)
+        ]
+        results = [self._search_cache.get(key) for key in keys]
+        pending = [i for i, hits in enumerate(results) if hits is None]
+        if not pending:
+            if sparse_future is not None:
+                sparse_future.result()
+            return results
         
+        # 以文搜图（CLIP文本塔），只在图像索引中有clip向量时进行
+        image_results = None
+        if mode != "sparse" and self.image_index.searchable_by_text(self.read_only):
+            image_results = dict(zip(pending, self.image_index.search_text(
+                [queries[i] for i in pending], candidates
+            )))
+        sparse_results = sparse_future.result() if sparse_future is not None else None
+        
+        with self._lock:
+            dense_results = None
+            if mode != "sparse":
+                dense_ks = [candidates] * len(pending)
+                if mode == "hybrid":
+                    # 稀疏检索已有精确匹配（包含全部查询词）时，稠密检索少取一些候选；
+                    # 按各查询自己的匹配数截断，结果不受同批其他查询影响
+                    dense_ks = [max(top_k, candidates - sparse_results[i][1]) for i in pending]
+                dense_results = [
+                    hits[:k] for hits, k in zip(
+                        self._search_dense(query_embeddings[pending], max(dense_ks), nprobe, ef_search), dense_ks
+                    )
+                ]
+            
+            # 融合两路结果，每个查询得到 (块id, 分数, 稠密分数, 稀疏分数)
+            ranked = []
+            for n, i in enumerate(pending):
+                if mode == "dense":
+                    ranked.append([(idx, score, score, None) for idx, score in dense_results[n]])
+                elif mode == "sparse":
+                    ranked.append([(idx, score, None, score) for idx, score in sparse_results[i][0]])
+                else:
+                    ranked.append(fuse_results(
+                        dense_results[n], sparse_results[i][0], candidates, self.fusion,
+                        self.rrf_k, self.dense_weight, self.sparse_weight
+                    ))
+            # 再与以文搜图的结果融合，每个结果附加图像分数
+            ranked = [
+                self._fuse_images(hits, image_results[i], candidates) if image_results and image_results.get(i)
+                else [(*hit, None) for hit in hits]
+                for i, hits in zip(pending, ranked)
+            ]
+            metadata = self.get_metadata([idx for hits in ranked for idx, *_ in hits])
+            
+            # 准备结果
+            for i, hits in zip(pending, ranked):
+                results[i] = []
+                for idx, score, dense_score, sparse_score, image_score in hits:
+                    # 跳过已删除的结果
+                    if idx not in metadata:
+                        continue
+                    hit = {"id": idx, "score": score, "metadata": metadata[idx]}
+                    if mode == "hybrid":
+                        hit["dense_score"] = dense_score
+                        hit["sparse_score"] = sparse_score
+                    if image_score is not None:
+                        hit["image_score"] = image_score
+                    results[i].append(hit)
+                    if len(results[i]) >= top_k:
+                        break
+                self._search_cache.put(keys[i], results[i])
+        
+        return results
+    
+    def _fuse_images(self, hits: List[Tuple], images: List[Tuple[int, float]],
+                     top_k: int) -> List[Tuple[int, float, Optional[float], Optional[float], Optional[float]]]:
+        """融合文本检索与以文搜图的结果，返回 (块id, 融合分数, 稠密分数, 稀疏分数, 图像分数)"""
+        text_scores = {idx: (dense_score, sparse_score) for idx, _, dense_score, sparse_score in hits}
+        fused = fuse_results(
+            [(idx, score) for idx, score, _, _ in hits], images, top_k, self.fusion,
+            self.rrf_k, 1.0, self.image_weight
+        )
+        return [(idx, score, *text_scores.get(idx, (None, None)), image_score)
+                for idx, score, _, image_score in fused]
+    
+    def search_images(self, features, model: str, top_k: int = 5) -> List[Dict]:
+        """以图搜图：按查询图片的特征（须与导入时同一图像模型）检索相似的图片块"""
+        hits = self.image_index.search_features(model, features, top_k)
+        with self._lock:
+            metadata = self.get_metadata([idx for idx, _ in hits])
+        return [{"id": idx, "score": score, "metadata": metadata[idx]}
+                for idx, score in hits if idx in metadata]
+    
+    def _search_dense(self, queries: np.ndarray, top_k: int, nprobe: Optional[int],
+                      ef_search: Optional[int]) -> List[List[Tuple[int, float]]]:
+        """向量检索，返回每个查询的 (块id, 相似度分数)，已过滤删除标记"""
+        # 多取一些结果以抵消删除标记
+        oversample = min(len(self._deleted), self.max_oversample)
+        distances, indices = self._search_index(queries, top_k + oversample, nprobe, ef_search)
+        results = []
+        for row_distances, row_indices in zip(distances, indices):
+            hits = []
+            for distance, idx in zip(row_distances, row_indices):
+                if idx == -1 or int(idx) in self._deleted:
+                    continue
+                hits.append((int(idx), self.index.to_score(distance)))  # 转换为相似度分数
+                if len(hits) >= top_k:
+                    break
+            results.append(hits)
         return results
     
+    def _search_sparse(self, queries: List[str], top_k: int) -> List[Tuple[List[Tuple[int, float]], int]]:
+        """BM25检索，返回每个查询的 (结果, 精确匹配数)"""
+        with self._lock:
+            return [self.sparse.search(query, top_k) for query in queries]
+    
+    def _search_index(self, queries: np.ndarray, top_k: int, nprobe: Optional[int],
+                      ef_search: Optional[int]):
+        """在内存中的增量索引和磁盘分段上检索并合并结果"""
+        results = [self.index.search(queries, top_k, nprobe=nprobe, ef_search=ef_search)]
+        for segment in self._segments:
+            set_query_params(
+                segment.index, nprobe or self.index.nprobe, ef_search or self.index.ef_search
+            )
+            results.append(segment.index.search(queries, top_k))
+        return merge_search_results(results, top_k, self.index.metric)
+    
+    def get_metadata(self, ids: List[int]) -> Dict[int, Dict]:
+        """按id读取元数据，已提交的部分从SQLite惰性读取；已删除的id不返回"""
+        found = {}
+        persisted = [idx for idx in ids if idx < self.metadata.start_id and idx not in self._deleted]
+        if persisted and self._store is not None:
+            found.update(self._store.metadata.get_many(persisted))
+        for idx in ids:
+            if idx >= self.metadata.start_id:
+                row = self.metadata.get(idx)
+                if row is not None:
+                    found[idx] = row
+        return found
+    
+    def iter_metadata(self):
+        """按id顺序遍历所有元数据"""
+        if self._store is not None:
+            yield from self._store.metadata.iter_rows(limit=self.metadata.start_id)
+        yield from self.metadata
+    
+    def list_documents(self, offset: int = 0, limit: int = 50) -> Dict:
+        """按文档聚合的分页视图，每个文档一行"""
+        with self._lock:
+            documents = {}
+            if self._store is not None:
+                for doc in self._store.metadata.documents(self.metadata.start_id):
+                    if doc["source"] in self._doc_hashes:
+                        # 有未提交的删除，按剩余的块重新统计
+                        doc = self._persisted_document(doc["source"])
+                        if doc is None:
+                            continue
+                    documents[doc["source"]] = doc
+            for doc in self.metadata.documents():
+                merged = documents.get(doc["source"])
+                if merged is None:
+                    documents[doc["source"]] = doc
+                else:
+                    # 同一文档的块可能分布在磁盘分段和内存中，页数按两边页码的并集统计
+                    merged["chunks"] += doc["chunks"]
+                    merged["pages"] = len(
+                        self._persisted_pages(doc["source"]) | self.metadata.document_pages(doc["source"])
+                    )
+                    merged["modalities"] = sorted(set(merged["modalities"]) | set(doc["modalities"]))
+        
+        rows = list(documents.values())
+        return {
+            "total": len(rows),
+            "offset": offset,
+            "limit": limit,
+            "documents": rows[offset:offset + limit]
+        }
+    
+    def _persisted_rows(self, source: str) -> List[Tuple[int, str]]:
+        """某个文档已提交且未删除的 (页码, 模态)"""
+        return [
+            (page, modality)
+            for chunk_id, page, modality in self._store.metadata.document_rows(source, self.metadata.start_id)
+            if chunk_id not in self._deleted
+        ]
+    
+    def _persisted_pages(self, source: str) -> Set[int]:
+        return {page for page, _ in self._persisted_rows(source)} - {0, None}
+    
+    def _persisted_document(self, source: str) -> Optional[Dict]:
+        rows = self._persisted_rows(source)
+        if not rows:
+            return None
+        return {
+            "source": source,
+            "chunks": len(rows),
+            "pages": len({page for page, _ in rows} - {0, None}),
+            "modalities": sorted({modality for _, modality in rows if modality})
+        }
+    
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """编码查询，命中缓存的查询不再重复编码"""
+        normalized = [normalize_text(query) for query in queries]
+        embeddings = [self._embedding_cache.get(text) for text in normalized]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = self.encoder.encode(
+                [queries[i] for i in missing],
+                batch_size=self.encode_batch_size,
+                convert_to_numpy=True
+            ).astype(np.float32)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                self._embedding_cache.put(normalized[i], embedding)
+        return np.stack(embeddings).astype(np.float32)
+    
+    def cache_stats(self) -> Dict:
+        """返回各层缓存的命中统计"""
+        return {
+            "embedding": self._embedding_cache.stats(),
+            "search": self._search_cache.stats(),
+            "embedding_store": self._embedding_store.stats() if self._embedding_store is not None else None,
+            "image_index": self.image_index.stats(),
+            "index_version": self.index_version
+        }
+    
     def save(self, path: str):
-        """保存向量存储到磁盘"""
-        # 创建目录
-        os.makedirs(path, exist_ok=True)
+        """提交新增向量和删除到磁盘
+
+        新增的向量写为一个增量分段，元数据追加到SQLite，最后原子替换
+        manifest；已提交的分段不会被重写。删除标记过多或分段过多时自动压缩。
+        """
+        if self.read_only:
+            raise ValueError("Vector store is opened read-only")
+        with self._lock:
+            store = self._open_store(path)
+            # 图像索引随manifest一起提交，与 next_id 保持一致
+            segment = store.commit(
+                self.index.snapshot(),
+                self.metadata.items(),
+                self._next_id,
+                self._deleted,
+                template=self.index.trained_template(),
+                trained_on=self.index.trained_on,
+                documents=self._doc_hashes,
+                image_indexes=self.image_index.dirty_snapshots()
+            )
+            self.image_index.mark_saved(store.manifest.get("image_indexes") or {})
+            self._doc_hashes = {}
+            
+            # 已提交的数据改由内存映射的分段提供
+            if segment is not None:
+                self._segments.append(segment)
+            self.index.clear()
+            self.metadata = ColumnarMetadata(start_id=self._next_id)
+            
+            if self._needs_compaction():
+                self.compact()
+    
+    def compact(self):
+        """压缩：去掉被删除的向量，把所有分段和内存中的向量合并为一个新索引"""
+        with self._lock:
+            if self.sparse is not None:
+                self.sparse.compact()
+            index = ManagedIndex(self.config)
+            sources = [segment.index for segment in self._segments]
+            deleted = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+            for source in sources:
+                for vectors, ids in iter_index_vectors(source):
+                    keep = ~np.isin(ids, deleted)
+                    if keep.any():
+                        index.add(vectors[keep], ids[keep])
+            for vectors, ids in self.index.iter_vectors():
+                keep = ~np.isin(ids, deleted)
+                if keep.any():
+                    index.add(vectors[keep], ids[keep])
+            
+            if self._store is None:
+                # 尚未持久化时只有内存索引
+                self.index = index
+                self._deleted = set()
+                self._bump_version()
+                return
+            
+            segment = self._store.rewrite(
+                index.snapshot(),
+                self.metadata.items(),
+                self._next_id,
+                self._deleted,
+                template=index.trained_template(),
+                trained_on=index.trained_on,
+                documents=self._doc_hashes,
+                image_indexes=self.image_index.dirty_snapshots()
+            )
+            self.image_index.mark_saved(self._store.manifest.get("image_indexes") or {})
+            self._segments = [segment] if segment is not None else []
+            self._deleted = set()
+            self._doc_hashes = {}
+            self.index = ManagedIndex(self.config)
+            template = self._store.load_template()
+            if template is not None:
+                self.index.adopt(template, self._store.manifest.get("trained_on", 0))
+            self.metadata = ColumnarMetadata(start_id=self._next_id)
+            self._bump_version()
+    
+    def _needs_compaction(self) -> bool:
+        if len(self._segments) > self.compact_max_segments:
+            return True
+        total = sum(segment.count for segment in self._segments)
+        return bool(self._deleted) and len(self._deleted) >= total * self.compact_deleted_ratio
+    
+    def load(self, path: str, read_only: bool = False):
+        """从磁盘加载向量存储，索引分段以内存映射方式打开，元数据按需读取
+
+        read_only 为 True 时作为只读副本加载：多个进程映射同一份分段，
+        不能写入，通过 refresh 跟随写入进程提交的新快照。
+        """
+        # 加载失败时删除本次新建的分段目录和元数据库，旧格式目录保持原样
+        created = [name for name in (SEGMENT_DIR, METADATA_DB) if not os.path.exists(os.path.join(path, name))]
+        store = SegmentStore(path, mmap=self.mmap, read_only=read_only)
+        try:
+            self._load_store(store, path)
+        except BaseException:
+            store.metadata.close()
+            if not read_only:
+                for name in created:
+                    target = os.path.join(path, name)
+                    if os.path.isdir(target):
+                        shutil.rmtree(target, ignore_errors=True)
+                    for suffix in ("", "-wal", "-shm"):
+                        if os.path.isfile(target + suffix):
+                            os.remove(target + suffix)
+            self._store = None
+            raise
+    
+    def _load_store(self, store: SegmentStore, path: str):
+        legacy_index = os.path.join(path, "index.faiss")
+        read_only = store.read_only
+        with self._lock:
+            self._store = store
+            self._segments = store.load_segments()
+            self._next_id = store.next_id
+            self._deleted = store.deleted
+            self._doc_hashes = {}
+            self.index = ManagedIndex(self.config)
+            self.metadata = ColumnarMetadata(start_id=self._next_id)
+            
+            template = store.load_template() if not read_only else None
+            if template is not None:
+                self.index.adopt(template, store.manifest.get("trained_on", 0))
+            
+            # 旧格式（index.faiss + metadata.json）整体读入，按位置分配id，下次保存时转为分段格式
+            if not store.exists() and os.path.exists(legacy_index):
+                legacy = faiss.read_index(legacy_index)
+                ivf = faiss.try_extract_index_ivf(legacy)
+                if ivf is not None:
+                    ivf.make_direct_map()
+                with open(os.path.join(path, "metadata.json"), "r", encoding="utf-8") as f:
+                    rows = json.load(f)
+                for row in rows:
+                    row["hash"] = self._chunk_hash(row)
+                self.metadata = ColumnarMetadata(rows)
+                if legacy.ntotal:
+                    self.index.add(legacy.reconstruct_n(0, legacy.ntotal),
+                                   np.arange(legacy.ntotal, dtype=np.int64))
+                self._next_id = legacy.ntotal
+            
+            self.image_index.clear()
+            self.image_index.adopt(store.load_image_indexes())
+            self._rebuild_sparse()
+            self._bump_version()
+    
+    @property
+    def read_only(self) -> bool:
+        return self._store is not None and self._store.read_only
+    
+    @property
+    def generation(self) -> int:
+        """已加载快照的manifest代数，未持久化时为0"""
+        return self._store.generation if self._store is not None else 0
+    
+    def refresh(self, path: Optional[str] = None) -> bool:
+        """只读副本检查manifest的代数，有新快照时切换过去，返回是否切换
+
+        已打开的分段原样复用，只映射新增的分段；稀疏索引按新增的id和新的
+        删除标记增量更新。写入进程压缩后删除的旧分段在映射期间仍然有效。
+        尚未加载时，目录中出现manifest后以只读方式加载。
+        """
+        if self._store is None:
+            if path is None or not os.path.exists(os.path.join(path, MANIFEST_NAME)):
+                return False
+            self.load(path, read_only=True)
+            return True
+        if not self.read_only:
+            raise ValueError("Only read-only replicas can refresh from disk")
         
-        # 保存索引
-        faiss.write_index(self.index, os.path.join(path, "index.faiss"))
+        store = self._store
+        previous = store.manifest
+        manifest = store.reload_manifest()
+        if manifest["generation"] == previous["generation"]:
+            return False
+        try:
+            segments = store.load_segments(self._segments)
+            images = store.load_image_indexes(self.image_index.files)
+        except Exception:
+            # 分段和图像索引可能在读取manifest后被删除，恢复旧manifest等待下次刷新
+            store.manifest = previous
+            raise
         
-        # 保存元数据
-        with open(os.path.join(path, "metadata.json"), "w", encoding="utf-8") as f:
-            json.dump(self.metadata, f, ensure_ascii=False, indent=2)
-    
-    def load(self, path: str):
-        """从磁盘加载向量存储"""
-        # 加载索引
-        self.index = faiss.read_index(os.path.join(path, "index.faiss"))
+        deleted = store.deleted
+        # 压缩会替换全部分段，期间的删除可能已不在删除标记中，稀疏索引在锁外整体重建
+        compacted = bool(self._segments) and not (
+            {segment.name for segment in self._segments} & {segment.name for segment in segments}
+        )
+        sparse = None
+        if self.sparse is not None and compacted:
+            sparse = BM25Index(self.config)
+            for ids, texts in store.metadata.iter_texts(limit=store.next_id):
+                live = [(idx, text) for idx, text in zip(ids, texts) if idx not in deleted]
+                sparse.add([idx for idx, _ in live], [text for _, text in live])
         
-        # 加载元数据
-        with open(os.path.join(path, "metadata.json"), "r", encoding="utf-8") as f:
-            self.metadata = json.load(f) 
\ No newline at end of file
+        with self._lock:
+            if sparse is not None:
+                self.sparse = sparse
+            elif self.sparse is not None:
+                self.sparse.remove(deleted - self._deleted)
+                for ids, texts in store.metadata.iter_texts(limit=store.next_id, start=self._next_id):
+                    live = [(idx, text) for idx, text in zip(ids, texts) if idx not in deleted]
+                    self.sparse.add([idx for idx, _ in live], [text for _, text in live])
+            self._segments = segments
+            self._next_id = store.next_id
+            self._deleted = deleted
+            self.metadata = ColumnarMetadata(start_id=self._next_id)
+            self.image_index.adopt(images)
+            self._bump_version()
+        return True
+    
+    def _rebuild_sparse(self):
+        """稀疏索引不单独持久化，加载时按元数据中的文本重建"""
+        if self.sparse is None:
+            return
+        self.sparse.clear()
+        if self._store is not None:
+            for ids, texts in self._store.metadata.iter_texts(limit=self.metadata.start_id):
+                live = [(idx, text) for idx, text in zip(ids, texts) if idx not in self._deleted]
+                self.sparse.add([idx for idx, _ in live], [text for _, text in live])
+        live = [(idx, row) for idx, row in self.metadata.items() if not row.get("image_only")]
+        self.sparse.add([idx for idx, _ in live], [row["text"] for _, row in live])
+    
+    def _open_store(self, path: str) -> SegmentStore:
+        if self._store is None:
+            store = SegmentStore(path, mmap=self.mmap)
+            if store.next_id != self.metadata.start_id:
+                raise ValueError(f"{path} already contains a vector store, load it first")
+            self._store = store
+        elif os.path.abspath(self._store.path) != os.path.abspath(path):
+            raise ValueError(f"Vector store is bound to {self._store.path}")
+        return self._store
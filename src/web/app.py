@@ -1,15 +1,23 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
 import os
 import yaml
 import json
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
+import io
 import shutil
+import uuid
+import hashlib
+import threading
+import time
 from pathlib import Path
+from PIL import Image
 import sys
 
 # 添加项目根目录到Python路径
@@ -17,10 +25,16 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 
 # 导入自定义模块
 from src.document_processor.base import PDFProcessor, WordProcessor, ExcelProcessor
+from src.document_processor.ocr import OCRPool
 from src.image_processor.processor import ImageProcessor
 from src.table_processor.processor import TableProcessor
-from src.vector_store.store import VectorStore
+from src.vector_store.store import VectorStore, SEARCH_MODES
+from src.vector_store.rerank import Reranker
+from src.vector_store.encoders import set_torch_threads
 from src.llm.qa import LLMQA
+from src.web.jobs import IngestionQueue, IngestJob, QueueFullError
+from src.web.executors import StageExecutors
+from src.models.registry import default_registry
 
 app = FastAPI(title="Multimodal RAG System")
 
@@ -39,16 +53,48 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # 设置模板
 templates = Jinja2Templates(directory="templates")
 
-# 初始化处理器
-document_processors = {
-    "pdf": PDFProcessor(config),
-    "docx": WordProcessor(config),
-    "xlsx": ExcelProcessor(config)
-}
-image_processor = ImageProcessor(config)
-table_processor = TableProcessor(config)
+# 服务角色：all 同时提供导入和查询（多进程部署时即唯一的写入进程）；query 为只读
+# 查询副本，不创建导入相关的处理器。环境变量 RAG_SERVING_ROLE 优先于配置，供 run.py 使用
+serving_config = config.get("serving", {})
+role = os.environ.get("RAG_SERVING_ROLE") or serving_config.get("role", "all")
+if role not in ("all", "query"):
+    raise ValueError(f"Unsupported serving role: {role}")
+ingestion_enabled = role != "query"
+# torch 线程数是进程级设置，只在这里按 serving.torch_threads 设置一次
+set_torch_threads(config)
+
+# 初始化处理器，模型只在注册表中登记，首次使用时加载
+document_processors = {}
+table_processor = None
+ocr_pool = None
+if ingestion_enabled:
+    # 各文档处理器共享一个OCR识别池
+    ocr_pool = OCRPool(config)
+    document_processors = {
+        "pdf": PDFProcessor(config, ocr_pool),
+        "docx": WordProcessor(config, ocr_pool),
+        "xlsx": ExcelProcessor(config, ocr_pool)
+    }
+    table_processor = TableProcessor(config)
 vector_store = VectorStore(config)
-llm_qa = LLMQA(config)
+# 图像模型按需加载；查询副本默认不创建，以图搜图请求重定向到写入进程，
+# 配置 vector_store.image_index.replica_text_to_image 后副本才自行加载视觉模型
+image_queries_enabled = ingestion_enabled or vector_store.image_index.replica_text_to_image
+image_processor = ImageProcessor(config) if image_queries_enabled else None
+persist_dir = config["vector_store"].get("persist_dir")
+if ingestion_enabled and persist_dir and os.path.isdir(persist_dir):
+    vector_store.load(persist_dir)
+elif not ingestion_enabled:
+    if not persist_dir:
+        raise ValueError("Query-only replicas require vector_store.persist_dir")
+    # 只读副本映射写入进程提交的快照，尚无快照时由刷新线程等待
+    vector_store.refresh(persist_dir)
+reranker = Reranker(config)
+
+# 查询各阶段的执行器，与导入任务的线程池相互隔离
+stage_executors = StageExecutors(config)
+# 上下文组装（读元数据、分词）在search线程池中执行
+llm_qa = LLMQA(config, fetch_metadata=vector_store.get_metadata, executor=stage_executors.executor("search"))
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -58,78 +104,354 @@ async def home(request: Request):
         {"request": request}
     )
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """上传文件并处理"""
-    # 检查文件类型
-    file_ext = file.filename.split(".")[-1].lower()
-    if file_ext not in config["document_processor"]["supported_formats"]:
-        raise HTTPException(400, "Unsupported file format")
-    
-    # 保存文件
-    file_path = os.path.join(config["system"]["temp_dir"], file.filename)
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    
+def run_ingestion(job: IngestJob) -> Dict:
+    """在后台线程中执行文档导入流程"""
     try:
-        # 处理文档
-        processor = document_processors.get(file_ext)
-        if not processor:
-            raise HTTPException(400, "No processor available for this file type")
+        processor = document_processors[job.file_ext]
         
-        result = processor.process(file_path)
+        # 内容未变化的文件直接跳过
+        file_hash = _file_hash(job.file_path)
+        if vector_store.has_document(job.filename, file_hash):
+            return {"status": "unchanged", "chunks": 0, "images": 0, "tables": 0}
+        
+        # 解析文档
+        with job.stage("parse") as stage:
+            result = processor.process(job.file_path)
+            page_stats = result.get("page_stats") or []
+            if page_stats:
+                stage["done"] = stage["total"] = len(page_stats)
+                stage["ocr_pages"] = sum(1 for page in page_stats if page["ocr"])
         
         # 处理图片
-        if "images" in result:
-            image_results = image_processor.process_batch(result["images"])
-            result["image_analysis"] = image_results
+        if result.get("images"):
+            with job.stage("images", total=len(result["images"])) as stage:
+                result["image_analysis"] = image_processor.process_batch(result["images"])
+                # 记录图片所在页，便于检索结果定位
+                for analysis, page in zip(result["image_analysis"], result.get("image_pages", [])):
+                    analysis["page"] = page
+                # 图片内容哈希进入块哈希，同一位置换了图片时重新写入图像索引
+                for analysis, image in zip(result["image_analysis"], result["images"]):
+                    analysis["content_hash"] = getattr(image, "content_hash", None)
+                stage["done"] = len(result["images"])
         
         # 处理表格
-        if "tables" in result:
-            table_results = table_processor.batch_process_tables(result["tables"])
-            result["table_analysis"] = table_results
+        if result.get("tables"):
+            with job.stage("tables", total=len(result["tables"])) as stage:
+                result["table_analysis"] = table_processor.batch_process_tables(result["tables"])
+                stage["done"] = len(result["tables"])
         
-        # 添加到向量存储
-        vector_store.add_documents([{
-            "text": result.get("text", ""),
-            "images": result.get("image_analysis", []),
-            "tables": result.get("table_analysis", []),
-            "source": file.filename,
-            "type": file_ext
-        }])
+        # 添加到向量存储（按块切分后逐块编码，同名文档只重新编码变化的块）
+        with job.stage("index") as stage:
+            num_chunks = vector_store.upsert_document({
+                "text": result.get("text", ""),
+                "pages": result.get("pages"),
+                "images": result.get("image_analysis", []),
+                "tables": result.get("table_analysis", []),
+                "table_blocks": result.get("table_blocks"),
+                "source": job.filename,
+                "type": job.file_ext
+            }, content_hash=file_hash)
+            stage["done"] = stage["total"] = num_chunks
         
-        return {"message": "File processed successfully", "result": result}
-    
-    except Exception as e:
-        raise HTTPException(500, str(e))
+        # 新增向量作为增量分段提交到磁盘
+        if persist_dir:
+            with job.stage("persist"):
+                vector_store.save(persist_dir)
+        
+        return {
+            "chunks": num_chunks,
+            "images": len(result.get("images") or []),
+            "tables": len(result.get("tables") or []),
+            "pages": page_stats
+        }
     
     finally:
         # 清理临时文件
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+ingestion_queue = IngestionQueue(config, run_ingestion) if ingestion_enabled else None
+
+@app.on_event("startup")
+def warmup_models():
+    """服务启动后在后台预加载 serving.warmup 中列出的模型（模型名或分组，all 为全部）及默认模型的分词器"""
+    warmup = serving_config.get("warmup", [])
+    # 默认模型的分词器总是预加载，避免首个请求等待分词器下载
+    tokenizer = llm_qa.context_builder.counter.key(llm_qa.model_name)
+    if tokenizer is not None and tokenizer not in warmup:
+        warmup = list(warmup) + [tokenizer]
+    if warmup:
+        default_registry.warmup(warmup)
+
+_refresh_stop = threading.Event()
+
+def _refresh_loop(interval: float):
+    """只读副本定期检查manifest的代数，新文档在一个刷新间隔内可见"""
+    while not _refresh_stop.wait(interval):
+        try:
+            vector_store.refresh(persist_dir)
+        except Exception as e:
+            print(f"Snapshot refresh failed, retrying: {e}")
+
+@app.on_event("startup")
+def start_snapshot_refresh():
+    if not ingestion_enabled:
+        threading.Thread(
+            target=_refresh_loop, args=(serving_config.get("refresh_interval", 2.0),),
+            name="snapshot-refresh", daemon=True
+        ).start()
+
+def _writer_redirect(request: Request) -> RedirectResponse:
+    """只读副本把写请求重定向到写入进程，307 保留请求方法和请求体"""
+    writer_url = serving_config.get("writer_url")
+    if writer_url:
+        url = writer_url.rstrip("/") + request.url.path
+        if request.url.query:
+            url += "?" + request.url.query
+    else:
+        url = str(request.url.replace(port=serving_config.get("writer_port", 8001)))
+    return RedirectResponse(url, status_code=307)
+
+@app.on_event("shutdown")
+async def close_llm_gateway():
+    await llm_qa.gateway.aclose()
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    _refresh_stop.set()
+    if ingestion_queue is not None:
+        ingestion_queue.shutdown(wait=False)
+    if "pdf" in document_processors:
+        document_processors["pdf"].shutdown()
+    if ocr_pool is not None:
+        ocr_pool.shutdown(wait=False)
+    stage_executors.shutdown(wait=False)
+
+def _save_upload(file: UploadFile, file_path: str):
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(file.file, f)
+
+@app.post("/upload", status_code=202)
+async def upload_file(request: Request, file: UploadFile = File(...)):
+    """上传文件，提交后台导入任务并立即返回任务ID"""
+    if not ingestion_enabled:
+        return _writer_redirect(request)
+    # 检查文件类型
+    file_ext = file.filename.split(".")[-1].lower()
+    if file_ext not in config["document_processor"]["supported_formats"]:
+        raise HTTPException(400, "Unsupported file format")
+    if file_ext not in document_processors:
+        raise HTTPException(400, "No processor available for this file type")
+    
+    # 保存文件，文件名加前缀避免并发上传冲突
+    file_path = os.path.join(
+        config["system"]["temp_dir"], f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}"
+    )
+    await run_in_threadpool(_save_upload, file, file_path)
+    
+    try:
+        job = ingestion_queue.submit(file_path, file.filename, file_ext)
+    except QueueFullError as e:
+        os.remove(file_path)
+        raise HTTPException(503, str(e))
+    
+    return {"message": "File accepted", "job_id": job.id, "status": job.status}
+
+@app.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str):
+    """查询导入任务状态"""
+    if not ingestion_enabled:
+        return _writer_redirect(request)
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job.to_dict()
+
+@app.get("/jobs")
+async def list_jobs(request: Request):
+    """列出最近的导入任务"""
+    if not ingestion_enabled:
+        return _writer_redirect(request)
+    return {
+        "jobs": [job.to_dict() for job in ingestion_queue.list()],
+        "stats": ingestion_queue.stats()
+    }
+
+async def _retrieve(query: str, mode: Optional[str], timings: Dict) -> List[Dict]:
+    """检索并（启用时）重排，各阶段耗时记入 timings
+
+    启用重排时先取 rerank.candidates 个候选，再由交叉编码器在rerank线程池中
+    重排为前 rerank.top_k 个。
+    """
+    start = time.perf_counter()
+    if not reranker.enabled:
+        # 检索相关文档（编码、BM25与FAISS检索在search线程池中执行）
+        results = await stage_executors.run("search", vector_store.search, query, mode=mode)
+        timings["search_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return results
+    
+    candidates = await stage_executors.run(
+        "search", vector_store.search, query, top_k=reranker.candidates, mode=mode
+    )
+    timings["search_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    
+    start = time.perf_counter()
+    results, stats = await stage_executors.run("rerank", reranker.rerank, query, candidates)
+    timings["rerank_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    timings["rerank"] = stats
+    return results
 
 @app.post("/query")
-async def query(query: str = Form(...)):
-    """处理用户查询"""
+async def query(query: str = Form(...), mode: Optional[str] = Form(None)):
+    """处理用户查询，mode 可选 dense/sparse/hybrid"""
+    if mode is not None and mode not in SEARCH_MODES:
+        raise HTTPException(400, "Unsupported search mode")
     try:
-        # 检索相关文档
-        search_results = vector_store.search(query)
+        timings = {}
+        search_results = await _retrieve(query, mode, timings)
         
         # 生成答案
-        answer = llm_qa.generate_answer(query, search_results)
+        start = time.perf_counter()
+        async with stage_executors.limit("llm"):
+            answer = await llm_qa.agenerate_answer(query, search_results)
+        timings["llm_ms"] = round((time.perf_counter() - start) * 1000, 1)
         
         return {
             "answer": answer["answer"],
-            "sources": search_results
+            "model": answer["model"],
+            "sources": search_results,
+            "timings": timings
         }
     
     except Exception as e:
         raise HTTPException(500, str(e))
 
+@app.post("/query/image")
+async def query_image(request: Request, file: UploadFile = File(...), top_k: int = Form(5)):
+    """以图搜图：上传一张图片，返回图像索引中最相似的图片块"""
+    if image_processor is None:
+        return _writer_redirect(request)
+    if not 0 < top_k <= 100:
+        raise HTTPException(400, "Invalid top_k")
+    data = await file.read()
+    
+    def search():
+        # 解码和特征提取都在线程池中执行
+        try:
+            image = Image.open(io.BytesIO(data)).convert("RGB")
+        except Exception:
+            raise HTTPException(400, "Invalid image")
+        features = image_processor.extract_features(image)
+        return vector_store.search_images(features, image_processor.model_name, top_k=top_k)
+    
+    start = time.perf_counter()
+    results = await stage_executors.run("search", search)
+    return {"sources": results, "timings": {"search_ms": round((time.perf_counter() - start) * 1000, 1)}}
+
+async def _stream_events(query: str, mode: Optional[str]) -> AsyncIterator[Dict]:
+    """流式问答的事件序列：先发送检索到的来源，再逐段发送答案，最后发送耗时
+
+    事件为 {"event": sources|token|done|error, "data": ...}；首个答案片段的
+    耗时（ttft_ms）从收到请求开始计算。
+    """
+    start = time.perf_counter()
+    try:
+        timings = {}
+        search_results = await _retrieve(query, mode, timings)
+        yield {"event": "sources", "data": {"sources": jsonable_encoder(search_results)}}
+        
+        ttft_ms = None
+        info = {}
+        async with stage_executors.limit("llm"):
+            async for text in llm_qa.astream_answer(query, search_results, info=info):
+                if ttft_ms is None:
+                    ttft_ms = round((time.perf_counter() - start) * 1000, 1)
+                yield {"event": "token", "data": {"text": text}}
+        yield {"event": "done", "data": {
+            "model": info.get("model"),
+            "context": info.get("context"),
+            "timings": timings,
+            "ttft_ms": ttft_ms,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1)
+        }}
+    except Exception as e:
+        yield {"event": "error", "data": {"detail": str(e)}}
+
+@app.post("/query/stream")
+async def query_stream(query: str = Form(...), mode: Optional[str] = Form(None)):
+    """以Server-Sent Events流式返回来源和答案"""
+    if mode is not None and mode not in SEARCH_MODES:
+        raise HTTPException(400, "Unsupported search mode")
+    
+    async def sse():
+        async for event in _stream_events(query, mode):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+    
+    # 关闭代理缓冲，保证每个片段立即送达
+    return StreamingResponse(
+        sse(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/query/stream")
+async def query_websocket(websocket: WebSocket):
+    """WebSocket流式问答：客户端发送 {"query", "mode"}，服务端按事件逐条返回，连接可复用"""
+    await websocket.accept()
+    try:
+        while True:
+            request = await websocket.receive_json()
+            query_text = (request.get("query") or "").strip()
+            mode = request.get("mode")
+            if not query_text or (mode is not None and mode not in SEARCH_MODES):
+                await websocket.send_json({"event": "error", "data": {"detail": "Invalid query or search mode"}})
+                continue
+            async for event in _stream_events(query_text, mode):
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """查询缓存命中统计"""
+    # 统计会查询SQLite，不在事件循环中执行
+    stats = await stage_executors.run("search", vector_store.cache_stats)
+    return {**stats, **llm_qa.cache_stats()}
+
+@app.get("/models")
+async def model_stats():
+    """各模型的加载状态、加载耗时和内存占用"""
+    return {"role": role, "generation": vector_store.generation, **default_registry.stats()}
+
 @app.get("/sources")
-async def get_sources():
-    """获取所有文档源"""
-    return {"sources": vector_store.metadata}
+async def get_sources(offset: int = 0, limit: int = 50):
+    """分页获取文档列表，每个文档一行并附带块数"""
+    if offset < 0 or not 0 < limit <= 1000:
+        raise HTTPException(400, "Invalid pagination parameters")
+    # 聚合查询在存储锁内读取SQLite，导入持有锁时不能阻塞事件循环
+    return await stage_executors.run("search", vector_store.list_documents, offset, limit)
+
+@app.delete("/sources/{source}")
+async def delete_source(request: Request, source: str):
+    """删除一个文档及其所有块"""
+    if not ingestion_enabled:
+        return _writer_redirect(request)
+    def delete():
+        deleted = vector_store.delete_document(source)
+        if deleted and persist_dir:
+            vector_store.save(persist_dir)
+        return deleted
+    
+    deleted = await run_in_threadpool(delete)
+    if not deleted:
+        raise HTTPException(404, "Source not found")
+    return {"source": source, "deleted_chunks": deleted}
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -0,0 +1,54 @@
+from typing import Callable, Dict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+
+# 各阶段默认的线程数与并发上限
+DEFAULT_STAGES = {
+    "search": {"max_workers": 4, "max_concurrency": 8},
+    # 交叉编码器重排占满CPU，少量并发，每个请求内部由推理线程并行
+    "rerank": {"max_workers": 2, "max_concurrency": 2},
+    "llm": {"max_workers": 16, "max_concurrency": 16},
+}
+
+
+class StageExecutors:
+    """按服务阶段划分的执行器
+
+    每个阶段拥有独立大小的线程池和并发上限，阻塞的模型推理、FAISS检索
+    以及同步的LLM调用都在线程池中执行，不会阻塞事件循环。
+    """
+
+    def __init__(self, config: Dict):
+        stage_config = config.get('serving', {}).get('stages', {})
+        self._executors = {}
+        self._semaphores = {}
+        self.limits = {}
+        for stage in set(DEFAULT_STAGES) | set(stage_config):
+            settings = {**DEFAULT_STAGES.get(stage, {}), **stage_config.get(stage, {})}
+            max_workers = settings.get('max_workers', 4)
+            max_concurrency = settings.get('max_concurrency', max_workers)
+            self._executors[stage] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f"{stage}-stage"
+            )
+            self._semaphores[stage] = asyncio.Semaphore(max_concurrency)
+            self.limits[stage] = {"max_workers": max_workers, "max_concurrency": max_concurrency}
+
+    def executor(self, stage: str) -> ThreadPoolExecutor:
+        return self._executors[stage]
+
+    def limit(self, stage: str) -> asyncio.Semaphore:
+        """阶段并发上限，用于本身是异步的调用"""
+        return self._semaphores[stage]
+
+    async def run(self, stage: str, fn: Callable, *args, **kwargs):
+        """在指定阶段的线程池中执行阻塞调用"""
+        async with self._semaphores[stage]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executors[stage], functools.partial(fn, *args, **kwargs)
+            )
+
+    def shutdown(self, wait: bool = True):
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
@@ -0,0 +1,128 @@
+from typing import Callable, Dict, List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import threading
+import time
+import uuid
+
+
+class QueueFullError(RuntimeError):
+    """待处理任务数达到上限"""
+
+
+class IngestJob:
+    """一次文档导入任务，记录各阶段的进度与耗时"""
+
+    def __init__(self, file_path: str, filename: str, file_ext: str):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.filename = filename
+        self.file_ext = file_ext
+        self.status = "pending"
+        self.error = None
+        self.result = {}
+        self.stages = OrderedDict()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @contextmanager
+    def stage(self, name: str, total: Optional[int] = None):
+        """记录一个处理阶段，可在阶段内调用 progress 更新进度"""
+        info = {"status": "running", "done": 0, "total": total, "elapsed": None}
+        self.stages[name] = info
+        start = time.perf_counter()
+        try:
+            yield info
+        except Exception:
+            info["status"] = "failed"
+            raise
+        else:
+            info["status"] = "done"
+        finally:
+            info["elapsed"] = round(time.perf_counter() - start, 3)
+
+    def to_dict(self) -> Dict:
+        finished = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "result": self.result,
+            "stages": dict(self.stages),
+            "created_at": self.created_at,
+            "queued": round((self.started_at or finished) - self.created_at, 3),
+            "elapsed": round(finished - self.started_at, 3) if self.started_at else None
+        }
+
+
+class IngestionQueue:
+    """后台导入队列：有界等待队列 + 固定大小的工作线程池"""
+
+    def __init__(self, config: Dict, pipeline: Callable[[IngestJob], Dict]):
+        ingest_config = config.get('ingestion', {})
+        self.max_workers = ingest_config.get('max_workers', 1)
+        self.max_pending = ingest_config.get('max_pending', 32)
+        self.max_history = ingest_config.get('max_history', 200)
+        self.pipeline = pipeline
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="ingest"
+        )
+        # 限制排队与运行中的任务总数
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, file_path: str, filename: str, file_ext: str) -> IngestJob:
+        """提交导入任务，立即返回"""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError("Too many pending ingestion jobs")
+
+        job = IngestJob(file_path, filename, file_ext)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim_history()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[IngestJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def stats(self) -> Dict:
+        counts = {}
+        for job in self.list():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.max_workers, "max_pending": self.max_pending, "jobs": counts}
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: IngestJob):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = self.pipeline(job) or {}
+            job.status = "succeeded"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self._slots.release()
+
+    def _trim_history(self):
+        """只保留最近的已结束任务"""
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in [jid for jid, job in self._jobs.items()
+                       if job.status in ("succeeded", "failed")][:excess]:
+            del self._jobs[job_id]
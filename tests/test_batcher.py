@@ -0,0 +1,57 @@
+import threading
+
+import numpy as np
+
+from src.vector_store.batcher import QueryBatcher
+from src.vector_store.store import VectorStore
+
+
+def test_queries_with_different_top_k_are_not_merged():
+    calls = []
+
+    def search(queries, top_k, **kwargs):
+        calls.append((sorted(queries), top_k))
+        return [[f"{query}-{i}" for i in range(top_k)] for query in queries]
+
+    batcher = QueryBatcher(search, max_wait_ms=200)
+    results = {}
+    threads = [
+        threading.Thread(target=lambda q=q, k=k: results.__setitem__(q, batcher.submit(q, k)))
+        for q, k in [("a", 1), ("b", 3), ("c", 3)]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert sorted(calls) == [(["a"], 1), (["b", "c"], 3)]
+    assert results == {"a": ["a-0"], "b": ["b-0", "b-1", "b-2"], "c": ["c-0", "c-1", "c-2"]}
+
+
+def _store() -> VectorStore:
+    store = VectorStore({"vector_store": {
+        "dimension": 8, "index_type": "L2", "nlist": 0, "nprobe": 1,
+        "hybrid": {"mode": "hybrid", "candidates": 4}
+    }})
+    vectors = {}
+
+    def encode(texts):
+        return np.stack([
+            vectors.setdefault(text, np.random.default_rng(len(vectors)).normal(size=8)) for text in texts
+        ]).astype(np.float32)
+
+    store._encode_texts = store._encode_queries = encode
+    store.chunker.chunk_size = 8
+    return store
+
+
+def test_hybrid_results_do_not_depend_on_co_batched_queries():
+    store = _store()
+    paragraphs = [f"苹果 香蕉 {i}" for i in range(6)] + [f"其他 内容 {i}" for i in range(6)]
+    store.upsert_document({"source": "a.txt", "text": "\n\n".join(paragraphs)})
+
+    alone = store.search_batch(["苹果 香蕉"], top_k=2, mode="hybrid")
+    store._search_cache.clear()
+    batched = store.search_batch(["苹果 香蕉", "葡萄"], top_k=2, mode="hybrid")
+    assert batched[0] == alone[0]
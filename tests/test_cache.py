@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+
+from src.vector_store.cache import LRUCache, embedding_key, normalize_text
+from src.vector_store.embedding_cache import EmbeddingCache, content_key
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 3, 1, 1)
+
+
+def test_lru_entries_expire_after_ttl():
+    cache = LRUCache(max_size=4, ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a", "missing") == "missing"
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = LRUCache.from_config({"cache": {"enabled": False}}, "search", max_size=16)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_cache_keys_ignore_case_whitespace_and_float_noise():
+    assert normalize_text("  Hello\n World ") == "hello world"
+    vector = np.random.default_rng(0).normal(size=8).astype(np.float32)
+    assert embedding_key(vector) == embedding_key(vector + 1e-7)
+    assert embedding_key(vector) != embedding_key(vector + 1e-2)
+
+
+def test_embedding_cache_round_trips_and_evicts_oldest(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "org/model:onnx", dimension=4, max_entries=2, touch_interval=0)
+    keys = [content_key(text) for text in ("甲", "乙", "丙")]
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+    cache.put_many(keys[:2], vectors[:2])
+    # 只合并空白，内容相同的文本命中同一条目
+    assert content_key(" 甲 ") == keys[0]
+    np.testing.assert_allclose(cache.get_many([keys[0]])[0], vectors[0])
+
+    time.sleep(0.01)
+    cache.put_many(keys[2:], vectors[2:])
+    hits = cache.get_many(keys)
+    assert hits[1] is None
+    np.testing.assert_allclose(hits[2], vectors[2])
+    assert cache.stats()["size"] == 2
+
+    # 另一个实例（如其他导入进程）共享同一份缓存
+    other = EmbeddingCache(str(tmp_path), "org/model:onnx", dimension=4, max_entries=2)
+    np.testing.assert_allclose(other.get_many([keys[0]])[0], vectors[0])
+    cache.close()
+    other.close()
@@ -0,0 +1,59 @@
+import pytest
+
+from src.vector_store.chunker import TextChunker
+
+
+def _chunker(**settings) -> TextChunker:
+    return TextChunker({"chunker": {"chunk_size": 12, "chunk_overlap": 4, **settings}})
+
+
+def test_paragraphs_are_packed_up_to_chunk_size_with_overlap():
+    text = "第一段内容\n\n第二段\n\n第三段内容很长"
+    chunks = list(_chunker().split({"source": "a.txt", "text": text}))
+
+    # 下一块从上一块末尾的重叠处开始，但不超过chunk_size
+    assert [chunk["text"] for chunk in chunks] == ["第一段内容\n\n第二段", "第二段\n\n第三段内容很长"]
+    for chunk in chunks:
+        assert len(chunk["text"]) <= 12
+        assert text[chunk["start"]:chunk["end"]].strip() == chunk["text"]
+
+
+def test_long_paragraph_is_split_with_overlap():
+    text = "".join(str(i % 10) for i in range(30))
+    chunks = list(_chunker().split({"source": "a.txt", "text": text}))
+
+    assert [(chunk["start"], chunk["end"]) for chunk in chunks] == [(0, 12), (8, 20), (16, 28), (24, 30)]
+    assert all(chunk["modality"] == "text" for chunk in chunks)
+
+
+def test_pages_keep_their_page_numbers_and_offsets():
+    chunks = list(_chunker(split_by="page").split({"source": "a.pdf", "pages": ["甲页", "", "丙页"]}))
+    assert [(chunk["page"], chunk["text"], chunk["start"]) for chunk in chunks] == [(1, "甲页", 0), (3, "丙页", 0)]
+
+
+def test_table_rows_repeat_the_header_in_every_chunk():
+    table = {"sheet_name": "表1", "data": [["名称", "数量"]] + [[f"物品{i}", i] for i in range(5)]}
+    chunks = list(_chunker(chunk_size=512, table_rows_per_chunk=2).split({"source": "a.xlsx", "table": table}))
+
+    schema, *rows = chunks
+    assert schema["table_part"] == "schema" and schema["num_rows"] == 5
+    assert [(chunk["row_start"], chunk["row_end"]) for chunk in rows] == [(2, 3), (4, 5), (6, 6)]
+    assert all("| 名称 | 数量 |" in chunk["text"] for chunk in rows)
+    assert rows[0]["cell_range"] == "A2:B3"
+
+
+def test_images_with_captions_or_features_become_chunks():
+    document = {"source": "a.pdf", "images": [
+        {"caption": "流程图", "page": 2},
+        {"page": 3, "features": [0.1, 0.2], "model": "clip", "content_hash": "h"},
+        {"page": 4}
+    ]}
+    captioned, featured = _chunker().split(document)
+
+    assert captioned["text"] == "[图片描述] 流程图" and "image_only" not in captioned
+    assert featured["image_only"] and featured["image_hash"] == "h" and featured["image_model"] == "clip"
+
+
+def test_invalid_overlap_is_rejected():
+    with pytest.raises(ValueError):
+        _chunker(chunk_overlap=12)
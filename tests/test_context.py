@@ -0,0 +1,72 @@
+from src.llm.context import ContextBuilder, estimate_tokens
+from src.models.registry import ModelRegistry
+
+
+def _builder(max_context_tokens: int = 3000, model: str = "stub", **context) -> ContextBuilder:
+    return ContextBuilder({"llm": {
+        "default_model": model,
+        "max_tokens": 512,
+        "context": {"max_context_tokens": max_context_tokens, "min_chunk_tokens": 4, **context}
+    }}, registry=ModelRegistry())
+
+
+def _hit(idx: int, text: str, score: float, **metadata) -> dict:
+    return {"id": idx, "score": score, "metadata": {"text": text, "source": "a.pdf", "page": 1, **metadata}}
+
+
+def test_budget_leaves_room_for_the_answer_and_prompt():
+    builder = _builder(model="qwen", context_windows={"qwen": 1000})
+    assert builder.budget(prompt_tokens=100) == 1000 - 512 - 100
+    assert _builder().budget(prompt_tokens=100) == 3000
+
+
+def test_overlapping_chunks_on_one_page_are_stitched_once():
+    text = "甲乙丙丁戊己庚辛"
+    hits = [
+        _hit(1, text[0:5], 0.9, start=0, end=5),
+        _hit(2, text[3:8], 0.8, start=3, end=8),
+        _hit(3, text[0:5], 0.7, source="b.pdf", start=0, end=5)
+    ]
+    context, stats = _builder().build(hits)
+
+    assert context.count("文本内容：甲乙丙丁戊己庚辛\n") == 1
+    assert "来源：b.pdf 第1页" not in context  # 内容重复的块只保留分数最高的
+    assert stats["items"] == 1 and stats["hits"] == 3
+
+
+def test_table_row_chunks_are_merged_with_one_header():
+    header = "| 名称 | 数量 |\n| --- | --- |"
+    hits = [
+        _hit(1, f"[表格内容] 第2-3行\n{header}\n| 甲 | 1 |\n| 乙 | 2 |", 0.9,
+             modality="table", table_part="rows", table_index=0, row_start=2, row_end=3),
+        _hit(2, f"[表格内容] 第4-4行\n{header}\n| 丙 | 3 |", 0.5,
+             modality="table", table_part="rows", table_index=0, row_start=4, row_end=4)
+    ]
+    context, stats = _builder().build(hits)
+
+    assert context.startswith("表格内容：第2-4行\n名称,数量\n甲,1\n乙,2\n丙,3\n")
+    assert stats["items"] == 1
+
+
+def test_packing_stops_at_the_budget_and_truncates_the_last_item():
+    hits = [_hit(i, "甲乙丙"[i] * 40, 1.0 - i / 10, page=i + 1) for i in range(3)]
+    context, stats = _builder(max_context_tokens=100).build(hits)
+
+    assert stats["tokens"] <= 100
+    assert stats["items"] == 2 and stats["dropped"] == 1
+    assert context.count("…") == 1
+    assert estimate_tokens(context) == stats["tokens"]
+
+
+def test_missing_text_is_fetched_by_id():
+    fetched = []
+
+    def fetch(ids):
+        fetched.extend(ids)
+        return {7: {"text": "取回的内容", "source": "c.pdf"}}
+
+    builder = ContextBuilder({"llm": {"default_model": "stub", "max_tokens": 64}}, fetch=fetch,
+                             registry=ModelRegistry())
+    context, _ = builder.build([{"id": 7, "score": 1.0}])
+    assert fetched == [7]
+    assert context == "文本内容：取回的内容\n来源：c.pdf\n---\n"
@@ -0,0 +1,72 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.models.registry import ModelRegistry
+from src.vector_store import encoders
+from src.vector_store.store import VectorStore
+
+
+class _Encoder:
+    def __init__(self, backend: str, noise: float):
+        self.model_name = "m"
+        self.backend = backend
+        self.dimension = 8
+        self.noise = noise
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True):
+        vectors = np.stack([np.random.default_rng(len(text)).normal(size=8) for text in texts])
+        return (vectors + self.noise * np.random.default_rng(0).normal(size=vectors.shape)).astype(np.float32)
+
+
+def _config(tmp_path, max_drop: float = 0.02) -> dict:
+    parity_set = tmp_path / "parity.json"
+    parity_set.write_text(json.dumps({"queries": ["a", "bb"], "corpus": ["a", "bb", "ccc", "dddd"]}))
+    return {"vector_store": {"dimension": 8, "index_type": "L2", "nlist": 0, "nprobe": 1, "encoder": {
+        "backend": "onnx", "model": "org/model", "onnx_dir": str(tmp_path / "onnx"),
+        "parity_set": str(parity_set), "parity_k": 2, "max_recall_drop": max_drop
+    }}}
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """按后端创建假编码器，记录加载次数"""
+    created = []
+
+    def create(config, **overrides):
+        backend = overrides.get("backend") or config["vector_store"]["encoder"]["backend"]
+        created.append(backend)
+        return _Encoder(backend if backend == "torch" else "onnx-int8", noise=0.0 if backend == "torch" else 0.01)
+
+    monkeypatch.setattr(encoders, "create_encoder", create)
+    monkeypatch.setattr("src.vector_store.store.create_encoder", create)
+    return created
+
+
+def test_parity_runs_once_per_exported_model(tmp_path, loads):
+    config = _config(tmp_path)
+    for _ in range(3):
+        store = VectorStore(config, registry=ModelRegistry())
+        assert store.encoder.backend == "onnx-int8"
+        assert store.encoder_parity["recall_delta"] == 0.0
+
+    # 基准模型只在第一次加载时创建
+    assert loads.count("torch") == 1
+    assert (tmp_path / "onnx" / "org__model" / "parity-int8.json").exists()
+
+
+def test_recorded_parity_still_gates_loading(tmp_path, loads):
+    config = _config(tmp_path)
+    report_path = encoders.parity_report_path(config["vector_store"]["encoder"])
+    VectorStore(config, registry=ModelRegistry()).encoder
+
+    with open(report_path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    report["recall_delta"] = -0.5
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f)
+
+    with pytest.raises(ValueError):
+        VectorStore(config, registry=ModelRegistry()).encoder
+    assert loads.count("torch") == 1
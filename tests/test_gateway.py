@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from src.llm.gateway import LLMError, LLMGateway
+
+MESSAGES = [{"role": "user", "content": "问题"}]
+
+
+def _gateway(providers: dict, hedge: dict = None, deadline: float = 5.0) -> LLMGateway:
+    stubs = {name: {"type": "stub", "jitter": 0, **settings} for name, settings in providers.items()}
+    return LLMGateway({"llm": {
+        "default_model": next(iter(providers)),
+        "temperature": 0.1,
+        "max_tokens": 32,
+        "gateway": {"order": list(providers), "deadline": deadline, "backoff": 0.01,
+                    "hedge": hedge or {}, "providers": stubs}
+    }})
+
+
+def test_failing_provider_falls_back_after_retries():
+    gateway = _gateway({
+        "primary": {"latency": 0.01, "error_rate": 1.0, "failure_threshold": 3},
+        "backup": {"latency": 0.01, "answer": "B"}
+    })
+    assert asyncio.run(gateway.complete(MESSAGES)) == {"answer": "B", "model": "backup"}
+
+    stats = gateway.stats()["providers"]["primary"]
+    assert (stats["failures"], stats["retries"]) == (3, 2)
+    # 连续失败后进入冷却，下一次请求直接由备用提供方作答
+    assert asyncio.run(gateway.complete(MESSAGES))["model"] == "backup"
+    assert gateway.stats()["providers"]["primary"]["calls"] == 1
+
+
+def test_slow_provider_is_hedged():
+    gateway = _gateway({
+        "primary": {"latency": 1.0, "answer": "A"},
+        "backup": {"latency": 0.01, "answer": "B"}
+    }, hedge={"enabled": True, "delay": 0.05})
+
+    start = time.monotonic()
+    assert asyncio.run(gateway.complete(MESSAGES))["model"] == "backup"
+    assert time.monotonic() - start < 0.5
+    assert gateway.providers["primary"].hedged == 1
+
+
+def test_deadline_bounds_the_whole_request():
+    gateway = _gateway({"primary": {"latency": 2.0}}, deadline=0.1)
+    start = time.monotonic()
+    with pytest.raises(LLMError):
+        asyncio.run(gateway.complete(MESSAGES))
+    assert time.monotonic() - start < 1.0
+
+
+def test_stream_hedges_before_the_first_chunk_and_releases_the_loser():
+    gateway = _gateway({
+        "primary": {"ttft": 1.0, "latency": 1.1, "answer": "AAAA"},
+        "backup": {"ttft": 0.01, "latency": 0.05, "answer": "BBBBBBBB", "chunk_size": 4}
+    }, hedge={"enabled": True, "delay": 0.05})
+
+    async def stream():
+        info = {}
+        parts = [text async for text in gateway.stream(MESSAGES, info=info)]
+        return parts, info
+
+    assert asyncio.run(stream()) == (["BBBB", "BBBB"], {"model": "backup"})
+    assert gateway.providers["primary"]._semaphore._value == 16
+    assert gateway.providers["backup"]._semaphore._value == 16
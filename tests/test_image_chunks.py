@@ -0,0 +1,48 @@
+import numpy as np
+
+from src.vector_store.store import VectorStore
+
+
+def _store(monkeypatch):
+    store = VectorStore({"vector_store": {"dimension": 8, "index_type": "L2", "nlist": 0, "nprobe": 1}})
+    encoded = []
+
+    def encode(texts):
+        encoded.extend(texts)
+        return np.random.default_rng(len(encoded)).normal(size=(len(texts), 8)).astype(np.float32)
+
+    monkeypatch.setattr(store, "_encode_texts", encode)
+    return store, encoded
+
+
+def _document(image_hash: str, features: np.ndarray) -> dict:
+    return {
+        "source": "a.pdf",
+        "text": "正文",
+        "images": [{"page": 3, "model": "clip", "features": features, "content_hash": image_hash}]
+    }
+
+
+def _features(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=16).astype(np.float32)
+
+
+def test_captionless_images_skip_the_text_encoder(monkeypatch):
+    store, encoded = _store(monkeypatch)
+    store.upsert_document(_document("old", _features(1)))
+
+    assert encoded == ["正文"]
+    assert store.index.ntotal == 1
+    assert store.image_index.stats()["clip"]["vectors"] == 1
+    assert [hit["metadata"]["modality"] for hit in store.search_images(_features(1), "clip", 5)] == ["image"]
+
+
+def test_replaced_image_updates_the_image_index(monkeypatch):
+    store, _ = _store(monkeypatch)
+    store.upsert_document(_document("old", _features(1)))
+    store.upsert_document(_document("new", _features(2)))
+
+    hits = store.search_images(_features(2), "clip", 5)
+    assert store.image_index.stats()["clip"]["vectors"] == 1
+    assert hits[0]["metadata"]["image_hash"] == "new"
+    assert hits[0]["score"] > 0.99
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from src.vector_store.image_index import ImageIndex
+from src.vector_store.persistence import SegmentStore
+
+
+def _config() -> dict:
+    return {"image_processor": {"model": "clip"}, "vector_store": {"dimension": 8}}
+
+
+def _features(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(count, 16)).astype(np.float32)
+
+
+def _commit(store: SegmentStore, images: ImageIndex, next_id: int):
+    store.commit(None, [], next_id, set(), image_indexes=images.dirty_snapshots())
+    images.mark_saved(store.manifest.get("image_indexes") or {})
+
+
+def test_crash_before_manifest_swap_keeps_committed_image_index(tmp_path, monkeypatch):
+    store = SegmentStore(str(tmp_path))
+    images = ImageIndex(_config())
+    images.add("clip", range(3), _features(3))
+    _commit(store, images, 3)
+
+    images.add("clip", range(3, 6), _features(3, seed=1))
+
+    def crash(manifest):
+        raise OSError("crash")
+
+    monkeypatch.setattr(store, "_write_manifest", crash)
+    with pytest.raises(OSError):
+        _commit(store, images, 6)
+    store.metadata.close()
+
+    # 重新打开时只看到已提交的图像向量，id 3-5 会被重新分配
+    reopened = SegmentStore(str(tmp_path))
+    loaded = ImageIndex(_config())
+    loaded.adopt(reopened.load_image_indexes())
+    assert reopened.next_id == 3
+    assert loaded.stats()["clip"]["vectors"] == 3
+    assert {idx for idx, _ in loaded.search_features("clip", _features(6, seed=1)[3], 6)} == {0, 1, 2}
+
+
+def test_unchanged_models_keep_their_files(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    images = ImageIndex(_config())
+    images.add("clip", range(2), _features(2))
+    images.add("blip2", range(2, 4), _features(2, seed=1))
+    _commit(store, images, 4)
+    first = dict(store.manifest["image_indexes"])
+
+    images.remove_ids([0])
+    _commit(store, images, 4)
+    second = store.manifest["image_indexes"]
+
+    assert second["blip2"] == first["blip2"]
+    assert second["clip"] != first["clip"]
+    assert not (tmp_path / first["clip"]).exists()
+
+
+def test_replicas_skip_text_to_image_by_default():
+    images = ImageIndex(_config())
+    images.add("clip", range(2), _features(2))
+    assert images.searchable_by_text()
+    assert not images.searchable_by_text(read_only=True)
+    assert images.clip_key is None
@@ -0,0 +1,72 @@
+import json
+import os
+
+import faiss
+import numpy as np
+
+from src.vector_store.store import VectorStore
+
+
+def _config(persist_dir: str) -> dict:
+    return {
+        "vector_store": {
+            "dimension": 8,
+            "index_type": "L2",
+            "nlist": 0,
+            "nprobe": 1,
+            "persist_dir": persist_dir,
+        }
+    }
+
+
+def _write_baseline_store(path: str, rows: list):
+    """按最初版本的格式写入 index.faiss 和 metadata.json（元数据不含文本）"""
+    index = faiss.IndexFlatL2(8)
+    index.add(np.random.default_rng(0).normal(size=(len(rows), 8)).astype(np.float32))
+    faiss.write_index(index, os.path.join(path, "index.faiss"))
+    with open(os.path.join(path, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+def test_load_baseline_format(tmp_path):
+    rows = [
+        {"source": "a.pdf", "type": "pdf", "page": 1},
+        {"source": "a.pdf", "type": "pdf", "page": 2},
+        {"source": "b.docx", "type": "docx", "page": 0},
+    ]
+    _write_baseline_store(str(tmp_path), rows)
+
+    store = VectorStore(_config(str(tmp_path)))
+    store.load(str(tmp_path))
+
+    assert store.index.ntotal == 3
+    metadata = store.get_metadata([0, 1, 2])
+    assert [metadata[i]["source"] for i in range(3)] == ["a.pdf", "a.pdf", "b.docx"]
+    assert metadata[1]["page"] == 2
+    assert {doc["source"] for doc in store.list_documents()["documents"]} == {"a.pdf", "b.docx"}
+
+
+def test_failed_load_leaves_legacy_directory_untouched(tmp_path):
+    _write_baseline_store(str(tmp_path), [{"source": "a.pdf", "type": "pdf", "page": 1}])
+    # 元数据损坏时加载失败
+    with open(os.path.join(str(tmp_path), "metadata.json"), "w", encoding="utf-8") as f:
+        f.write("{")
+
+    store = VectorStore(_config(str(tmp_path)))
+    try:
+        store.load(str(tmp_path))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("loading a corrupt store should fail")
+    assert sorted(os.listdir(str(tmp_path))) == ["index.faiss", "metadata.json"]
+
+
+def test_replica_does_not_create_embedding_cache(tmp_path):
+    writer = VectorStore(_config(str(tmp_path)))
+    writer.save(str(tmp_path))
+
+    replica = VectorStore(_config(str(tmp_path)))
+    assert replica.refresh(str(tmp_path))
+    assert replica.embedding_store is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "embedding_cache"))
@@ -0,0 +1,23 @@
+import numpy as np
+
+from src.vector_store.store import VectorStore
+
+
+def test_pages_are_counted_across_disk_and_memory(tmp_path, monkeypatch):
+    store = VectorStore({"vector_store": {
+        "dimension": 8, "index_type": "L2", "nlist": 0, "nprobe": 1, "persist_dir": str(tmp_path)
+    }})
+    # 不加载编码模型，按文本数返回随机向量
+    rng = np.random.default_rng(0)
+    monkeypatch.setattr(store, "_encode_texts", lambda texts: rng.normal(size=(len(texts), 8)).astype(np.float32))
+
+    def chunk(page: int) -> dict:
+        return {"text": f"page {page}", "source": "a.pdf", "type": "pdf", "modality": "text", "page": page}
+
+    store._add_chunks([chunk(1), chunk(2)])
+    store.save(str(tmp_path))
+    store._add_chunks([chunk(2), chunk(3), chunk(4)])
+
+    [doc] = store.list_documents()["documents"]
+    assert doc["chunks"] == 5
+    assert doc["pages"] == 4
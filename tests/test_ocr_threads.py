@@ -0,0 +1,26 @@
+import os
+import subprocess
+
+from PIL import Image
+
+from src.document_processor import ocr
+
+
+def test_thread_limit_only_reaches_the_tesseract_subprocess(monkeypatch):
+    monkeypatch.delenv("OMP_THREAD_LIMIT", raising=False)
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append((args, kwargs))
+        return subprocess.CompletedProcess(args, 0, stdout="识别结果".encode("utf-8"), stderr=b"")
+
+    monkeypatch.setattr(ocr.subprocess, "run", run)
+    pool = ocr.OCRPool({"document_processor": {"ocr": {"language": "chi_sim", "dpi": 300, "threads": 2}}})
+    result = pool.recognize(Image.new("RGB", (8, 8), "white"))
+
+    assert result["text"] == "识别结果"
+    assert "OMP_THREAD_LIMIT" not in os.environ
+    [(args, kwargs)] = calls
+    assert args[1:] == ["stdin", "stdout", "-l", "chi_sim", "--dpi", "300"]
+    assert kwargs["env"]["OMP_THREAD_LIMIT"] == "2"
+    pool.shutdown()
@@ -0,0 +1,64 @@
+import io
+
+import fitz
+import numpy as np
+from PIL import Image
+
+from src.document_processor.images import ImageFilter
+from src.document_processor.ocr import image_hash
+from src.document_processor.pdf_engine import PDFPageEngine
+
+
+def _png(seed: int) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (128, 128, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_repeated_iter_pages_returns_images(tmp_path):
+    logo = _png(0)
+    doc = fitz.open()
+    for page_no in range(12):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"page {page_no}")
+        # 每页都有的logo，以及每4页一张的插图
+        page.insert_image(fitz.Rect(100, 100, 300, 300), stream=logo)
+        if page_no % 4 == 0:
+            page.insert_image(fitz.Rect(100, 350, 300, 550), stream=_png(page_no + 1))
+    path = str(tmp_path / "doc.pdf")
+    doc.save(path)
+
+    config = {"document_processor": {
+        "pdf": {"workers": 2, "parallel_min_pages": 4, "pages_per_task": 3},
+        "ocr": {"enabled": False, "dpi": 200}
+    }}
+    engine = PDFPageEngine(config)
+    options = ImageFilter(config).options()
+    try:
+        runs = [
+            [image.name for page in engine.iter_pages(path, image_options=options)
+             for image in page["embedded_images"]]
+            for _ in range(2)
+        ]
+    finally:
+        engine.shutdown()
+
+    assert len(runs[0]) == 4
+    assert len(set(runs[0])) == 4
+    assert runs[1] == runs[0]
+
+
+def test_rendered_page_hash_matches_ocr_cache_key(tmp_path):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "scan")
+    path = str(tmp_path / "scan.pdf")
+    doc.save(path)
+
+    config = {"document_processor": {
+        "pdf": {"workers": 1, "render": "all", "dpi": 72},
+        "ocr": {"enabled": False, "dpi": 200}
+    }}
+    page = next(PDFPageEngine(config).iter_pages(path))
+    # PDF页走渲染结果的哈希，perform_ocr 走PIL图像的哈希，两者须命中同一缓存项
+    assert page["image_hash"] == image_hash(page["image"])
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from src.vector_store import persistence
+from src.vector_store.store import VectorStore
+
+
+def _store(path: str, **settings) -> VectorStore:
+    store = VectorStore({"vector_store": {
+        "dimension": 8, "index_type": "L2", "nlist": 0, "nprobe": 1, "persist_dir": path, **settings
+    }})
+
+    def encode(texts):
+        return np.stack([np.random.default_rng(len(t)).normal(size=8) for t in texts]).astype(np.float32)
+
+    store._encode_texts = store._encode_queries = encode
+    return store
+
+
+def _sources(store: VectorStore):
+    return sorted(doc["source"] for doc in store.list_documents()["documents"])
+
+
+def test_saved_segments_and_deletes_survive_reload(tmp_path):
+    store = _store(str(tmp_path))
+    store.upsert_document({"source": "a.txt", "text": "甲"})
+    store.save(str(tmp_path))
+    store.upsert_document({"source": "b.txt", "text": "乙乙"})
+    store.delete_document("a.txt")
+    store.save(str(tmp_path))
+
+    loaded = _store(str(tmp_path))
+    loaded.load(str(tmp_path))
+    assert _sources(loaded) == ["b.txt"]
+    assert [hit["metadata"]["source"] for hit in loaded.search("乙乙", top_k=5, mode="dense")] == ["b.txt"]
+    assert loaded.search("甲", top_k=5, mode="sparse") == []
+
+
+def test_crash_before_manifest_swap_keeps_the_previous_snapshot(tmp_path, monkeypatch):
+    store = _store(str(tmp_path))
+    store.upsert_document({"source": "a.txt", "text": "甲"})
+    store.save(str(tmp_path))
+
+    store.upsert_document({"source": "b.txt", "text": "乙乙"})
+    store.delete_document("a.txt")
+
+    def crash(self, manifest):
+        raise OSError("crash")
+
+    monkeypatch.setattr(persistence.SegmentStore, "_swap_manifest", crash)
+    with pytest.raises(OSError):
+        store.save(str(tmp_path))
+    monkeypatch.undo()
+
+    # 新分段和元数据已写入，但旧manifest不引用它们
+    loaded = _store(str(tmp_path))
+    loaded.load(str(tmp_path))
+    assert loaded.generation == 1
+    assert _sources(loaded) == ["a.txt"]
+    assert [hit["metadata"]["source"] for hit in loaded.search("甲", top_k=5, mode="sparse")] == ["a.txt"]
+
+
+def test_compaction_drops_deleted_vectors(tmp_path):
+    store = _store(str(tmp_path))
+    store.chunker.chunk_size = 4
+    store.upsert_document({"source": "a.txt", "text": "甲\n\n乙乙"})
+    store.upsert_document({"source": "b.txt", "text": "丙丙丙"})
+    store.save(str(tmp_path))
+    store.delete_document("a.txt")
+    store.compact()
+
+    loaded = _store(str(tmp_path))
+    loaded.load(str(tmp_path))
+    assert sum(segment.count for segment in loaded._segments) == 1
+    assert not loaded._deleted
+    assert _sources(loaded) == ["b.txt"]
+
+
+def test_read_only_replica_follows_new_snapshots(tmp_path):
+    writer = _store(str(tmp_path))
+    writer.upsert_document({"source": "a.txt", "text": "甲"})
+    writer.save(str(tmp_path))
+
+    replica = _store(str(tmp_path))
+    replica.load(str(tmp_path), read_only=True)
+    assert replica.refresh() is False
+
+    writer.upsert_document({"source": "b.txt", "text": "乙乙"})
+    writer.save(str(tmp_path))
+    assert replica.refresh() is True
+    assert _sources(replica) == ["a.txt", "b.txt"]
+    with pytest.raises(ValueError):
+        replica.save(str(tmp_path))
@@ -0,0 +1,49 @@
+import asyncio
+
+from src.llm.qa import LLMQA
+
+
+def _config(primary_error_rate: float) -> dict:
+    stub = {"type": "stub", "latency": 0.01, "ttft": 0.005, "jitter": 0}
+    return {"llm": {
+        "default_model": "primary",
+        "temperature": 0.1,
+        "max_tokens": 64,
+        "gateway": {
+            "order": ["primary", "backup"],
+            "backoff": 0.0,
+            "max_retries": 0,
+            "providers": {
+                "primary": {**stub, "answer": "primary answer", "error_rate": primary_error_rate},
+                "backup": {**stub, "answer": "backup answer"}
+            }
+        }
+    }}
+
+
+CONTEXT = [{"id": 1, "score": 1.0, "metadata": {"text": "参考内容", "source": "a.pdf"}}]
+
+
+def test_fallback_answer_is_not_cached_under_the_default_model():
+    qa = LLMQA(_config(primary_error_rate=1.0))
+    first = asyncio.run(qa.agenerate_answer("问题", CONTEXT))
+    assert first["model"] == "backup"
+
+    # 默认模型恢复后应由它作答，而不是命中备用模型的缓存
+    qa.gateway.providers["primary"].error_rate = 0.0
+    qa.gateway.providers["primary"].cooldown_until = 0.0
+    second = asyncio.run(qa.agenerate_answer("问题", CONTEXT))
+    assert second == {"answer": "primary answer", "model": "primary"}
+    assert qa.cache_stats()["answer"]["size"] == 1
+
+
+def test_streamed_fallback_answer_is_not_cached():
+    qa = LLMQA(_config(primary_error_rate=1.0))
+
+    async def stream():
+        info = {}
+        parts = [text async for text in qa.astream_answer("问题", CONTEXT, info)]
+        return "".join(parts), info["model"]
+
+    assert asyncio.run(stream()) == ("backup answer", "backup")
+    assert qa.cache_stats()["answer"]["size"] == 0
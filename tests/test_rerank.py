@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+
+from src.models.registry import ModelRegistry
+from src.vector_store import rerank
+
+
+class _CrossEncoder:
+    """按文本中的数字打分，每批耗时 delay 秒"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.batches = 0
+
+    def score(self, pairs):
+        self.batches += 1
+        time.sleep(self.delay)
+        return np.array([float(text) for _, text in pairs])
+
+
+def _reranker(monkeypatch, model: _CrossEncoder, **settings) -> rerank.Reranker:
+    monkeypatch.setattr(rerank, "create_cross_encoder", lambda config: model)
+    return rerank.Reranker({"vector_store": {"rerank": {
+        "enabled": True, "batch_size": 2, "min_keep": 1, **settings
+    }}}, registry=ModelRegistry())
+
+
+def _hits(*scores: float):
+    return [{"id": i, "score": 1.0 - i / 10, "metadata": {"text": str(score)}} for i, score in enumerate(scores)]
+
+
+def test_rerank_orders_by_cross_encoder_score(monkeypatch):
+    reranker = _reranker(monkeypatch, _CrossEncoder())
+    hits = _hits(0.1, 0.9, 0.5)
+    results, stats = reranker.rerank("问题", hits, top_k=2)
+
+    assert [hit["id"] for hit in results] == [1, 2]
+    assert results[0]["retrieval_score"] == 0.9 and results[0]["score"] == 0.9
+    assert stats["scored"] == 3 and not stats["budget_exhausted"]
+    # 不修改传入的（可能来自缓存的）结果
+    assert hits[1]["score"] == 0.9 and "retrieval_score" not in hits[1]
+
+
+def test_budget_stops_scoring_and_keeps_unscored_candidates_below(monkeypatch):
+    model = _CrossEncoder(delay=0.05)
+    reranker = _reranker(monkeypatch, model, budget_ms=60)
+    results, stats = reranker.rerank("问题", _hits(0.2, 0.1, 0.9, 0.8, 0.7), top_k=5)
+
+    assert model.batches == 1
+    assert stats["budget_exhausted"] and stats["scored"] == 2
+    # 未打分的候选按检索名次排在后面，分数不高于已打分的结果
+    assert [hit["id"] for hit in results] == [0, 1, 2, 3, 4]
+    assert [hit["rerank_score"] for hit in results[2:]] == [None, None, None]
+    assert all(hit["score"] <= 0.1 for hit in results[2:])
+
+
+def test_min_score_cuts_weak_results_but_keeps_min_keep(monkeypatch):
+    reranker = _reranker(monkeypatch, _CrossEncoder(), min_score=0.5)
+    results, _ = reranker.rerank("问题", _hits(0.9, 0.2, 0.6), top_k=5)
+    assert [hit["id"] for hit in results] == [0, 2]
+
+    results, _ = reranker.rerank("问题", _hits(0.1, 0.3), top_k=5)
+    assert [hit["id"] for hit in results] == [1]
@@ -0,0 +1,52 @@
+import pytest
+
+from src.vector_store.sparse import BM25Index, Tokenizer, fuse_results
+
+
+def _index(texts) -> BM25Index:
+    index = BM25Index({"vector_store": {}})
+    index.add(range(len(texts)), texts)
+    return index
+
+
+def test_tokenizer_keeps_codes_whole_and_adds_cjk_bigrams():
+    assert Tokenizer()("型号 A-100.5 电池") == ["型", "号", "型号", "a-100.5", "电", "池", "电池"]
+
+
+def test_bm25_ranks_matching_chunks_and_counts_exact_matches():
+    index = _index(["锂电池 容量 5000", "电池 安全规范", "发动机 维修"])
+    hits, exact = index.search("锂电池", top_k=5)
+
+    assert [idx for idx, _ in hits] == [0, 1]
+    assert exact == 1
+    assert index.search("不存在", top_k=5) == ([], 0)
+
+
+def test_removed_chunks_disappear_before_and_after_compaction():
+    index = _index(["电池", "电池 容量", "容量"])
+    index.remove([0])
+    assert len(index) == 2
+    assert [idx for idx, _ in index.search("电池", 5)[0]] == [1]
+
+    index.compact()
+    assert [idx for idx, _ in index.search("电池", 5)[0]] == [1]
+    # 已删除的id重新加入时按新文本索引
+    index.add([0], ["发动机"])
+    assert [idx for idx, _ in index.search("发动机", 5)[0]] == [0]
+
+
+def test_rrf_fusion_rewards_chunks_found_by_both_legs():
+    fused = fuse_results([(1, 0.9), (2, 0.8)], [(2, 7.0), (3, 6.0)], top_k=3)
+
+    assert [idx for idx, *_ in fused] == [2, 1, 3]
+    assert fused[0][2:] == (0.8, 7.0)
+    assert fused[1][3] is None
+
+
+def test_weighted_fusion_normalizes_each_leg():
+    fused = fuse_results([(1, 0.9), (2, 0.1)], [(2, 10.0), (3, 0.0)], top_k=2,
+                         method="weighted", dense_weight=1.0, sparse_weight=2.0)
+    assert [(idx, round(score, 3)) for idx, score, *_ in fused] == [(2, 2.0), (1, 1.0)]
+
+    with pytest.raises(ValueError):
+        fuse_results([(1, 0.9)], [], top_k=1, method="max")
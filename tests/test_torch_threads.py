@@ -0,0 +1,32 @@
+import sys
+import types
+
+from src.vector_store.encoders import create_encoder, set_torch_threads
+from src.vector_store.rerank import create_cross_encoder
+
+
+def _fake_modules(monkeypatch):
+    """替换 torch 和 sentence_transformers，记录线程数设置"""
+    calls = []
+    torch = types.ModuleType("torch")
+    torch.set_num_threads = calls.append
+    models = types.ModuleType("sentence_transformers")
+    models.SentenceTransformer = lambda name, device=None: object()
+    models.CrossEncoder = lambda name, device=None, max_length=None: object()
+    monkeypatch.setitem(sys.modules, "torch", torch)
+    monkeypatch.setitem(sys.modules, "sentence_transformers", models)
+    return calls
+
+
+def test_model_constructors_leave_torch_threads_alone(monkeypatch):
+    calls = _fake_modules(monkeypatch)
+    create_encoder({"vector_store": {"encoder": {"backend": "torch", "threads": 8}}})
+    create_cross_encoder({"backend": "torch", "threads": 4})
+    assert calls == []
+
+
+def test_torch_threads_come_from_the_serving_setting(monkeypatch):
+    calls = _fake_modules(monkeypatch)
+    set_torch_threads({"serving": {"torch_threads": 6}})
+    set_torch_threads({})
+    assert calls == [6]
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import numpy as np
+
+from src.vector_store.store import VectorStore
+
+
+def _store(monkeypatch, delay: float = 0.0):
+    store = VectorStore({"vector_store": {"dimension": 8, "index_type": "L2", "nlist": 0, "nprobe": 1}})
+    encoded = []
+
+    def encode(texts):
+        # 模拟编码耗时，让并发导入在锁外交错
+        time.sleep(delay)
+        encoded.extend(texts)
+        return np.stack([np.random.default_rng(len(t)).normal(size=8) for t in texts]).astype(np.float32)
+
+    monkeypatch.setattr(store, "_encode_texts", encode)
+    return store, encoded
+
+
+def _document(*paragraphs: str) -> dict:
+    return {"source": "a.txt", "text": "\n\n".join(paragraphs)}
+
+
+def test_upsert_reuses_unchanged_chunks_and_deletes_removed_ones(monkeypatch):
+    store, encoded = _store(monkeypatch)
+    store.chunker.chunk_size = 4
+    assert store.upsert_document(_document("第一段", "第二段"), content_hash="v1") == 2
+
+    # 内容哈希不变时跳过
+    assert store.upsert_document(_document("第一段", "第二段"), content_hash="v1") == 0
+
+    assert store.upsert_document(_document("第一段", "第三段"), content_hash="v2") == 1
+    texts = sorted(row["text"] for row in store.iter_metadata())
+    assert texts == ["第一段", "第三段"]
+    # 未变化的“第一段”不再编码
+    assert encoded.count("第一段") == 1
+
+
+def test_delete_document_removes_every_chunk(monkeypatch):
+    store, _ = _store(monkeypatch)
+    store.chunker.chunk_size = 4
+    store.upsert_document(_document("第一段", "第二段"))
+    assert store.delete_document("a.txt") == 2
+    assert store.list_documents()["total"] == 0
+    assert store.search("第一段", top_k=5, mode="sparse") == []
+
+
+def test_concurrent_upserts_of_one_source_do_not_duplicate_chunks(monkeypatch):
+    store, _ = _store(monkeypatch, delay=0.05)
+    store.chunker.chunk_size = 4
+    threads = [
+        threading.Thread(target=store.upsert_document, args=(_document("第一段", f"版本{i}"),))
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    [doc] = store.list_documents()["documents"]
+    assert doc["chunks"] == 2
+    assert not store._source_locks